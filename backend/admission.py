@@ -0,0 +1,147 @@
+# Admission control: per route class concurrency limits with bounded queues.
+# Requests that find the queue full (or wait longer than the queue timeout)
+# get an immediate 503 with Retry-After instead of slowing every route down.
+import asyncio
+import json
+import os
+import re
+
+READ_METHODS = {"GET", "HEAD"}
+
+# (class, method or None for any, path regex). First match wins; requests that
+# match no rule are "write" for mutating methods and "read" otherwise.
+ROUTE_RULES = [
+    ("exempt", None, re.compile(r"^/health/")),
+    ("exempt", "GET", re.compile(r"^/api/admin/metrics$")),
+    ("heavy", None, re.compile(r"^/api/invoices/[^/]+/(export-pdf|upload-image|images/)")),
+    # Long streamed bodies hold their slot until the stream ends, so they get
+    # their own class and cannot starve invoice images/PDFs
+    ("stream", "GET", re.compile(r"^/api/bookings/export$")),
+    ("stream", "GET", re.compile(r"^/api/admin/invoices/")),
+    ("stream", "GET", re.compile(r"^/api/statements/")),
+    ("stream", "POST", re.compile(r"^/api/logs/bulk$")),
+    ("auth", "POST", re.compile(r"^/api/auth/(login|register)$")),
+]
+
+DEFAULT_LIMITS = {
+    # class: (concurrency, queue size)
+    "read": (256, 512),
+    "write": (64, 256),
+    "auth": (8, 32),
+    "heavy": (4, 16),
+    "stream": (4, 8),
+}
+
+def classify(method: str, path: str) -> str:
+    if method == "OPTIONS":
+        return "exempt"
+    for route_class, rule_method, pattern in ROUTE_RULES:
+        if (rule_method is None or rule_method == method) and pattern.match(path):
+            return route_class
+    return "read" if method in READ_METHODS else "write"
+
+
+class RouteClassLimiter:
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.active < self.concurrency and not self.waiting:
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    def __init__(self):
+        self.queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+        self.retry_after = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+        self.limiters = {}
+        for name, (concurrency, queue_size) in DEFAULT_LIMITS.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            self.limiters[name] = RouteClassLimiter(
+                name,
+                int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency)),
+                int(os.environ.get(f"{prefix}_QUEUE", queue_size)),
+            )
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_timeout_seconds": self.queue_timeout,
+            "retry_after_seconds": self.retry_after,
+            "classes": {name: limiter.snapshot() for name, limiter in self.limiters.items()},
+        }
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope["method"], scope["path"])
+        limiter = self.controller.limiters.get(route_class)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire(self.controller.queue_timeout):
+            await self._reject(send, route_class)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _reject(self, send, route_class: str):
+        body = json.dumps({"detail": "Server busy, retry later", "route_class": route_class}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.controller.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,171 @@
+# Storage codec for booking documents.
+#
+# The API shape is unchanged; only what is stored differs:
+#   - money (subtotal, total_price): integer cents instead of float dollars
+#   - created_at / updated_at: BSON datetimes instead of ISO strings
+#   - preferred_date: BSON datetime at midnight UTC instead of "YYYY-MM-DD"
+#   - status / fuel_type: small integer codes instead of strings
+# Range filters and sorts on these fields compare native values, and their
+# index keys shrink (8-byte dates and small ints instead of 10-32 character
+# strings).
+#
+# Documents are encoded on every write (encode_booking also accepts partial
+# $set payloads) and decoded on every read. Decoding looks at the stored
+# BSON type, so documents written before the codec still read correctly;
+# queries only match encoded documents, so run
+# `python manage.py migrate` after deploying.
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Optional
+
+# Codes are assigned in alphabetical order, so sorting by code sorts by name
+STATUS_CODES = {"cancelled": 0, "confirmed": 1, "delivered": 2, "in_transit": 3, "pending": 4}
+FUEL_TYPE_CODES = {"diesel": 0, "gasoline": 1}
+ENUM_FIELDS = {"status": STATUS_CODES, "fuel_type": FUEL_TYPE_CODES}
+ENUM_NAMES = {field: {code: name for name, code in codes.items()} for field, codes in ENUM_FIELDS.items()}
+
+MONEY_FIELDS = ("subtotal", "total_price")
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+DAY_FIELDS = ("preferred_date",)
+
+
+def encode_enum(field: str, value):
+    # Values without a code (free-form legacy strings) are stored as is
+    return ENUM_FIELDS[field].get(value, value)
+
+def encode_enums(field: str, values: Iterable) -> list:
+    return [encode_enum(field, value) for value in values]
+
+def encode_money(value):
+    if isinstance(value, float):
+        return round(value * 100)
+    return value
+
+def decode_money(value):
+    # Legacy documents hold float dollars, encoded ones integer cents
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value / 100
+    return value
+
+def encode_timestamp(value):
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
+    return value
+
+def decode_timestamp(value):
+    # BSON datetimes have millisecond precision and come back naive (UTC)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+def day_start(day: str) -> datetime:
+    return datetime.combine(date.fromisoformat(day[:10]), time(), tzinfo=timezone.utc)
+
+def encode_day(value):
+    if isinstance(value, str):
+        try:
+            return day_start(value)
+        except ValueError:
+            return value
+    return value
+
+def decode_day(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return value
+
+def encode_booking(doc: dict) -> dict:
+    encoded = dict(doc)
+    for field in ENUM_FIELDS:
+        if field in encoded:
+            encoded[field] = encode_enum(field, encoded[field])
+    for field in MONEY_FIELDS:
+        if field in encoded:
+            encoded[field] = encode_money(encoded[field])
+    for field in TIMESTAMP_FIELDS:
+        if field in encoded:
+            encoded[field] = encode_timestamp(encoded[field])
+    for field in DAY_FIELDS:
+        if field in encoded:
+            encoded[field] = encode_day(encoded[field])
+    return encoded
+
+def decode_booking(doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    decoded = dict(doc)
+    for field, names in ENUM_NAMES.items():
+        if field in decoded:
+            decoded[field] = names.get(decoded[field], decoded[field])
+    for field in MONEY_FIELDS:
+        if field in decoded:
+            decoded[field] = decode_money(decoded[field])
+    for field in TIMESTAMP_FIELDS:
+        if field in decoded:
+            decoded[field] = decode_timestamp(decoded[field])
+    for field in DAY_FIELDS:
+        if field in decoded:
+            decoded[field] = decode_day(decoded[field])
+    return decoded
+
+async def decode_stream(cursor):
+    async for doc in cursor:
+        yield decode_booking(doc)
+
+def day_range(first: Optional[str], last: Optional[str]) -> dict:
+    # Inclusive of the whole last day
+    bounds = {}
+    if first is not None:
+        bounds['$gte'] = day_start(first)
+    if last is not None:
+        bounds['$lt'] = day_start(last) + timedelta(days=1)
+    return bounds
+
+
+# Aggregation expressions producing the decoded value of a stored field
+def money_expr(field: str) -> dict:
+    return {"$cond": [
+        {"$in": [{"$type": f"${field}"}, ["int", "long"]]},
+        {"$divide": [f"${field}", 100]},
+        f"${field}",
+    ]}
+
+def enum_name_expr(field: str) -> dict:
+    return {"$switch": {
+        "branches": [{"case": {"$eq": [f"${field}", code]}, "then": name} for code, name in ENUM_NAMES[field].items()],
+        "default": f"${field}",
+    }}
+
+def day_expr(field: str) -> dict:
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "date"]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": f"${field}"}},
+        {"$substrCP": [f"${field}", 0, 10]},
+    ]}
+
+
+# Documents with at least one field still in its pre-codec representation
+LEGACY_QUERY = {"$or": [
+    {"status": {"$type": "string"}},
+    {"fuel_type": {"$type": "string"}},
+    {"subtotal": {"$type": "double"}},
+    {"total_price": {"$type": "double"}},
+    {"created_at": {"$type": "string"}},
+    {"updated_at": {"$type": "string"}},
+    {"preferred_date": {"$type": "string"}},
+]}
+CODEC_FIELDS = tuple(ENUM_FIELDS) + MONEY_FIELDS + TIMESTAMP_FIELDS + DAY_FIELDS
+
+def storage_rewrite(doc: dict) -> Optional[tuple]:
+    # Migration 3 (see migrations.py): guarded on the legacy values, so a
+    # booking written meanwhile (already encoded) is not overwritten
+    current = {field: doc[field] for field in CODEC_FIELDS if field in doc}
+    changes = {field: value for field, value in encode_booking(current).items() if value != current[field]}
+    if not changes:
+        # e.g. a status without a code
+        return None
+    return {field: current[field] for field in changes}, {"$set": changes}
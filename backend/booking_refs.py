@@ -0,0 +1,87 @@
+# Tank / equipment references on bookings.
+#
+# Bookings keep only a minimal snapshot of each selected tank and piece of
+# equipment (what an invoice shows: id, name, identifier / unit number and
+# plate) instead of a copy of the whole document. Read endpoints accept
+# `?expand=tanks,equipment`, which replaces the snapshots by the current
+# documents with one batched $in query per collection for the whole page.
+from typing import Optional
+
+TANK_SNAPSHOT_FIELDS = ("id", "name", "identifier")
+EQUIPMENT_SNAPSHOT_FIELDS = ("id", "name", "unit_number", "license_plate")
+LOCATION_FIELDS = ("location_id", "location_name", "address", "items")
+LOCATION_ITEM_FIELDS = ("id", "type", "name", "quantity")
+
+# expand option -> (booking field, collection)
+EXPANDABLE = {
+    "tanks": ("selected_tanks", "fuel_tanks"),
+    "equipment": ("selected_equipment", "customer_equipment"),
+}
+
+
+def snapshot(doc: dict, fields: tuple) -> dict:
+    return {field: doc[field] for field in fields if doc.get(field) is not None}
+
+def compact_delivery_locations(locations: Optional[list]) -> Optional[list]:
+    if not locations:
+        return locations
+    compacted = []
+    for location in locations:
+        entry = snapshot(location, LOCATION_FIELDS)
+        if "items" in entry:
+            entry['items'] = [snapshot(item, LOCATION_ITEM_FIELDS) for item in entry['items']]
+        compacted.append(entry)
+    return compacted
+
+def compact_references(booking: dict) -> dict:
+    # The reference fields present on `booking`, reduced to their snapshots
+    compacted = {}
+    if booking.get('selected_tanks') is not None:
+        compacted['selected_tanks'] = [snapshot(t, TANK_SNAPSHOT_FIELDS) for t in booking['selected_tanks']]
+    if booking.get('selected_equipment') is not None:
+        compacted['selected_equipment'] = [snapshot(e, EQUIPMENT_SNAPSHOT_FIELDS) for e in booking['selected_equipment']]
+    if booking.get('delivery_locations') is not None:
+        compacted['delivery_locations'] = compact_delivery_locations(booking['delivery_locations'])
+    return compacted
+
+def parse_expand(expand: Optional[str]) -> set:
+    options = {option.strip() for option in expand.split(",") if option.strip()} if expand else set()
+    unknown = options - EXPANDABLE.keys()
+    if unknown:
+        raise ValueError(f"expand accepts {', '.join(EXPANDABLE)}")
+    return options
+
+async def expand_references(db, bookings: list, options: set, projection: dict) -> list:
+    # Referenced documents that no longer exist keep their snapshot
+    if not options or not bookings:
+        return bookings
+    expanded = [dict(booking) for booking in bookings]
+    for option in options:
+        field, collection = EXPANDABLE[option]
+        ids = {ref['id'] for booking in expanded for ref in booking.get(field) or [] if ref.get('id')}
+        if not ids:
+            continue
+        docs = {}
+        async for doc in db[collection].find({"id": {"$in": list(ids)}}, projection):
+            docs[doc['id']] = doc
+        for booking in expanded:
+            if booking.get(field):
+                booking[field] = [{**ref, **docs.get(ref.get('id'), {})} for ref in booking[field]]
+    return expanded
+
+COMPACT_QUERY = {"$or": [
+    {"selected_tanks.0": {"$exists": True}},
+    {"selected_equipment.0": {"$exists": True}},
+    {"delivery_locations.0": {"$exists": True}},
+]}
+COMPACT_FIELDS = ("selected_tanks", "selected_equipment", "delivery_locations")
+
+def compact_rewrite(booking: dict) -> Optional[tuple]:
+    # Migration 2 (see migrations.py): bookings created with full embedded
+    # copies; guarded on the old values so a booking changed meanwhile is left
+    # for the next run.
+    compacted = compact_references(booking)
+    original = {field: booking[field] for field in compacted}
+    if original == compacted:
+        return None
+    return original, {"$set": compacted}
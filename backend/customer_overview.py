@@ -0,0 +1,111 @@
+# Admin customer overview: each customer with booking, tank and equipment
+# counts and lifetime delivered liters/revenue, joined in one aggregation.
+#
+# Every join is a `$lookup` on the joined collection's indexed `user_id`
+# (bookings.user_created, fuel_tanks.user, customer_equipment.user) that
+# reduces the customer's documents to a single row inside the lookup, so no
+# booking/tank/equipment documents leave the server. When the sort column is
+# a field of the user document, the page is cut before the joins and only
+# page_size customers are joined; sorting by a computed column has to join
+# every customer first.
+from booking_codec import STATUS_CODES, decode_timestamp, money_expr
+
+USER_SORT_FIELDS = ("name", "email", "created_at")
+COMPUTED_SORT_FIELDS = (
+    "bookings", "open_bookings", "delivered_bookings", "lifetime_liters", "lifetime_revenue",
+    "last_booking_at", "tanks", "equipment", "delivery_sites",
+)
+OVERVIEW_SORT_FIELDS = USER_SORT_FIELDS + COMPUTED_SORT_FIELDS
+OPEN_STATUSES = ("pending", "confirmed", "in_transit")
+
+# Inclusion projection, so password / typeahead keys never enter the pipeline
+CUSTOMER_FIELDS = {
+    "_id": 0, "id": 1, "email": 1, "name": 1, "price_modifier": 1, "created_at": 1,
+    "delivery_sites": {"$size": {"$ifNull": ["$delivery_sites", []]}},
+}
+
+
+def _count_if(condition: dict) -> dict:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+def _first(path: str) -> dict:
+    return {"$first": f"${path}"}
+
+def booking_stats_lookup() -> dict:
+    delivered = {"$eq": ["$status", STATUS_CODES["delivered"]]}
+    return {"$lookup": {
+        "from": "bookings",
+        "localField": "id",
+        "foreignField": "user_id",
+        "pipeline": [
+            {"$group": {
+                "_id": None,
+                "bookings": {"$sum": 1},
+                "open_bookings": _count_if({"$in": ["$status", [STATUS_CODES[s] for s in OPEN_STATUSES]]}),
+                "delivered_bookings": _count_if(delivered),
+                # Same liters as the rollups: dispensed amount when recorded
+                "lifetime_liters": {"$sum": {"$cond": [
+                    delivered, {"$ifNull": ["$dispensed_amount", "$fuel_quantity_liters"]}, 0,
+                ]}},
+                "lifetime_revenue": {"$sum": {"$cond": [delivered, money_expr("total_price"), 0]}},
+                "last_booking_at": {"$max": "$created_at"},
+            }},
+        ],
+        "as": "booking_stats",
+    }}
+
+def count_lookup(collection: str, field: str) -> dict:
+    return {"$lookup": {
+        "from": collection,
+        "localField": "id",
+        "foreignField": "user_id",
+        "pipeline": [{"$count": "n"}],
+        "as": field,
+    }}
+
+def overview_joins() -> list:
+    # A lookup yields [] for a customer without documents
+    return [
+        booking_stats_lookup(),
+        count_lookup("fuel_tanks", "tanks"),
+        count_lookup("customer_equipment", "equipment"),
+        {"$set": {
+            **{field: {"$ifNull": [_first(f"booking_stats.{field}"), 0]} for field in (
+                "bookings", "open_bookings", "delivered_bookings", "lifetime_liters", "lifetime_revenue",
+            )},
+            "last_booking_at": _first("booking_stats.last_booking_at"),
+            "tanks": {"$ifNull": [_first("tanks.n"), 0]},
+            "equipment": {"$ifNull": [_first("equipment.n"), 0]},
+        }},
+        {"$project": {"booking_stats": 0}},
+    ]
+
+def overview_pipeline(sort: str, direction: int, skip: int, limit: int) -> list:
+    # Raises ValueError for an unknown sort column
+    if sort not in OVERVIEW_SORT_FIELDS:
+        raise ValueError(f"sort must be one of {sorted(OVERVIEW_SORT_FIELDS)}")
+    # id breaks ties so pages do not overlap
+    page = [{"$sort": {sort: direction, "id": direction}}, {"$skip": skip}, {"$limit": limit}]
+    head = [{"$match": {"role": "customer"}}, {"$project": CUSTOMER_FIELDS}]
+    if sort in USER_SORT_FIELDS:
+        return head + page + overview_joins()
+    return head + overview_joins() + page
+
+def overview_row(doc: dict) -> dict:
+    return {
+        **doc,
+        "lifetime_liters": round(doc['lifetime_liters'], 3),
+        "lifetime_revenue": round(doc['lifetime_revenue'], 2),
+        "last_booking_at": decode_timestamp(doc.get('last_booking_at')),
+    }
+
+async def customer_overview(db, sort: str, direction: int, page: int, page_size: int) -> dict:
+    pipeline = overview_pipeline(sort, direction, (page - 1) * page_size, page_size)
+    cursor = db.users.aggregate(pipeline, allowDiskUse=True)
+    items = [overview_row(doc) async for doc in cursor]
+    return {
+        "items": items,
+        "page": page,
+        "page_size": page_size,
+        "total": await db.users.count_documents({"role": "customer"}),
+    }
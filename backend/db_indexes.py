@@ -0,0 +1,97 @@
+# Index definitions, created by the lifespan handler in server.py on startup.
+# create_indexes is a no-op for indexes that already exist with the same spec.
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("role", ASCENDING)], name="role"),
+        # Typeahead prefix keys (see typeahead.py)
+        IndexModel([("search_terms", ASCENDING)], name="search_terms"),
+        IndexModel([("site_search_terms", ASCENDING)], name="site_search_terms"),
+    ],
+    "bookings": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+        IndexModel([("created_at", DESCENDING)], name="created"),
+        # Search: equality field first, then the sort/range field
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created"),
+        IndexModel([("status", ASCENDING), ("preferred_date", ASCENDING)], name="status_preferred_date"),
+        IndexModel([("fuel_type", ASCENDING), ("created_at", DESCENDING)], name="fuel_type_created"),
+        IndexModel([("user_id", ASCENDING), ("preferred_date", ASCENDING)], name="user_preferred_date"),
+        IndexModel([("preferred_date", ASCENDING)], name="preferred_date"),
+    ],
+    "delivery_logs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("booking_id", ASCENDING), ("created_at", DESCENDING)], name="booking_created"),
+        # Dedupe key for bulk uploads (see log_ingest.py)
+        IndexModel(
+            [("client_log_id", ASCENDING)], unique=True, name="client_log_id_unique",
+            partialFilterExpression={"client_log_id": {"$type": "string"}},
+        ),
+        IndexModel([("created_at", DESCENDING)], name="created"),
+    ],
+    "dispatch_plans": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("date", ASCENDING), ("status", ASCENDING)], name="date_status"),
+    ],
+    "migrations": [
+        IndexModel([("number", ASCENDING)], unique=True, name="number_unique"),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Claim query: type + status, oldest run_at first
+        IndexModel([("type", ASCENDING), ("status", ASCENDING), ("run_at", ASCENDING)], name="claim"),
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"),
+    ],
+    # Claimed keys of create requests (see idempotency.py)
+    "idempotency_keys": [
+        IndexModel([("user_id", ASCENDING), ("route", ASCENDING), ("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"),
+    ],
+    "pricing_versions": [
+        IndexModel([("version", ASCENDING)], unique=True, name="version_unique"),
+        # "Rates as of X": latest effective_from <= X
+        IndexModel([("effective_from", DESCENDING)], name="effective_from"),
+    ],
+    "booking_rollups": [
+        IndexModel([("day", ASCENDING)], name="day"),
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_day"),
+        IndexModel([("fuel_type", ASCENDING), ("day", ASCENDING)], name="fuel_type_day"),
+    ],
+    # Rebuilt by forecasting.py in a staging collection with these indexes
+    "tank_forecasts": [
+        IndexModel([("tank_id", ASCENDING)], unique=True, name="tank_id_unique"),
+        IndexModel([("next_refill_at", ASCENDING)], name="next_refill_at"),
+        IndexModel([("user_id", ASCENDING), ("next_refill_at", ASCENDING)], name="user_next_refill_at"),
+    ],
+    "fuel_tanks": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING)], name="user"),
+        IndexModel([("search_terms", ASCENDING)], name="search_terms"),
+    ],
+    "customer_equipment": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING)], name="user"),
+        IndexModel([("search_terms", ASCENDING)], name="search_terms"),
+    ],
+}
+
+async def ensure_indexes(db) -> dict:
+    # A failure on one collection (e.g. legacy duplicates) is logged and does
+    # not stop the worker from serving; the result is reported by readiness.
+    results = {}
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+            results[collection] = "ok"
+        except OperationFailure as e:
+            logger.error("Failed to create indexes on %s: %s", collection, e)
+            results[collection] = str(e)
+    return results
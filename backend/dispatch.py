@@ -0,0 +1,249 @@
+# Dispatch planning: pending/confirmed bookings for one day packed into truck
+# runs.
+#
+# Bookings are grouped by preferred_time window (DISPATCH_WINDOW_MINUTES) and
+# fuel type (a run carries one product), then by delivery site. The liters
+# to load are the booking's fuel_quantity_liters, capped by the total
+# capacity of its selected tanks/equipment when all of them have a known
+# capacity. Sites are packed whole into the first run with room; a site that
+# does not fit anywhere is packed stop by stop, and a booking larger than a
+# truck is split into legs. When sites have coordinates they are visited in
+# sweep order around the depot (DISPATCH_DEPOT_LAT/LON, or their centroid)
+# and only the newest run of a group is filled, so runs stay geographically
+# compact; sites without coordinates follow, largest first.
+#
+# The whole plan is computed in memory from four queries (bookings, tank and
+# equipment capacities, customers' sites). Committing stores it in
+# `dispatch_plans` and confirms every planned booking with one bulk_write.
+import math
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from booking_codec import day_range, decode_booking, encode_booking, encode_enums
+
+DISPATCH_PLANS = "dispatch_plans"
+DISPATCH_TRUCK_CAPACITY_LITERS = float(os.environ.get('DISPATCH_TRUCK_CAPACITY_LITERS', '30000'))
+DISPATCH_WINDOW_MINUTES = int(os.environ.get('DISPATCH_WINDOW_MINUTES', '120'))
+DISPATCH_MAX_BOOKINGS = int(os.environ.get('DISPATCH_MAX_BOOKINGS', '10000'))
+DISPATCH_DEPOT = (
+    (float(os.environ['DISPATCH_DEPOT_LAT']), float(os.environ['DISPATCH_DEPOT_LON']))
+    if os.environ.get('DISPATCH_DEPOT_LAT') and os.environ.get('DISPATCH_DEPOT_LON') else None
+)
+
+PLANNABLE_STATUSES = ("pending", "confirmed")
+BOOKING_FIELDS = (
+    "id", "user_id", "user_name", "delivery_address", "delivery_locations", "fuel_quantity_liters",
+    "fuel_type", "preferred_time", "selected_tanks", "selected_equipment",
+)
+PLAN_PROJECTION = {"_id": 0}
+
+
+def time_window(preferred_time: Optional[str], minutes: int) -> Optional[int]:
+    # Window index within the day; None when the time cannot be read
+    try:
+        hours, mins = (int(part) for part in (preferred_time or "").strip()[:5].split(":"))
+    except ValueError:
+        return None
+    if not (0 <= hours < 24 and 0 <= mins < 60):
+        return None
+    return (hours * 60 + mins) // minutes
+
+def window_label(window: Optional[int], minutes: int) -> str:
+    if window is None:
+        return "unscheduled"
+    start = window * minutes
+    end = min(start + minutes, 24 * 60)
+    return f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+
+def booking_site(booking: dict, sites: dict) -> dict:
+    # The booking's first saved site, or its delivery address
+    for location in booking.get('delivery_locations') or []:
+        site = sites.get(location.get('location_id'))
+        if site:
+            return {"key": site['id'], "site_id": site['id'], "name": site.get('name'), "address": site.get('address'),
+                    "lat": site.get('lat'), "lon": site.get('lon')}
+    address = booking.get('delivery_address') or ""
+    return {"key": "address:" + " ".join(address.lower().split()), "site_id": None, "name": None, "address": address,
+            "lat": None, "lon": None}
+
+def booking_load(booking: dict, capacities: dict) -> float:
+    liters = booking.get('fuel_quantity_liters') or 0.0
+    refs = [ref.get('id') for ref in (booking.get('selected_tanks') or []) + (booking.get('selected_equipment') or [])]
+    if refs and all(capacities.get(ref) for ref in refs):
+        return min(liters, sum(capacities[ref] for ref in refs))
+    return liters
+
+def sweep_order(sites: list, depot: Optional[tuple]) -> list:
+    located = [site for site in sites if site['lat'] is not None and site['lon'] is not None]
+    if not located:
+        return sorted(sites, key=lambda site: (-site['liters'], site['key']))
+    if depot is None:
+        depot = (sum(s['lat'] for s in located) / len(located), sum(s['lon'] for s in located) / len(located))
+    located.sort(key=lambda site: (math.atan2(site['lat'] - depot[0], site['lon'] - depot[1]), site['key']))
+    rest = sorted((site for site in sites if site['lat'] is None or site['lon'] is None),
+                  key=lambda site: (-site['liters'], site['key']))
+    return located + rest
+
+
+class RunBuilder:
+    def __init__(self, window: Optional[int], window_minutes: int, fuel_type: str, capacity: float):
+        self.window = window
+        self.window_minutes = window_minutes
+        self.fuel_type = fuel_type
+        self.capacity = capacity
+        self.runs = []
+
+    def _open(self) -> dict:
+        run = {
+            "run_id": str(uuid.uuid4()),
+            "window": window_label(self.window, self.window_minutes),
+            "fuel_type": self.fuel_type,
+            "capacity_liters": self.capacity,
+            "load_liters": 0.0,
+            "stops": [],
+        }
+        self.runs.append(run)
+        return run
+
+    @staticmethod
+    def _stop(run: dict, site: dict, booking: dict, liters: float, leg: Optional[str] = None):
+        stop = {
+            "booking_id": booking['id'],
+            "customer": booking.get('user_name'),
+            "site_id": site['site_id'],
+            "site_name": site['name'],
+            "address": site['address'],
+            "liters": round(liters, 3),
+        }
+        if leg:
+            stop['leg'] = leg
+        run['stops'].append(stop)
+        run['load_liters'] += liters
+
+    def add_site(self, site: dict, stops: list, compact: bool):
+        # stops: (booking, liters), largest first
+        candidates = self.runs[-1:] if compact else self.runs
+        run = next((r for r in candidates if r['load_liters'] + site['liters'] <= self.capacity), None)
+        if run is not None:
+            for booking, liters in stops:
+                self._stop(run, site, booking, liters)
+            return
+        for booking, liters in stops:
+            if liters > self.capacity:
+                legs = math.ceil(liters / self.capacity)
+                for leg in range(legs):
+                    part = min(self.capacity, liters - leg * self.capacity)
+                    self._stop(self._open(), site, booking, part, f"{leg + 1}/{legs}")
+                continue
+            candidates = self.runs[-1:] if compact else self.runs
+            run = next((r for r in candidates if r['load_liters'] + liters <= self.capacity), None) or self._open()
+            self._stop(run, site, booking, liters)
+
+
+def plan_runs(bookings: list, capacities: dict, sites: dict, capacity: float, window_minutes: int,
+              depot: Optional[tuple] = DISPATCH_DEPOT) -> list:
+    # (window, fuel type) -> site key -> site with its stops
+    groups = defaultdict(dict)
+    for booking in bookings:
+        liters = booking_load(booking, capacities)
+        if liters <= 0:
+            continue
+        site = booking_site(booking, sites)
+        group = groups[(time_window(booking.get('preferred_time'), window_minutes), booking.get('fuel_type'))]
+        entry = group.setdefault(site['key'], {**site, "liters": 0.0, "stops": []})
+        entry['liters'] += liters
+        entry['stops'].append((booking, liters))
+
+    runs = []
+    # Unscheduled bookings last
+    for (window, fuel_type) in sorted(groups, key=lambda g: (g[0] is None, g[0] or 0, g[1] or "")):
+        builder = RunBuilder(window, window_minutes, fuel_type, capacity)
+        for site in sweep_order(list(groups[(window, fuel_type)].values()), depot):
+            compact = site['lat'] is not None and site['lon'] is not None
+            builder.add_site(site, sorted(site['stops'], key=lambda stop: -stop[1]), compact)
+        runs.extend(builder.runs)
+    for run in runs:
+        run['load_liters'] = round(run['load_liters'], 3)
+        run['utilisation'] = round(run['load_liters'] / run['capacity_liters'], 4)
+    return runs
+
+
+async def load_plannable(db, day: str) -> list:
+    # Raises ValueError for a bad date or more than DISPATCH_MAX_BOOKINGS bookings
+    query = {
+        "preferred_date": day_range(day, day),
+        "status": {"$in": encode_enums('status', PLANNABLE_STATUSES)},
+    }
+    bookings = await db.bookings.find(query, {"_id": 0, **{f: 1 for f in BOOKING_FIELDS}}).to_list(DISPATCH_MAX_BOOKINGS + 1)
+    if len(bookings) > DISPATCH_MAX_BOOKINGS:
+        raise ValueError(f"More than {DISPATCH_MAX_BOOKINGS} bookings on {day}")
+    return [decode_booking(booking) for booking in bookings]
+
+async def load_capacities(db, bookings: list) -> dict:
+    capacities = {}
+    for field, collection in (("selected_tanks", "fuel_tanks"), ("selected_equipment", "customer_equipment")):
+        ids = list({ref['id'] for b in bookings for ref in b.get(field) or [] if ref.get('id')})
+        if ids:
+            async for doc in db[collection].find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "capacity": 1}):
+                capacities[doc['id']] = doc.get('capacity')
+    return capacities
+
+async def load_sites(db, bookings: list) -> dict:
+    user_ids = list({b['user_id'] for b in bookings if b.get('delivery_locations')})
+    sites = {}
+    if user_ids:
+        async for user in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "delivery_sites": 1}):
+            for site in user.get('delivery_sites') or []:
+                sites[site['id']] = site
+    return sites
+
+async def build_plan(db, day: str, capacity: float, window_minutes: int) -> dict:
+    bookings = await load_plannable(db, day)
+    runs = plan_runs(bookings, await load_capacities(db, bookings), await load_sites(db, bookings), capacity, window_minutes)
+    planned = {stop['booking_id'] for run in runs for stop in run['stops']}
+    return {
+        "id": str(uuid.uuid4()),
+        "date": day,
+        "truck_capacity_liters": capacity,
+        "window_minutes": window_minutes,
+        "bookings": len(planned),
+        "skipped_booking_ids": [b['id'] for b in bookings if b['id'] not in planned],
+        "total_liters": round(sum(run['load_liters'] for run in runs), 3),
+        "runs": runs,
+    }
+
+async def commit_plan(db, plan: dict, created_by: str) -> dict:
+    # Supersedes earlier plans for the day; bookings that left pending/
+    # confirmed since planning (cancelled, in transit) are not touched
+    now = datetime.now(timezone.utc).isoformat()
+    plan = {**plan, "status": "committed", "created_by": created_by, "created_at": now}
+    await db[DISPATCH_PLANS].update_many(
+        {"date": plan['date'], "status": "committed"}, {"$set": {"status": "superseded", "superseded_at": now}}
+    )
+    await db[DISPATCH_PLANS].insert_one(plan)
+    plan.pop('_id', None)
+
+    run_ids = defaultdict(list)
+    for run in plan['runs']:
+        for stop in run['stops']:
+            run_ids[stop['booking_id']].append(run['run_id'])
+    plannable = {"$in": encode_enums('status', PLANNABLE_STATUSES)}
+    operations = [
+        UpdateOne(
+            {"id": booking_id, "status": plannable},
+            {"$set": encode_booking({
+                "status": "confirmed", "dispatch_plan_id": plan['id'], "dispatch_run_ids": ids, "updated_at": now,
+            })},
+        )
+        for booking_id, ids in run_ids.items()
+    ]
+    plan['confirmed'] = 0
+    if operations:
+        result = await db.bookings.bulk_write(operations, ordered=False)
+        plan['confirmed'] = result.modified_count
+    return plan
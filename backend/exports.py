@@ -0,0 +1,112 @@
+# Streaming booking exports for accounting.
+#
+# Rows are read from a Mongo cursor in batches and written out as they arrive,
+# so memory stays bounded by the batch / row group size rather than by the
+# number of bookings exported. pyarrow is only imported for Parquet exports.
+import asyncio
+import csv
+import io
+import os
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '50000'))
+
+# (column, parquet type)
+EXPORT_COLUMNS = [
+    ("id", "string"),
+    ("user_id", "string"),
+    ("user_name", "string"),
+    ("user_email", "string"),
+    ("status", "string"),
+    ("fuel_type", "string"),
+    ("delivery_address", "string"),
+    ("preferred_date", "string"),
+    ("preferred_time", "string"),
+    ("fuel_quantity_liters", "float64"),
+    ("ordered_amount", "float64"),
+    ("dispensed_amount", "float64"),
+    ("pricing_version", "int64"),
+    ("rack_price", "float64"),
+    ("customer_price_modifier", "float64"),
+    ("fuel_price_per_liter", "float64"),
+    ("federal_carbon_tax", "float64"),
+    ("quebec_carbon_tax", "float64"),
+    ("gst_rate", "float64"),
+    ("qst_rate", "float64"),
+    ("subtotal", "float64"),
+    ("total_price", "float64"),
+    ("created_at", "string"),
+    ("updated_at", "string"),
+]
+COLUMN_NAMES = [name for name, _ in EXPORT_COLUMNS]
+# Rate columns are filled in from the booking's pricing version by the caller
+EXPORT_PROJECTION = {"_id": 0, **{name: 1 for name in COLUMN_NAMES}}
+
+def export_cursor(db, query: dict):
+    return db.bookings.find(query, EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+
+async def _batches(cursor, size: int):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_csv(cursor):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMN_NAMES)
+    async for batch in _batches(cursor, EXPORT_BATCH_SIZE):
+        for doc in batch:
+            writer.writerow([doc.get(name) for name in COLUMN_NAMES])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class DrainableSink(io.RawIOBase):
+    # Write-only, non-seekable file object whose contents are handed to the
+    # response and dropped after every chunk (Parquet row group, ZIP entry).
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def stream_parquet(cursor):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in EXPORT_COLUMNS])
+    sink = DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for batch in _batches(cursor, PARQUET_ROW_GROUP_SIZE):
+            table = pa.Table.from_pydict(
+                {name: [doc.get(name) for doc in batch] for name in COLUMN_NAMES},
+                schema=schema,
+            )
+            await asyncio.to_thread(writer.write_table, table)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
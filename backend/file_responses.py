@@ -0,0 +1,162 @@
+# Cacheable file responses for immutable uploads (invoice images).
+#
+# Image names are SHA-256 digests of their content (see image_store.py), so a
+# name always maps to the same bytes: responses carry the digest as a strong
+# ETag and a one-year immutable Cache-Control. Names from before the store
+# ("{booking_id}_{uuid}.{ext}") were never reused either; they fall back to an
+# ETag derived from the file's inode/size/mtime.
+# Conditional (If-None-Match) and single byte-range requests are answered
+# without reading the file body. The body is sent with the most direct path
+# the deployment offers:
+#   1. X-Accel-Redirect, when FILE_ACCEL_REDIRECT_PREFIX is set and nginx
+#      serves the upload directory (nginx then uses sendfile);
+#   2. the ASGI "http.response.zerocopy" / "http.response.pathsend"
+#      extensions, when the server advertises them;
+#   3. chunked reads otherwise (uvicorn implements neither extension).
+import hashlib
+import os
+import re
+import stat
+from email.utils import formatdate
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Optional
+
+import anyio
+from starlette.responses import Response
+
+from image_store import is_content_addressed
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+FILE_ACCEL_REDIRECT_PREFIX = os.environ.get('FILE_ACCEL_REDIRECT_PREFIX')
+CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def strong_etag(path: Path, stat_result: os.stat_result) -> str:
+    if is_content_addressed(path.name):
+        return f'"{path.stem}"'
+    base = f"{stat_result.st_ino}-{stat_result.st_size}-{stat_result.st_mtime_ns}"
+    return '"' + hashlib.sha1(base.encode()).hexdigest()[:20] + '"'
+
+def _etag_matches(header: str, etag: str) -> bool:
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def parse_range(header: str, size: int) -> Optional[tuple]:
+    # Single ranges only; multi-range requests get the whole file (RFC 9110
+    # allows ignoring Range). Returns (start, end) inclusive, or () when the
+    # range cannot be satisfied.
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return ()
+        return (max(size - length, 0), size - 1)
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return ()
+    return (start, end)
+
+
+class ImmutableFileResponse(Response):
+    def __init__(self, path: Path, request_headers, accel_path: Optional[str] = None):
+        self.path = path
+        self.stat_result = os.stat(path)
+        if not stat.S_ISREG(self.stat_result.st_mode):
+            raise FileNotFoundError(path)
+        self.media_type = guess_type(str(path))[0] or "application/octet-stream"
+        self.background = None
+        self.accel_path = accel_path
+        self.range = None
+
+        etag = strong_etag(path, self.stat_result)
+        size = self.stat_result.st_size
+        headers = {
+            "etag": etag,
+            "cache-control": IMMUTABLE_CACHE_CONTROL,
+            "last-modified": formatdate(self.stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+
+        if_none_match = request_headers.get("if-none-match")
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            self.status_code = 304
+        elif range_header and (not if_range or if_range.strip() == etag):
+            byte_range = parse_range(range_header, size)
+            if byte_range == ():
+                self.status_code = 416
+                headers["content-range"] = f"bytes */{size}"
+                headers["content-length"] = "0"
+            elif byte_range:
+                self.status_code = 206
+                self.range = byte_range
+                headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+                headers["content-length"] = str(byte_range[1] - byte_range[0] + 1)
+            else:
+                self.status_code = 200
+        else:
+            self.status_code = 200
+
+        if self.status_code == 200:
+            headers["content-length"] = str(size)
+        self.init_headers(headers)
+        if self.status_code in (200, 206):
+            self.headers["content-type"] = self.media_type
+        if self.accel_path and self.status_code in (200, 206):
+            # nginx answers Range itself against the file it sends
+            self.status_code = 200
+            self.range = None
+            self.headers["x-accel-redirect"] = self.accel_path
+            self.headers["content-length"] = "0"
+            if "content-range" in self.headers:
+                del self.headers["content-range"]
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.status_code not in (200, 206) or self.accel_path:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        start, end = self.range or (0, self.stat_result.st_size - 1)
+        count = end - start + 1
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopy" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopy", "file": file, "offset": start, "count": count})
+            return
+        if "http.response.pathsend" in extensions and self.range is None:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+def immutable_file_response(path: Path, base_dir: Path, request_headers) -> Optional[ImmutableFileResponse]:
+    # None when the name escapes base_dir or the file does not exist
+    resolved = path.resolve()
+    if base_dir.resolve() not in resolved.parents:
+        return None
+    accel_path = None
+    if FILE_ACCEL_REDIRECT_PREFIX:
+        accel_path = FILE_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + resolved.relative_to(base_dir.resolve()).as_posix()
+    try:
+        return ImmutableFileResponse(resolved, request_headers, accel_path)
+    except FileNotFoundError:
+        return None
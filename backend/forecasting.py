@@ -0,0 +1,197 @@
+# Tank refill forecasting.
+#
+# Every delivered booking is a refill of its selected tanks (liters split in
+# proportion to tank capacity when all capacities are known, evenly
+# otherwise). The liters delivered at a refill are what the tank consumed
+# since the previous one, so a tank's consumption rate is
+#     sum(w_i * liters_i) / sum(w_i * days_i)
+# over its refill intervals, with weights halving every
+# FORECAST_HALF_LIFE_DAYS so recent behaviour dominates. Assuming each refill
+# tops the tank up, the next refill is due when the usable volume (capacity
+# above FORECAST_REORDER_FRACTION, or the tank's average refill when the
+# capacity is unknown) has been consumed since the last refill.
+#
+# The fit runs over all tanks at once: refills are flat NumPy arrays sorted
+# by (tank, time), and per-tank sums are np.bincount reductions, so there is
+# no per-tank Python loop. Results are written to a staging collection and
+# renamed over `tank_forecasts`, so readers never see a partial run.
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+
+from booking_codec import STATUS_CODES, decode_day, decode_timestamp
+from db_indexes import INDEXES
+
+TANK_FORECASTS = "tank_forecasts"
+FORECAST_HALF_LIFE_DAYS = float(os.environ.get('FORECAST_HALF_LIFE_DAYS', '90'))
+FORECAST_REORDER_FRACTION = float(os.environ.get('FORECAST_REORDER_FRACTION', '0.25'))
+# Refills closer together than this are treated as one visit
+FORECAST_MIN_INTERVAL_DAYS = float(os.environ.get('FORECAST_MIN_INTERVAL_DAYS', '0.25'))
+FORECAST_WRITE_BATCH_SIZE = int(os.environ.get('FORECAST_WRITE_BATCH_SIZE', '5000'))
+
+FORECAST_PROJECTION = {"_id": 0, "run_id": 0}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_days(value) -> float:
+    # ISO timestamp / YYYY-MM-DD / BSON datetime -> days since the epoch
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH).total_seconds() / 86400
+
+def from_days(days: float) -> datetime:
+    return EPOCH + timedelta(days=days)
+
+
+def fit_consumption(tank: np.ndarray, t: np.ndarray, liters: np.ndarray, n_tanks: int, now: float) -> dict:
+    # tank: int index per refill, t: days since epoch, liters: delivered.
+    # Returns per-tank arrays (length n_tanks); rate is NaN without at least
+    # one usable interval.
+    order = np.lexsort((t, tank))
+    tank, t, liters = tank[order], t[order], liters[order]
+
+    refills = np.bincount(tank, minlength=n_tanks)
+    mean_refill = np.divide(np.bincount(tank, weights=liters, minlength=n_tanks), refills,
+                            out=np.full(n_tanks, np.nan), where=refills > 0)
+    last = np.r_[tank[1:] != tank[:-1], True] if len(tank) else np.zeros(0, dtype=bool)
+    last_t = np.full(n_tanks, np.nan)
+    last_t[tank[last]] = t[last]
+
+    # Interval i ends at refill i + 1 of the same tank
+    gap = np.diff(t)
+    usable = (tank[1:] == tank[:-1]) & (gap >= FORECAST_MIN_INTERVAL_DAYS)
+    ends = tank[1:][usable]
+    weight = 0.5 ** ((now - t[1:][usable]) / FORECAST_HALF_LIFE_DAYS)
+    consumed = np.bincount(ends, weights=weight * liters[1:][usable], minlength=n_tanks)
+    elapsed = np.bincount(ends, weights=weight * gap[usable], minlength=n_tanks)
+    rate = np.divide(consumed, elapsed, out=np.full(n_tanks, np.nan), where=elapsed > 0)
+    return {"refills": refills, "mean_refill": mean_refill, "last_t": last_t, "rate": rate}
+
+def predict_refills(fit: dict, capacity: np.ndarray, now: float) -> dict:
+    # capacity: NaN where unknown
+    has_capacity = capacity > 0
+    usable = np.where(has_capacity, capacity * (1 - FORECAST_REORDER_FRACTION), fit['mean_refill'])
+    rate = fit['rate']
+    valid = np.isfinite(rate) & (rate > 0) & np.isfinite(usable)
+    next_t = np.where(valid, fit['last_t'] + usable / np.where(valid, rate, 1), np.nan)
+    level = np.where(
+        valid & has_capacity,
+        np.clip(capacity - rate * (now - fit['last_t']), 0, np.where(has_capacity, capacity, 0)),
+        np.nan,
+    )
+    return {"valid": valid, "next_t": next_t, "level": level}
+
+
+async def load_tanks(db) -> list:
+    return await db.fuel_tanks.find(
+        {}, {"_id": 0, "id": 1, "user_id": 1, "name": 1, "identifier": 1, "capacity": 1}
+    ).to_list(None)
+
+async def load_log_totals(db) -> dict:
+    # booking id -> (liters logged, last delivery time)
+    totals = {}
+    cursor = db.delivery_logs.aggregate([
+        {"$group": {"_id": "$booking_id", "liters": {"$sum": "$liters_delivered"}, "last": {"$max": "$delivery_time"}}},
+    ], allowDiskUse=True)
+    async for row in cursor:
+        totals[row['_id']] = (row['liters'], row['last'])
+    return totals
+
+async def load_refills(db, tank_index: dict, capacities: list) -> tuple:
+    # Flat (tank index, day, liters) arrays, one row per tank per delivery
+    log_totals = await load_log_totals(db)
+    tanks, days, liters = [], [], []
+    cursor = db.bookings.find(
+        {"status": STATUS_CODES["delivered"], "selected_tanks.0": {"$exists": True}},
+        {"_id": 0, "id": 1, "selected_tanks.id": 1, "preferred_date": 1, "dispensed_amount": 1, "fuel_quantity_liters": 1},
+    ).batch_size(5000)
+    async for booking in cursor:
+        indexes = [tank_index[ref['id']] for ref in booking['selected_tanks'] if ref.get('id') in tank_index]
+        if not indexes:
+            continue
+        logged, logged_at = log_totals.get(booking['id'], (None, None))
+        amount = booking.get('dispensed_amount') or logged or booking.get('fuel_quantity_liters') or 0.0
+        when = logged_at or decode_day(booking.get('preferred_date'))
+        if not amount or not when:
+            continue
+        day = to_days(when)
+        caps = [capacities[i] for i in indexes]
+        total = sum(caps) if all(cap > 0 for cap in caps) else None
+        tanks.extend(indexes)
+        days.extend([day] * len(indexes))
+        liters.extend(amount * cap / total if total else amount / len(indexes) for cap in caps)
+    return np.array(tanks, dtype=np.int64), np.array(days, dtype=np.float64), np.array(liters, dtype=np.float64)
+
+async def rebuild_forecasts(db) -> dict:
+    now_dt = datetime.now(timezone.utc)
+    now = to_days(now_dt)
+    tanks = await load_tanks(db)
+    tank_index = {tank['id']: i for i, tank in enumerate(tanks)}
+    capacities = [float(tank.get('capacity') or np.nan) for tank in tanks]
+    capacity = np.array(capacities, dtype=np.float64)
+
+    tank, t, liters = await load_refills(db, tank_index, capacities)
+    fit = fit_consumption(tank, t, liters, len(tanks), now)
+    prediction = predict_refills(fit, capacity, now)
+
+    run_id = str(uuid.uuid4())
+    updated_at = now_dt.isoformat()
+    valid = np.flatnonzero(prediction['valid'])
+    staging = db[f"{TANK_FORECASTS}_{run_id[:8]}"]
+    await staging.create_indexes(INDEXES[TANK_FORECASTS])
+    batch = []
+    for i, rate, last_t, next_t, level, refills in zip(
+        valid.tolist(), fit['rate'][valid].tolist(), fit['last_t'][valid].tolist(),
+        prediction['next_t'][valid].tolist(), prediction['level'][valid].tolist(), fit['refills'][valid].tolist(),
+    ):
+        tank_doc = tanks[i]
+        batch.append({
+            "tank_id": tank_doc['id'],
+            "user_id": tank_doc.get('user_id'),
+            "tank_name": tank_doc.get('name'),
+            "identifier": tank_doc.get('identifier'),
+            "capacity": tank_doc.get('capacity'),
+            "liters_per_day": round(rate, 3),
+            "refills": refills,
+            "last_refill_at": from_days(last_t),
+            "next_refill_at": from_days(next_t),
+            "estimated_level_liters": None if np.isnan(level) else round(level, 1),
+            "run_id": run_id,
+            "updated_at": updated_at,
+        })
+        if len(batch) >= FORECAST_WRITE_BATCH_SIZE:
+            await staging.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await staging.insert_many(batch, ordered=False)
+    if valid.size:
+        await staging.rename(TANK_FORECASTS, dropTarget=True)
+    else:
+        await staging.drop()
+        await db[TANK_FORECASTS].delete_many({})
+    return {
+        "tanks": len(tanks),
+        "refills": int(len(t)),
+        "forecasts": int(valid.size),
+        "insufficient_history": len(tanks) - int(valid.size),
+        "run_id": run_id,
+    }
+
+def forecast_response(doc: dict) -> dict:
+    return {
+        **doc,
+        "last_refill_at": decode_timestamp(doc.get('last_refill_at')),
+        "next_refill_at": decode_timestamp(doc.get('next_refill_at')),
+    }
+
+async def due_soon(db, days: int, user_id: Optional[str] = None, limit: int = 500) -> list:
+    query = {"next_refill_at": {"$lt": datetime.now(timezone.utc) + timedelta(days=days)}}
+    if user_id:
+        query['user_id'] = user_id
+    cursor = db[TANK_FORECASTS].find(query, FORECAST_PROJECTION).sort("next_refill_at", 1).limit(limit)
+    return [forecast_response(doc) async for doc in cursor]
@@ -0,0 +1,130 @@
+# Idempotency keys for create endpoints (POST /bookings, POST /logs).
+#
+# A client that retries after a timeout sends the same `Idempotency-Key`
+# header. The first request claims the key by inserting a record under a
+# unique (user_id, route, key) index, runs the handler and stores its
+# response; a repeat of the key gets the stored response back (with an
+# `Idempotent-Replayed: true` header) without running the handler again. A
+# concurrent duplicate loses the insert and gets 409 while the first request
+# is still running. The same key with a different body is rejected with 422.
+# Records expire through a TTL index after IDEMPOTENCY_TTL_HOURS.
+#
+# Each claim carries a random token, and only its holder may complete or
+# release it. The holder renews the claim's lock (IDEMPOTENCY_LOCK_SECONDS)
+# while the handler runs, so a live request is never taken over; a claim
+# whose worker died is taken over (with a new token) once its lock has
+# expired. A failed request releases its key so the client can retry.
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def request_fingerprint(payload: BaseModel) -> str:
+    # Hash of the validated body, so formatting differences do not matter
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+async def _claim(db, scope: dict, fingerprint: str, token: str) -> Optional[dict]:
+    # None when this request now owns the key, the existing record otherwise
+    now = _now()
+    locked_until = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        await db[IDEMPOTENCY_COLLECTION].insert_one({
+            **scope,
+            "fingerprint": fingerprint,
+            "status": "in_progress",
+            "token": token,
+            "created_at": now,
+            "locked_until": locked_until,
+            "expire_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    taken = await db[IDEMPOTENCY_COLLECTION].find_one_and_update(
+        {**scope, "fingerprint": fingerprint, "status": "in_progress", "locked_until": {"$lt": now}},
+        {"$set": {"token": token, "locked_until": locked_until}},
+    )
+    if taken:
+        return None
+    record = await db[IDEMPOTENCY_COLLECTION].find_one(scope, {"_id": 0})
+    # Released or expired since our insert failed: treat as still in flight
+    return record or {"fingerprint": fingerprint, "status": "in_progress"}
+
+async def _renew_lock(db, owned: dict):
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        try:
+            await db[IDEMPOTENCY_COLLECTION].update_one(
+                owned, {"$set": {"locked_until": _now() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+            )
+        except Exception as e:
+            logger.warning("Renewing idempotency lock %s failed: %s", owned['key'], e)
+
+async def idempotent(
+    db,
+    key: Optional[str],
+    user_id: str,
+    route: str,
+    payload: BaseModel,
+    handler: Callable[[], Awaitable],
+    status_code: int = 200,
+):
+    if key is None:
+        return await handler()
+    if not key.strip() or len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_MAX_KEY_LENGTH} characters")
+
+    scope = {"user_id": user_id, "route": route, "key": key}
+    fingerprint = request_fingerprint(payload)
+    token = uuid.uuid4().hex
+    record = await _claim(db, scope, fingerprint, token)
+    if record is not None:
+        if record['fingerprint'] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if record['status'] != "completed":
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        return JSONResponse(record['response'], status_code=record['status_code'], headers={REPLAYED_HEADER: "true"})
+
+    # Only this claim may renew, complete or release the key
+    owned = {**scope, "token": token, "status": "in_progress"}
+    lock = asyncio.create_task(_renew_lock(db, owned))
+    try:
+        result = await handler()
+    except Exception:
+        await db[IDEMPOTENCY_COLLECTION].delete_one(owned)
+        raise
+    finally:
+        lock.cancel()
+    completed = await db[IDEMPOTENCY_COLLECTION].update_one(owned, {
+        "$set": {
+            "status": "completed",
+            "status_code": status_code,
+            "response": jsonable_encoder(result),
+            "completed_at": _now(),
+        },
+        "$unset": {"locked_until": ""},
+    })
+    if completed.matched_count == 0:
+        logger.warning("Idempotency key %s was taken over before %s completed", key, route)
+    return result
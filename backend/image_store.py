@@ -0,0 +1,177 @@
+# Content-addressed store for invoice images.
+#
+# Uploads are hashed (SHA-256) while they are copied to disk and stored once
+# per distinct content at <images_dir>/<h[0:2]>/<h[2:4]>/<h>.<ext>. Bookings
+# reference images by that file name; `image_blobs` keeps one document per
+# blob with a reference count, so deleting an image from one booking only
+# removes the file when no other booking references it.
+#
+# Names from before the store ("{booking_id}_{uuid}.{ext}") still resolve to
+# the flat directory until `python manage.py migrate-images` moves them.
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import ReturnDocument
+
+BLOB_COLLECTION = "image_blobs"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})\.([A-Za-z0-9]{1,10})$")
+
+def is_content_addressed(name: str) -> bool:
+    return bool(_CONTENT_ADDRESSED.match(name))
+
+def image_path(images_dir: Path, name: str) -> Path:
+    match = _CONTENT_ADDRESSED.match(name)
+    if not match:
+        return images_dir / name
+    digest = match.group(1)
+    return images_dir / digest[:2] / digest[2:4] / name
+
+def _copy_and_hash(source, images_dir: Path) -> tuple:
+    # Runs in a worker thread; memory use is one chunk regardless of file size
+    sha = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=images_dir, prefix=".upload-")
+    with os.fdopen(fd, "wb") as out:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            out.write(chunk)
+    return sha.hexdigest(), Path(tmp_name)
+
+def _place(tmp: Path, final: Path):
+    final.parent.mkdir(parents=True, exist_ok=True)
+    if final.exists():
+        tmp.unlink(missing_ok=True)
+    else:
+        os.replace(tmp, final)
+
+async def _add_reference(db, digest: str, ext: str) -> str:
+    # The first upload of a blob decides its extension
+    blob = await db[BLOB_COLLECTION].find_one_and_update(
+        {"_id": digest},
+        {
+            "$inc": {"refcount": 1},
+            "$setOnInsert": {"ext": ext, "created_at": datetime.now(timezone.utc).isoformat()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return f"{digest}.{blob['ext']}"
+
+def clean_ext(ext: str) -> str:
+    ext = re.sub(r"[^a-z0-9]", "", ext.lower())[:10]
+    return ext or "jpg"
+
+async def store_upload(db, images_dir: Path, source, ext: str) -> str:
+    digest, tmp = await asyncio.to_thread(_copy_and_hash, source, images_dir)
+    try:
+        name = await _add_reference(db, digest, clean_ext(ext))
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    await asyncio.to_thread(_place, tmp, image_path(images_dir, name))
+    return name
+
+async def release_image(db, images_dir: Path, name: str):
+    path = image_path(images_dir, name)
+    if not is_content_addressed(name):
+        path.unlink(missing_ok=True)
+        return
+
+    digest = name.split(".", 1)[0]
+    blob = await db[BLOB_COLLECTION].find_one_and_update(
+        {"_id": digest}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if not blob or blob['refcount'] > 0:
+        return
+    deleted = await db[BLOB_COLLECTION].delete_one({"_id": digest, "refcount": {"$lte": 0}})
+    if not deleted.deleted_count:
+        return
+
+    # Move the file aside before checking again: an upload of the same content
+    # may have re-created the blob in the meantime and must keep its file.
+    trash = path.with_name(f".trash-{uuid.uuid4()}")
+    try:
+        os.replace(path, trash)
+    except FileNotFoundError:
+        return
+    if await db[BLOB_COLLECTION].find_one({"_id": digest}) and not path.exists():
+        os.replace(trash, path)
+    else:
+        trash.unlink(missing_ok=True)
+
+def _hash_file(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+async def migrate_legacy_images(db, images_dir: Path, dry_run: bool = False) -> dict:
+    # Idempotent: bookings whose images are all content-addressed are skipped.
+    # A booking changed concurrently is left for the next run (its references
+    # are released again). A crash between counting a reference and saving the
+    # booking leaves a refcount one too high (the blob is kept), never a
+    # dangling reference.
+    counts = {"bookings": 0, "migrated": 0, "deduplicated": 0, "missing": 0}
+    cursor = db.bookings.find(
+        {"invoice_images.0": {"$exists": True}}, {"_id": 0, "id": 1, "invoice_images": 1}
+    )
+    async for booking in cursor:
+        old_names = booking['invoice_images']
+        if all(is_content_addressed(name) for name in old_names):
+            continue
+        new_names = []
+        moved = []
+        added = []
+        for name in old_names:
+            legacy = images_dir / name
+            if is_content_addressed(name):
+                new_names.append(name)
+                continue
+            if not legacy.exists():
+                counts['missing'] += 1
+                new_names.append(name)
+                continue
+            digest = await asyncio.to_thread(_hash_file, legacy)
+            ext = clean_ext(name.rsplit(".", 1)[-1] if "." in name else "")
+            if dry_run:
+                new_names.append(f"{digest}.{ext}")
+                continue
+            new_name = await _add_reference(db, digest, ext)
+            final = image_path(images_dir, new_name)
+            if final.exists():
+                counts['deduplicated'] += 1
+            else:
+                final.parent.mkdir(parents=True, exist_ok=True)
+                tmp = final.with_name(f".migrate-{uuid.uuid4()}")
+                await asyncio.to_thread(shutil.copy2, legacy, tmp)
+                await asyncio.to_thread(_place, tmp, final)
+            moved.append(legacy)
+            added.append(new_name)
+            new_names.append(new_name)
+            counts['migrated'] += 1
+        counts['bookings'] += 1
+        if dry_run:
+            continue
+        result = await db.bookings.update_one(
+            {"id": booking['id'], "invoice_images": old_names},
+            {"$set": {"invoice_images": new_names}}
+        )
+        if result.modified_count:
+            for legacy in moved:
+                legacy.unlink(missing_ok=True)
+        else:
+            for name in added:
+                await release_image(db, images_dir, name)
+    return counts
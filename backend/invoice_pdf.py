@@ -0,0 +1,238 @@
+# Invoice PDF rendering. ReportLab is heavy to import, so server.py only
+# imports this module the first time an invoice is exported.
+import io
+from pathlib import Path
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage
+from reportlab.lib.units import inch
+
+from image_store import image_path
+
+
+def render_invoice_pdf(booking: dict, images_dir: Path) -> bytes:
+    # Create PDF
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title = Paragraph("<b>INVOICE - FuelTrack</b>", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 0.3*inch))
+    
+    # Booking Info
+    info_data = [
+        ['Invoice Number:', booking['id']],
+        ['Customer:', booking['user_name']],
+        ['Email:', booking['user_email']],
+        ['Date:', booking['created_at'][:10]],
+        ['Status:', booking['status'].upper()],
+    ]
+    info_table = Table(info_data, colWidths=[2*inch, 4*inch])
+    info_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    elements.append(info_table)
+    elements.append(Spacer(1, 0.3*inch))
+    
+    # Delivery Details
+    delivery_data = [
+        ['Delivery Address:', booking['delivery_address']],
+        ['Fuel Type:', booking['fuel_type'].upper()],
+        ['Preferred Date:', booking['preferred_date']],
+        ['Preferred Time:', booking['preferred_time']],
+    ]
+    if booking.get('ordered_amount'):
+        delivery_data.append(['Ordered Amount:', f"{booking['ordered_amount']} L"])
+    if booking.get('dispensed_amount'):
+        delivery_data.append(['Dispensed Amount:', f"{booking['dispensed_amount']} L"])
+    
+    delivery_table = Table(delivery_data, colWidths=[2*inch, 4*inch])
+    delivery_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    elements.append(delivery_table)
+    elements.append(Spacer(1, 0.3*inch))
+    
+    # Price Breakdown
+    price_header = Paragraph("<b>Price Breakdown</b>", styles['Heading2'])
+    elements.append(price_header)
+    elements.append(Spacer(1, 0.1*inch))
+    
+    # Use dispensed amount if available, otherwise use fuel_quantity_liters
+    # dispensed_amount is stored as null until the invoice is updated
+    quantity_for_price = booking.get('dispensed_amount') or booking["fuel_quantity_liters"]
+    quantity_label = f"Dispensed: {quantity_for_price}L" if booking.get('dispensed_amount') else f"{quantity_for_price}L"
+    
+    price_data = [
+        ['Description', 'Rate/Amount', 'Total'],
+        [f'Fuel Price ({quantity_label})', f'${booking["fuel_price_per_liter"]:.4f}/L', f'${quantity_for_price * booking["fuel_price_per_liter"]:.2f}'],
+        [f'Federal Carbon Tax ({quantity_label})', f'${booking["federal_carbon_tax"]:.4f}/L', f'${quantity_for_price * booking["federal_carbon_tax"]:.2f}'],
+        [f'Quebec Carbon Tax ({quantity_label})', f'${booking["quebec_carbon_tax"]:.4f}/L', f'${quantity_for_price * booking["quebec_carbon_tax"]:.2f}'],
+        ['Subtotal', '', f'${booking["subtotal"]:.2f}'],
+        [f'GST ({booking["gst_rate"]*100:.2f}%)', '', f'${booking["subtotal"] * booking["gst_rate"]:.2f}'],
+        [f'QST ({booking["qst_rate"]*100:.4f}%)', '', f'${booking["subtotal"] * booking["qst_rate"]:.2f}'],
+        ['TOTAL', '', f'${booking["total_price"]}'],
+    ]
+    
+    price_table = Table(price_data, colWidths=[3*inch, 1.5*inch, 1.5*inch])
+    price_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+    ]))
+    elements.append(price_table)
+    
+    # Add images if they exist
+    invoice_images = booking.get('invoice_images', [])
+    if invoice_images:
+        elements.append(Spacer(1, 0.3*inch))
+        elements.append(Paragraph("<b>Attached Images</b>", styles['Heading2']))
+        elements.append(Spacer(1, 0.1*inch))
+        
+        for img_name in invoice_images[:5]:
+            img_path = image_path(images_dir, img_name)
+            if img_path.exists():
+                try:
+                    img = RLImage(str(img_path), width=4*inch, height=3*inch)
+                    elements.append(img)
+                    elements.append(Spacer(1, 0.1*inch))
+                except:
+                    pass
+    
+    # Build PDF
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+# Monthly statements are drawn row by row on a canvas rather than built as a
+# platypus story, so a customer with thousands of deliveries never needs all
+# rows in memory at once.
+STATEMENT_COLUMNS = [
+    # (header, x offset in inches, right aligned)
+    ("Date", 0.0, False),
+    ("Invoice", 0.85, False),
+    ("Fuel", 1.6, False),
+    ("Liters", 2.3, True),
+    ("Price/L", 3.0, True),
+    ("Subtotal", 3.9, True),
+    ("GST", 4.7, True),
+    ("QST", 5.5, True),
+    ("Total", 6.5, True),
+]
+STATEMENT_MARGIN = 0.6 * inch
+STATEMENT_LINE_HEIGHT = 14
+
+def render_statement_pdf(bookings, customer: dict, period: str, output_path: Path) -> dict:
+    from reportlab.pdfgen import canvas
+
+    width, height = letter
+    pdf = canvas.Canvas(str(output_path), pagesize=letter)
+    page = 0
+    y = 0
+
+    def new_page():
+        nonlocal page, y
+        if page:
+            pdf.showPage()
+        page += 1
+        y = height - STATEMENT_MARGIN
+        pdf.setFont('Helvetica-Bold', 14)
+        pdf.drawString(STATEMENT_MARGIN, y, f"STATEMENT - FuelTrack - {period}")
+        pdf.setFont('Helvetica', 9)
+        pdf.drawRightString(width - STATEMENT_MARGIN, y, f"Page {page}")
+        y -= 18
+        pdf.drawString(STATEMENT_MARGIN, y, f"{customer['name']} <{customer['email']}>")
+        y -= 22
+        pdf.setFont('Helvetica-Bold', 9)
+        draw_row([header for header, _, _ in STATEMENT_COLUMNS])
+        pdf.line(STATEMENT_MARGIN, y + 10, width - STATEMENT_MARGIN, y + 10)
+        pdf.setFont('Helvetica', 9)
+
+    def draw_row(values):
+        nonlocal y
+        for value, (_, offset, right) in zip(values, STATEMENT_COLUMNS):
+            x = STATEMENT_MARGIN + offset * inch
+            if right:
+                pdf.drawRightString(x + 0.6 * inch, y, value)
+            else:
+                pdf.drawString(x, y, value)
+        y -= STATEMENT_LINE_HEIGHT
+
+    def ensure_space(lines=1):
+        if y - lines * STATEMENT_LINE_HEIGHT < STATEMENT_MARGIN:
+            new_page()
+
+    totals = {"deliveries": 0, "liters": 0.0, "subtotal": 0.0, "gst": 0.0, "qst": 0.0, "total": 0.0}
+    gst_by_rate = {}
+    qst_by_rate = {}
+
+    new_page()
+    for booking in bookings:
+        liters = booking.get('dispensed_amount') or booking['fuel_quantity_liters']
+        subtotal = booking['subtotal']
+        gst = subtotal * booking['gst_rate']
+        qst = subtotal * booking['qst_rate']
+        totals['deliveries'] += 1
+        totals['liters'] += liters
+        totals['subtotal'] += subtotal
+        totals['gst'] += gst
+        totals['qst'] += qst
+        totals['total'] += booking['total_price']
+        for summary, rate, tax in ((gst_by_rate, booking['gst_rate'], gst), (qst_by_rate, booking['qst_rate'], qst)):
+            taxable, collected = summary.get(rate, (0.0, 0.0))
+            summary[rate] = (taxable + subtotal, collected + tax)
+
+        ensure_space()
+        draw_row([
+            booking['preferred_date'][:10],
+            booking['id'][:8],
+            booking['fuel_type'].upper(),
+            f"{liters:,.2f}",
+            f"${booking['fuel_price_per_liter']:.4f}",
+            f"${subtotal:,.2f}",
+            f"${gst:,.2f}",
+            f"${qst:,.2f}",
+            f"${booking['total_price']:,.2f}",
+        ])
+
+    ensure_space(3)
+    pdf.line(STATEMENT_MARGIN, y + 10, width - STATEMENT_MARGIN, y + 10)
+    pdf.setFont('Helvetica-Bold', 9)
+    draw_row([
+        "TOTAL", f"{totals['deliveries']} deliveries", "",
+        f"{totals['liters']:,.2f}", "",
+        f"${totals['subtotal']:,.2f}", f"${totals['gst']:,.2f}", f"${totals['qst']:,.2f}", f"${totals['total']:,.2f}",
+    ])
+
+    y -= STATEMENT_LINE_HEIGHT
+    for label, summary in (("GST", gst_by_rate), ("QST", qst_by_rate)):
+        ensure_space(len(summary) + 1)
+        pdf.setFont('Helvetica-Bold', 10)
+        pdf.drawString(STATEMENT_MARGIN, y, f"{label} summary")
+        y -= STATEMENT_LINE_HEIGHT
+        pdf.setFont('Helvetica', 9)
+        for rate, (taxable, collected) in sorted(summary.items()):
+            pdf.drawString(STATEMENT_MARGIN, y, f"{label} at {rate * 100:.3f}% on ${taxable:,.2f}")
+            pdf.drawRightString(width - STATEMENT_MARGIN, y, f"${collected:,.2f}")
+            y -= STATEMENT_LINE_HEIGHT
+        y -= STATEMENT_LINE_HEIGHT / 2
+
+    pdf.save()
+    return {key: round(value, 2) for key, value in totals.items()}
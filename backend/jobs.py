@@ -0,0 +1,299 @@
+# Durable background jobs stored in the `jobs` collection.
+#
+# Slow side effects (PDF rendering, rollup rebuilds, ...) are enqueued as
+# documents and executed by asyncio workers in every API process. A worker
+# claims a job atomically (find_one_and_update) and holds a lease that it
+# renews while the handler runs; a job whose lease expires (worker crashed or
+# was killed) becomes claimable again, or is failed if that was its last
+# attempt. Failed attempts are retried with exponential backoff until
+# max_attempts is reached.
+#
+# Job lifecycle: queued -> running -> succeeded | failed (or back to queued
+# for a retry). Finished jobs are removed by a TTL index after
+# JOB_RETENTION_HOURS.
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_COLLECTION = "jobs"
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '2'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS', '5'))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get('JOB_RETRY_MAX_SECONDS', '600'))
+JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', '72'))
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.environ.get('JOB_SHUTDOWN_GRACE_SECONDS', '10'))
+
+# Fields returned by the status API
+PUBLIC_FIELDS = [
+    "id", "type", "status", "attempts", "max_attempts", "created_by", "created_at",
+    "run_at", "started_at", "finished_at", "result", "error",
+]
+PUBLIC_PROJECTION = {"_id": 0, **{field: 1 for field in PUBLIC_FIELDS}}
+
+
+class PermanentJobError(Exception):
+    # Raised by a handler when retrying cannot help (e.g. the booking is gone)
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+
+
+class JobType:
+    def __init__(self, name: str, handler: Callable[[dict], Awaitable[dict]], concurrency: int, max_attempts: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = int(os.environ.get(f"JOB_{name.upper()}_CONCURRENCY", concurrency))
+        self.max_attempts = max_attempts
+        self.wakeup = asyncio.Event()
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.busy_seconds = 0.0
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.claimed = 0
+
+    def snapshot(self, uptime: float) -> dict:
+        capacity = uptime * self.concurrency
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "utilisation": round(self.busy_seconds / capacity, 4) if capacity else 0.0,
+            "claimed": self.claimed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "queue_latency_avg_ms": round(self.latency_total_ms / self.claimed, 2) if self.claimed else 0.0,
+            "queue_latency_max_ms": round(self.latency_max_ms, 2),
+        }
+
+
+class JobQueue:
+    def __init__(self):
+        self.types = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.db = None
+        self._tasks = []
+        self._started_at = None
+        self._stopping = False
+
+    def register(self, name: str, handler: Callable[[dict], Awaitable[dict]], concurrency: int = 1, max_attempts: int = 3):
+        self.types[name] = JobType(name, handler, concurrency, max_attempts)
+
+    async def enqueue(self, db, job_type: str, payload: dict, created_by: Optional[str] = None) -> dict:
+        if job_type not in self.types:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = _now().isoformat()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.types[job_type].max_attempts,
+            "created_by": created_by,
+            "created_at": now,
+            "run_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        await db[JOB_COLLECTION].insert_one(job)
+        self.types[job_type].wakeup.set()
+        return {field: job[field] for field in PUBLIC_FIELDS}
+
+    async def get(self, db, job_id: str) -> Optional[dict]:
+        return await db[JOB_COLLECTION].find_one({"id": job_id}, PUBLIC_PROJECTION)
+
+    def start(self, db):
+        self.db = db
+        self._stopping = False
+        self._started_at = time.monotonic()
+        for job_type in self.types.values():
+            for _ in range(job_type.concurrency):
+                self._tasks.append(asyncio.create_task(self._worker(job_type)))
+
+    async def stop(self, grace: float = JOB_SHUTDOWN_GRACE_SECONDS):
+        # Idle workers exit at once; running jobs get `grace` seconds to finish
+        # and are put back in the queue otherwise.
+        self._stopping = True
+        for job_type in self.types.values():
+            job_type.wakeup.set()
+        if self._tasks:
+            _, still_running = await asyncio.wait(self._tasks, timeout=grace)
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+        self._tasks = []
+
+    async def _fail_exhausted(self, job_type: JobType, now: datetime):
+        # A job whose lease expired on its last attempt (the handler crashed
+        # or killed its worker every time) is failed instead of re-claimed
+        result = await self.db[JOB_COLLECTION].update_many(
+            {
+                "type": job_type.name,
+                "status": "running",
+                "lease_until": {"$lt": now.isoformat()},
+                "$expr": {"$gte": ["$attempts", "$max_attempts"]},
+            },
+            {"$set": {
+                "status": "failed",
+                "error": "Lease expired on the last attempt (worker crashed or was killed)",
+                "finished_at": now.isoformat(),
+                "expire_at": now + timedelta(hours=JOB_RETENTION_HOURS),
+            }},
+        )
+        if result.modified_count:
+            job_type.failed += result.modified_count
+            logger.error("%s %s job(s) failed after their last lease expired", result.modified_count, job_type.name)
+
+    async def _claim(self, job_type: JobType) -> Optional[dict]:
+        now = _now()
+        await self._fail_exhausted(job_type, now)
+        claim = {
+            "status": "running",
+            "started_at": now.isoformat(),
+            "worker": self.worker_id,
+            "lease_until": (now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(),
+        }
+        before = await self.db[JOB_COLLECTION].find_one_and_update(
+            {
+                "type": job_type.name,
+                "$or": [
+                    {"status": "queued", "run_at": {"$lte": now.isoformat()}},
+                    {
+                        "status": "running",
+                        "lease_until": {"$lt": now.isoformat()},
+                        "$expr": {"$lt": ["$attempts", "$max_attempts"]},
+                    },
+                ],
+            },
+            {"$set": claim, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            return None
+        return {**before, **claim, "attempts": before['attempts'] + 1}
+
+    async def _worker(self, job_type: JobType):
+        while not self._stopping:
+            job_type.wakeup.clear()
+            try:
+                job = await self._claim(job_type)
+            except Exception as e:
+                logger.warning("Claiming %s job failed: %s", job_type.name, e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(job_type.wakeup.wait(), JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job_type, job)
+            except Exception:
+                # Recording the outcome failed; the lease expires and the job
+                # is claimed again.
+                logger.exception("Job %s (%s) bookkeeping failed", job['id'], job_type.name)
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            lease_until = _now() + timedelta(seconds=JOB_LEASE_SECONDS)
+            await self.db[JOB_COLLECTION].update_one(
+                {"id": job_id, "worker": self.worker_id, "status": "running"},
+                {"$set": {"lease_until": lease_until.isoformat()}}
+            )
+
+    async def _finish(self, job: dict, update: dict):
+        # Only the worker holding the lease may record the outcome
+        await self.db[JOB_COLLECTION].update_one(
+            {"id": job['id'], "worker": self.worker_id, "status": "running"},
+            {"$set": update}
+        )
+
+    async def _run(self, job_type: JobType, job: dict):
+        claimed_at = datetime.fromisoformat(job['started_at'])
+        latency_ms = max((claimed_at - datetime.fromisoformat(job['run_at'])).total_seconds() * 1000, 0.0)
+        job_type.claimed += 1
+        job_type.latency_total_ms += latency_ms
+        job_type.latency_max_ms = max(job_type.latency_max_ms, latency_ms)
+
+        job_type.running += 1
+        started = time.monotonic()
+        lease = asyncio.create_task(self._renew_lease(job['id']))
+        try:
+            result = await job_type.handler(job['payload'])
+        except asyncio.CancelledError:
+            # Shutdown: hand the job back without counting the attempt
+            await asyncio.shield(self._finish(job, {
+                "status": "queued", "run_at": _now().isoformat(), "attempts": job['attempts'] - 1
+            }))
+            raise
+        except Exception as e:
+            finished = _now()
+            if isinstance(e, PermanentJobError) or job['attempts'] >= job['max_attempts']:
+                job_type.failed += 1
+                logger.error("Job %s (%s) failed: %s", job['id'], job_type.name, e)
+                await self._finish(job, {
+                    "status": "failed",
+                    "error": str(e),
+                    "finished_at": finished.isoformat(),
+                    "expire_at": finished + timedelta(hours=JOB_RETENTION_HOURS),
+                })
+            else:
+                job_type.retried += 1
+                run_at = finished + timedelta(seconds=retry_delay(job['attempts']))
+                logger.warning("Job %s (%s) attempt %s failed, retrying: %s", job['id'], job_type.name, job['attempts'], e)
+                await self._finish(job, {"status": "queued", "error": str(e), "run_at": run_at.isoformat()})
+        else:
+            finished = _now()
+            job_type.succeeded += 1
+            await self._finish(job, {
+                "status": "succeeded",
+                "result": result,
+                "error": None,
+                "finished_at": finished.isoformat(),
+                "expire_at": finished + timedelta(hours=JOB_RETENTION_HOURS),
+            })
+        finally:
+            lease.cancel()
+            job_type.running -= 1
+            job_type.busy_seconds += time.monotonic() - started
+
+    async def metrics(self, db) -> dict:
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        backlog = {}
+        rows = await db[JOB_COLLECTION].aggregate([
+            {"$match": {"status": {"$in": ["queued", "running"]}}},
+            {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}},
+        ]).to_list(None)
+        for row in rows:
+            backlog.setdefault(row['_id']['type'], {})[row['_id']['status']] = row['count']
+        return {
+            "worker_id": self.worker_id,
+            "uptime_seconds": round(uptime, 1),
+            "types": {
+                name: {**job_type.snapshot(uptime), "queued": backlog.get(name, {}).get("queued", 0),
+                       "running_cluster": backlog.get(name, {}).get("running", 0)}
+                for name, job_type in self.types.items()
+            },
+        }
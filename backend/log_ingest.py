@@ -0,0 +1,130 @@
+# Bulk delivery-log ingest (NDJSON, one log per line).
+#
+# Trucks buffer logs while offline and upload them in bursts. The request body
+# is split into lines as it arrives; valid lines are collected into batches of
+# LOG_INGEST_BATCH_SIZE, and each batch costs one `$in` lookup of its
+# booking ids and one unordered insert_many. Every log carries a
+# client-supplied `client_log_id` with a unique index, so re-uploading a
+# buffer after a lost response reports those lines as duplicates instead of
+# storing them twice. Memory is bounded by one batch plus one small result
+# per line; a body with more than LOG_INGEST_MAX_LINES lines is cut off there
+# and reported as truncated.
+import os
+from typing import AsyncIterator, Callable, Optional
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+LOG_INGEST_BATCH_SIZE = int(os.environ.get('LOG_INGEST_BATCH_SIZE', '500'))
+LOG_INGEST_MAX_LINES = int(os.environ.get('LOG_INGEST_MAX_LINES', '10000'))
+LOG_INGEST_MAX_LINE_BYTES = int(os.environ.get('LOG_INGEST_MAX_LINE_BYTES', '16384'))
+
+DUPLICATE_KEY = 11000
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int):
+    # (line number, bytes); None for a line longer than max_line_bytes, which
+    # is dropped as it streams in rather than buffered
+    pending = b""
+    overflow = False
+    number = 0
+    async for chunk in chunks:
+        parts = (pending + chunk).split(b"\n")
+        pending = parts.pop()
+        for part in parts:
+            number += 1
+            yield number, None if overflow or len(part) > max_line_bytes else part
+            overflow = False
+        if len(pending) > max_line_bytes:
+            overflow, pending = True, b""
+    if pending or overflow:
+        yield number + 1, None if overflow else pending
+
+def describe_error(error: ValueError) -> str:
+    if isinstance(error, ValidationError):
+        first = error.errors()[0]
+        location = ".".join(str(part) for part in first['loc'])
+        return f"{location}: {first['msg']}" if location else first['msg']
+    return str(error)
+
+
+class LogIngest:
+    def __init__(self, db, build_log: Callable[[bytes], dict]):
+        # build_log validates one line and returns the document to insert
+        # (raising ValueError / ValidationError for invalid lines)
+        self.db = db
+        self.build_log = build_log
+        self.results = []
+        self.counts = {"created": 0, "duplicate": 0, "error": 0}
+
+    def _result(self, line: int, status: str, client_log_id: Optional[str] = None, **fields):
+        self.counts[status] += 1
+        result = {"line": line, "status": status}
+        if client_log_id is not None:
+            result['client_log_id'] = client_log_id
+        self.results.append({**result, **fields})
+
+    async def run(self, chunks: AsyncIterator[bytes]) -> dict:
+        batch = []
+        lines = 0
+        truncated = False
+        async for number, line in iter_lines(chunks, LOG_INGEST_MAX_LINE_BYTES):
+            if number > LOG_INGEST_MAX_LINES:
+                truncated = True
+                break
+            lines = number
+            if line is None:
+                self._result(number, "error", error=f"Line longer than {LOG_INGEST_MAX_LINE_BYTES} bytes")
+                continue
+            if not line.strip():
+                continue
+            try:
+                batch.append((number, self.build_log(line)))
+            except ValueError as e:
+                self._result(number, "error", error=describe_error(e))
+                continue
+            if len(batch) >= LOG_INGEST_BATCH_SIZE:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)
+        self.results.sort(key=lambda result: result['line'])
+        return {"lines": lines, **self.counts, "truncated": truncated, "results": self.results}
+
+    async def _flush(self, batch: list):
+        booking_ids = list({log['booking_id'] for _, log in batch})
+        known = set()
+        async for booking in self.db.bookings.find({"id": {"$in": booking_ids}}, {"_id": 0, "id": 1}):
+            known.add(booking['id'])
+
+        valid = []
+        for number, log in batch:
+            if log['booking_id'] in known:
+                valid.append((number, log))
+            else:
+                self._result(number, "error", log['client_log_id'], error="Booking not found")
+        if not valid:
+            return
+
+        # Unordered: a duplicate does not stop the rest of the batch
+        failed = {}
+        try:
+            await self.db.delivery_logs.insert_many([log for _, log in valid], ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index']: error for error in e.details['writeErrors']}
+
+        duplicates = [valid[index][1]['client_log_id'] for index, error in failed.items() if error['code'] == DUPLICATE_KEY]
+        existing = {}
+        if duplicates:
+            cursor = self.db.delivery_logs.find({"client_log_id": {"$in": duplicates}}, {"_id": 0, "id": 1, "client_log_id": 1})
+            async for log in cursor:
+                existing[log['client_log_id']] = log['id']
+
+        for index, (number, log) in enumerate(valid):
+            error = failed.get(index)
+            if error is None:
+                self._result(number, "created", log['client_log_id'], id=log['id'])
+            elif error['code'] == DUPLICATE_KEY:
+                self._result(number, "duplicate", log['client_log_id'], id=existing.get(log['client_log_id']))
+            else:
+                self._result(number, "error", log['client_log_id'], error=error.get('errmsg', "Insert failed"))
@@ -0,0 +1,114 @@
+# Maintenance commands, run from the backend directory:
+#
+#     python manage.py <command> [options]
+#
+# Commands use the same .env / MONGO_* settings as the API server.
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from mongo_pool import create_mongo_client
+from forecasting import rebuild_forecasts
+from image_store import migrate_legacy_images
+from migrations import migration_status, run_migrations
+from rollups import rebuild_rollups
+from typeahead import backfill_search_terms
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def cmd_backfill_search_terms(db, args):
+    return await backfill_search_terms(db, batch_size=args.batch_size)
+
+async def cmd_backfill_rollups(db, args):
+    return await rebuild_rollups(db)
+
+async def cmd_forecast_tanks(db, args):
+    return await rebuild_forecasts(db)
+
+async def cmd_migrate_images(db, args):
+    return await migrate_legacy_images(db, Path(args.images_dir), dry_run=args.dry_run)
+
+async def cmd_migrate(db, args):
+    return await run_migrations(
+        db, only=args.only, batch_size=args.batch_size, dry_run=args.dry_run, max_batches=args.max_batches
+    )
+
+async def cmd_migrate_status(db, args):
+    return await migration_status(db)
+
+BATCH_SIZE_ARG = (("--batch-size",), {"type": int, "default": 1000})
+
+# name -> (handler, help, [(flags, argparse kwargs)])
+COMMANDS = {
+    "backfill-search-terms": (
+        cmd_backfill_search_terms,
+        "Recompute typeahead search_terms on users, tanks and equipment",
+        [BATCH_SIZE_ARG],
+    ),
+    "backfill-rollups": (
+        cmd_backfill_rollups,
+        "Rebuild the daily revenue/volume rollups from delivered bookings",
+        [],
+    ),
+    "forecast-tanks": (
+        cmd_forecast_tanks,
+        "Refit tank consumption rates and predicted refill dates",
+        [],
+    ),
+    "migrate-images": (
+        cmd_migrate_images,
+        "Move flat invoice images into the content-addressed store",
+        [
+            (("--images-dir",), {"default": "/app/uploads/invoice_images"}),
+            (("--dry-run",), {"action": "store_true"}),
+        ],
+    ),
+    "migrate": (
+        cmd_migrate,
+        "Run pending numbered data migrations (resumes from the last checkpoint)",
+        [
+            BATCH_SIZE_ARG,
+            (("--only",), {"type": int, "help": "run this migration number only"}),
+            (("--max-batches",), {"type": int, "help": "stop (resumable) after this many batches"}),
+            (("--dry-run",), {"action": "store_true"}),
+        ],
+    ),
+    "migrate-status": (
+        cmd_migrate_status,
+        "Show progress of the numbered data migrations",
+        [],
+    ),
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="FuelTrack maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, arguments) in COMMANDS.items():
+        sub = subparsers.add_parser(name, help=help_text)
+        for flags, kwargs in arguments:
+            sub.add_argument(*flags, **kwargs)
+    return parser
+
+async def run(args):
+    client = create_mongo_client(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        handler = COMMANDS[args.command][0]
+        return await handler(db, args)
+    finally:
+        client.close()
+
+def main():
+    args = build_parser().parse_args()
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
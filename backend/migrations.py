@@ -0,0 +1,256 @@
+# Numbered, resumable data migrations.
+#
+# A migration walks one collection in `_id` order, a batch at a time: it reads
+# the next `batch_size` documents matching its query with `_id` above the
+# checkpoint, turns each into at most one guarded update, writes the batch
+# with an unordered bulk_write and then saves the last `_id` seen in the
+# `migrations` collection. A run that crashes or is interrupted resumes from
+# that checkpoint; a batch written but not checkpointed is simply redone, so
+# updates are guarded on the values they replace and a second application
+# matches nothing.
+#
+# A runner holds a lease on the migration it is running (renewed with every
+# checkpoint), so two runners never work on the same migration. To keep live
+# traffic responsive, batches are written with MIGRATION_WRITE_CONCERN (by
+# default majority, so a run never gets ahead of replication) and the runner
+# sleeps between batches so that it is busy for at most MIGRATION_DUTY_CYCLE
+# of the wall-clock time.
+#
+#     python manage.py migrate [--only N] [--dry-run] [--batch-size 1000]
+#     python manage.py migrate-status
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.write_concern import WriteConcern
+
+from booking_codec import CODEC_FIELDS, LEGACY_QUERY, storage_rewrite
+from booking_refs import COMPACT_FIELDS, COMPACT_QUERY, compact_rewrite
+from pricing_history import BOOKING_PRICING_FIELDS, BOOKING_PRICING_QUERY, booking_pricing_rewrite
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_COLLECTION = "migrations"
+MIGRATION_LEASE_SECONDS = float(os.environ.get('MIGRATION_LEASE_SECONDS', '300'))
+MIGRATION_DUTY_CYCLE = float(os.environ.get('MIGRATION_DUTY_CYCLE', '0.5'))
+MIGRATION_BATCH_PAUSE_SECONDS = float(os.environ.get('MIGRATION_BATCH_PAUSE_SECONDS', '0'))
+MIGRATION_WRITE_CONCERN = os.environ.get('MIGRATION_WRITE_CONCERN', 'majority')
+
+STATUS_PROJECTION = {"_id": 0, "owner": 0}
+
+
+class MigrationLocked(Exception):
+    # Another runner holds the lease on this migration
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def throttle_delay(busy_seconds: float) -> float:
+    # Sleep long enough that working time is at most the duty cycle
+    duty = min(max(MIGRATION_DUTY_CYCLE, 0.01), 1.0)
+    return max(MIGRATION_BATCH_PAUSE_SECONDS, busy_seconds * (1 - duty) / duty)
+
+def write_concern() -> WriteConcern:
+    w = MIGRATION_WRITE_CONCERN
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+
+class Migration:
+    # rewrite(doc) returns (guard, update) or None to leave the document as
+    # is; the update is applied to {"_id": doc["_id"], **guard}. Migrations
+    # that need data loaded up front pass prepare(db, dry_run), which returns
+    # rewrite and must not write when dry_run is set.
+    def __init__(self, number: int, name: str, collection: str, query: dict, fields,
+                 rewrite: Optional[Callable] = None, prepare: Optional[Callable] = None):
+        self.number = number
+        self.name = name
+        self.collection = collection
+        self.query = query
+        self.projection = {field: 1 for field in fields}
+        self.rewrite = rewrite
+        self.prepare = prepare
+
+    async def load_rewrite(self, db, dry_run: bool = False) -> Callable:
+        return await self.prepare(db, dry_run) if self.prepare else self.rewrite
+
+
+# Append only: numbers are recorded in the `migrations` collection
+MIGRATIONS = [
+    Migration(1, "booking-pricing-versions", "bookings", BOOKING_PRICING_QUERY, BOOKING_PRICING_FIELDS,
+              prepare=booking_pricing_rewrite),
+    Migration(2, "compact-booking-refs", "bookings", COMPACT_QUERY, COMPACT_FIELDS,
+              rewrite=compact_rewrite),
+    Migration(3, "booking-storage-codec", "bookings", LEGACY_QUERY, CODEC_FIELDS,
+              rewrite=storage_rewrite),
+]
+
+
+class MigrationRunner:
+    def __init__(self, db):
+        self.db = db
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def _claim(self, migration: Migration) -> Optional[dict]:
+        now = _now()
+        state = self.db[MIGRATION_COLLECTION]
+        try:
+            await state.update_one(
+                {"number": migration.number},
+                {"$setOnInsert": {
+                    "number": migration.number,
+                    "name": migration.name,
+                    "collection": migration.collection,
+                    "status": "pending",
+                    "last_id": None,
+                    "counts": {"scanned": 0, "changed": 0, "skipped": 0, "written": 0},
+                    "owner": None,
+                    "lease_until": None,
+                    "started_at": now.isoformat(),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass
+        claim = {
+            "status": "running",
+            "owner": self.owner,
+            "lease_until": (now + timedelta(seconds=MIGRATION_LEASE_SECONDS)).isoformat(),
+            "updated_at": now.isoformat(),
+        }
+        before = await state.find_one_and_update(
+            {
+                "number": migration.number,
+                "status": {"$ne": "done"},
+                "$or": [{"owner": None}, {"lease_until": {"$lt": now.isoformat()}}],
+            },
+            {"$set": claim},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is not None:
+            return {**before, **claim}
+        current = await state.find_one({"number": migration.number}, {"_id": 0})
+        if current and current['status'] == "done":
+            return None
+        raise MigrationLocked(f"Migration {migration.number} is being run by {current and current['owner']}")
+
+    async def _checkpoint(self, migration: Migration, last_id, counts: dict) -> bool:
+        # False when the lease was lost (another runner took over)
+        now = _now()
+        result = await self.db[MIGRATION_COLLECTION].update_one(
+            {"number": migration.number, "owner": self.owner},
+            {
+                "$set": {
+                    "last_id": last_id,
+                    "lease_until": (now + timedelta(seconds=MIGRATION_LEASE_SECONDS)).isoformat(),
+                    "updated_at": now.isoformat(),
+                },
+                "$inc": {f"counts.{key}": value for key, value in counts.items()},
+            },
+        )
+        return result.matched_count == 1
+
+    async def _release(self, migration: Migration, done: bool):
+        update = {"status": "paused", "owner": None, "lease_until": None, "updated_at": _now().isoformat()}
+        if done:
+            update.update(status="done", finished_at=update['updated_at'])
+        await self.db[MIGRATION_COLLECTION].update_one(
+            {"number": migration.number, "owner": self.owner}, {"$set": update}
+        )
+
+    async def run(self, migration: Migration, batch_size: int = 1000, dry_run: bool = False,
+                  max_batches: Optional[int] = None) -> dict:
+        # A dry run starts from the saved checkpoint but writes nothing
+        if dry_run:
+            state = await self.db[MIGRATION_COLLECTION].find_one({"number": migration.number}, {"_id": 0}) or {}
+            if state.get('status') == "done":
+                return {"number": migration.number, "name": migration.name, "status": "done"}
+        else:
+            state = await self._claim(migration)
+            if state is None:
+                return {"number": migration.number, "name": migration.name, "status": "done"}
+
+        rewrite = await migration.load_rewrite(self.db, dry_run)
+        source = self.db[migration.collection]
+        target = source.with_options(write_concern=write_concern())
+        last_id = state.get('last_id')
+        totals = {"scanned": 0, "changed": 0, "skipped": 0, "written": 0}
+        batches = 0
+        done = False
+        try:
+            while max_batches is None or batches < max_batches:
+                started = time.monotonic()
+                query = dict(migration.query)
+                if last_id is not None:
+                    query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+                docs = await source.find(query, migration.projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+                if not docs:
+                    done = True
+                    break
+
+                counts = {"scanned": len(docs), "changed": 0, "skipped": 0, "written": 0}
+                operations = []
+                for doc in docs:
+                    change = rewrite(doc)
+                    if change is None:
+                        counts['skipped'] += 1
+                        continue
+                    guard, update = change
+                    counts['changed'] += 1
+                    operations.append(UpdateOne({"_id": doc['_id'], **guard}, update))
+                if operations and not dry_run:
+                    result = await target.bulk_write(operations, ordered=False)
+                    counts['written'] = result.modified_count
+                last_id = docs[-1]['_id']
+                batches += 1
+                for key, value in counts.items():
+                    totals[key] += value
+
+                if not dry_run and not await self._checkpoint(migration, last_id, counts):
+                    raise MigrationLocked(f"Lost the lease on migration {migration.number}")
+                await asyncio.sleep(throttle_delay(time.monotonic() - started))
+        finally:
+            if not dry_run:
+                await self._release(migration, done)
+        logger.info("Migration %s (%s): %s", migration.number, migration.name, totals)
+        return {
+            "number": migration.number,
+            "name": migration.name,
+            "status": "done" if done else ("dry-run" if dry_run else "paused"),
+            "batches": batches,
+            **totals,
+        }
+
+
+async def run_migrations(db, only: Optional[int] = None, batch_size: int = 1000, dry_run: bool = False,
+                         max_batches: Optional[int] = None) -> list:
+    # Pending migrations in number order; stops at the first one not finished
+    runner = MigrationRunner(db)
+    results = []
+    for migration in MIGRATIONS:
+        if only is not None and migration.number != only:
+            continue
+        result = await runner.run(migration, batch_size=batch_size, dry_run=dry_run, max_batches=max_batches)
+        results.append(result)
+        if result['status'] != "done" and not dry_run:
+            break
+    return results
+
+async def migration_status(db) -> list:
+    states = {
+        state['number']: state
+        async for state in db[MIGRATION_COLLECTION].find({}, STATUS_PROJECTION)
+    }
+    return [
+        states.get(m.number, {"number": m.number, "name": m.name, "collection": m.collection, "status": "pending"})
+        for m in MIGRATIONS
+    ]
@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+
+from pymongo import monitoring
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+def _env_int(name: str):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return None
+    return int(value)
+
+# Env var -> pymongo client option. Unset vars fall back to the driver defaults.
+POOL_SETTINGS_ENV = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "maxConnecting": "MONGO_MAX_CONNECTING",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+}
+
+def pool_settings_from_env() -> dict:
+    settings = {}
+    for option, env_name in POOL_SETTINGS_ENV.items():
+        value = _env_int(env_name)
+        if value is not None:
+            settings[option] = value
+    return settings
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    # Motor runs pymongo on executor threads and a checkout starts and finishes
+    # on the same thread, so the wait time is measured with a thread-local clock.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pools = 0
+        self.connections_open = 0
+        self.connections_created = 0
+        self.checked_out = 0
+        self.waiters = 0
+        self.max_waiters = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+        self.pool_clears = 0
+        self.wait_time_total_ms = 0.0
+        self.wait_time_max_ms = 0.0
+
+    def _finish_wait(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return 0.0
+        return (time.perf_counter() - started) * 1000
+
+    def pool_created(self, event):
+        with self._lock:
+            self.pools += 1
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiters += 1
+            self.max_waiters = max(self.max_waiters, self.waiters)
+
+    def connection_check_out_failed(self, event):
+        waited = self._finish_wait()
+        with self._lock:
+            self.waiters -= 1
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+            self.wait_time_total_ms += waited
+            self.wait_time_max_ms = max(self.wait_time_max_ms, waited)
+
+    def connection_checked_out(self, event):
+        waited = self._finish_wait()
+        with self._lock:
+            self.waiters -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time_total_ms += waited
+            self.wait_time_max_ms = max(self.wait_time_max_ms, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + sum(self.checkout_failures.values())
+            return {
+                "pools": self.pools,
+                "connections_open": self.connections_open,
+                "connections_created": self.connections_created,
+                "checked_out": self.checked_out,
+                "waiters": self.waiters,
+                "max_waiters": self.max_waiters,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "pool_clears": self.pool_clears,
+                "wait_time_avg_ms": round(self.wait_time_total_ms / attempts, 3) if attempts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max_ms, 3),
+            }
+
+
+pool_stats = PoolStatsListener()
+
+def create_mongo_client(mongo_url: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(mongo_url, event_listeners=[pool_stats], **pool_settings_from_env())
+
+# Read routing. Routes read through a named profile, a handle on the same
+# database with its own read preference and read concern, all sharing the
+# client's pools:
+#   primary    writes and read-after-write (the find_one after an update);
+#              always the primary, whatever the connection string says
+#   analytics  dashboards, reports and exports, which tolerate data a few
+#              seconds old; secondaryPreferred by default
+#   lists      list/search endpoints; primary by default so a client sees
+#              what it just wrote, can be moved to secondaries per deployment
+# A profile is configured with MONGO_READ_<PROFILE>_PREFERENCE,
+# MONGO_READ_<PROFILE>_MAX_STALENESS_SECONDS (-1 = no limit, otherwise at
+# least 90) and MONGO_READ_<PROFILE>_CONCERN (local, available, majority;
+# empty = server default).
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+READ_CONCERN_LEVELS = ("local", "available", "majority")
+READ_PROFILE_DEFAULTS = {
+    "analytics": {"preference": "secondaryPreferred", "max_staleness_seconds": 90, "read_concern": "local"},
+    "lists": {"preference": "primary", "max_staleness_seconds": -1, "read_concern": ""},
+}
+
+def read_profile_settings(profile: str) -> dict:
+    # Raises ValueError for an invalid setting
+    defaults = READ_PROFILE_DEFAULTS[profile]
+    prefix = f"MONGO_READ_{profile.upper()}_"
+    preference = os.environ.get(prefix + "PREFERENCE") or defaults['preference']
+    max_staleness = _env_int(prefix + "MAX_STALENESS_SECONDS")
+    if max_staleness is None:
+        max_staleness = defaults['max_staleness_seconds']
+    read_concern = os.environ.get(prefix + "CONCERN", defaults['read_concern'])
+    if preference not in READ_PREFERENCES:
+        raise ValueError(f"{prefix}PREFERENCE must be one of {list(READ_PREFERENCES)}")
+    if max_staleness != -1 and max_staleness < 90:
+        raise ValueError(f"{prefix}MAX_STALENESS_SECONDS must be -1 or at least 90")
+    if read_concern and read_concern not in READ_CONCERN_LEVELS:
+        raise ValueError(f"{prefix}CONCERN must be one of {list(READ_CONCERN_LEVELS)}")
+    return {"preference": preference, "max_staleness_seconds": max_staleness, "read_concern": read_concern}
+
+def read_options(settings: dict) -> dict:
+    mode = READ_PREFERENCES[settings['preference']]
+    # maxStalenessSeconds is not allowed with primary
+    preference = mode() if mode is Primary else mode(max_staleness=settings['max_staleness_seconds'])
+    return {"read_preference": preference, "read_concern": ReadConcern(settings['read_concern'] or None)}
+
+def read_databases(client: AsyncIOMotorClient, name: str) -> dict:
+    # Profile name -> database handle
+    databases = {"primary": client.get_database(name, read_preference=Primary())}
+    for profile in READ_PROFILE_DEFAULTS:
+        databases[profile] = client.get_database(name, **read_options(read_profile_settings(profile)))
+    return databases
+
+def read_routing_metrics(databases: dict) -> dict:
+    return {
+        profile: {
+            "read_preference": database.read_preference.document,
+            "read_concern": database.read_concern.level,
+        }
+        for profile, database in databases.items()
+    }
+
+def pool_metrics(client: AsyncIOMotorClient) -> dict:
+    options = client.delegate.options.pool_options
+    return {
+        "pid": os.getpid(),
+        "settings": {
+            "max_pool_size": options.max_pool_size,
+            "min_pool_size": options.min_pool_size,
+            "max_idle_time_seconds": options.max_idle_time_seconds,
+            "max_connecting": options.max_connecting,
+            "wait_queue_timeout": options.wait_queue_timeout,
+            "connect_timeout": options.connect_timeout,
+            "socket_timeout": options.socket_timeout,
+            "server_selection_timeout": client.delegate.options.server_selection_timeout,
+        },
+        "stats": pool_stats.snapshot(),
+    }
@@ -0,0 +1,190 @@
+# Invoice PDF rendering in a process pool, with an on-disk cache.
+#
+# Worker processes are spawned (not forked from the event-loop process) and
+# are the only processes that import ReportLab. Rendered PDFs are cached under
+# a key derived from the whole booking document, so any change to the booking
+# (status, amounts, images, ...) renders a fresh PDF and everything else is
+# served from disk.
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from pymongo import MongoClient
+
+from booking_codec import STATUS_CODES, day_start, decode_booking
+from exports import DrainableSink
+from pricing_history import PRICING_VERSIONS, expand_pricing, resolve_version
+
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', str(os.cpu_count() or 2)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def shutdown_render_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def render_pool_stats() -> dict:
+    return {"workers": PDF_RENDER_WORKERS, "started": _pool is not None}
+
+def _render_in_worker(booking: dict, images_dir: Path) -> bytes:
+    from invoice_pdf import render_invoice_pdf
+    return render_invoice_pdf(booking, images_dir)
+
+def _prune_stale(cache_dir: Path, prefix: str, keep: Path):
+    for stale in cache_dir.glob(f"{prefix}_*.pdf"):
+        if stale != keep:
+            stale.unlink(missing_ok=True)
+
+def booking_fingerprint(booking: dict) -> str:
+    payload = json.dumps(booking, sort_keys=True, default=str).encode()
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+def cached_pdf_path(cache_dir: Path, booking: dict) -> Path:
+    return cache_dir / f"{booking['id']}_{booking_fingerprint(booking)}.pdf"
+
+def _temp_path(path: Path) -> Path:
+    # Unique per write: overlapping renders of the same file (two threads of
+    # one process included) must not share a temp file
+    return path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+
+def _store(cache_dir: Path, path: Path, data: bytes):
+    # Atomic replace so concurrent readers never see a partial file; older
+    # renders of the same booking are removed.
+    tmp = _temp_path(path)
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    _prune_stale(cache_dir, path.name.rsplit("_", 1)[0], path)
+
+async def render_invoice_cached(booking: dict, images_dir: Path, cache_dir: Path) -> bytes:
+    path = cached_pdf_path(cache_dir, booking)
+    try:
+        return await asyncio.to_thread(path.read_bytes)
+    except FileNotFoundError:
+        pass
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(get_render_pool(), _render_in_worker, booking, images_dir)
+    await asyncio.to_thread(_store, cache_dir, path, data)
+    return data
+
+async def stream_invoice_zip(cursor, images_dir: Path, cache_dir: Path, max_in_flight: Optional[int] = None):
+    # PDFs are added to the archive in completion order. At most max_in_flight
+    # renders are outstanding, so memory is bounded by that many PDFs.
+    max_in_flight = max_in_flight or PDF_RENDER_WORKERS * 2
+    sink = DrainableSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)
+    pending = {}
+    errors = []
+
+    def add_finished(done):
+        for task in done:
+            booking_id = pending.pop(task)
+            try:
+                archive.writestr(f"invoice_{booking_id}.pdf", task.result())
+            except Exception as e:
+                errors.append(f"{booking_id}: {e}")
+
+    try:
+        async for booking in cursor:
+            task = asyncio.ensure_future(render_invoice_cached(booking, images_dir, cache_dir))
+            pending[task] = booking['id']
+            if len(pending) >= max_in_flight:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                add_finished(done)
+                yield sink.drain()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            add_finished(done)
+            yield sink.drain()
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors) + "\n")
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# Monthly statements. The worker process reads the customer's bookings for the
+# period with its own pymongo cursor (on the user_id + preferred_date index)
+# and draws them straight onto the PDF, so the API process never holds them.
+STATEMENT_FIELDS = [
+    "id", "preferred_date", "fuel_type", "fuel_quantity_liters", "dispensed_amount",
+    "fuel_price_per_liter", "subtotal", "gst_rate", "qst_rate", "total_price",
+    "pricing_version", "customer_price_modifier",
+]
+
+_worker_clients = {}
+
+def statement_range(period: str) -> dict:
+    # preferred_date is stored as a date (see booking_codec.py)
+    year, month = (int(part) for part in period.split("-"))
+    next_period = f"{year + 1}-01" if month == 12 else f"{year}-{month + 1:02d}"
+    return {"$gte": day_start(f"{period}-01"), "$lt": day_start(f"{next_period}-01")}
+
+def _render_statement_in_worker(mongo_url: str, db_name: str, customer: dict, period: str, output_path: Path) -> dict:
+    from invoice_pdf import render_statement_pdf
+
+    if mongo_url not in _worker_clients:
+        _worker_clients[mongo_url] = MongoClient(mongo_url)
+    db = _worker_clients[mongo_url][db_name]
+    # The whole version history is a handful of small documents
+    versions = {v['version']: v for v in db[PRICING_VERSIONS].find({}, {"_id": 0})}
+    cursor = db.bookings.find(
+        {"user_id": customer['id'], "preferred_date": statement_range(period), "status": STATUS_CODES["delivered"]},
+        {"_id": 0, **{field: 1 for field in STATEMENT_FIELDS}},
+    ).sort("preferred_date", 1).batch_size(500)
+    tmp = _temp_path(output_path)
+    try:
+        bookings = (expand_pricing(b, resolve_version(b, versions)) for b in map(decode_booking, cursor))
+        totals = render_statement_pdf(bookings, customer, period, tmp)
+        os.replace(tmp, output_path)
+    finally:
+        cursor.close()
+        tmp.unlink(missing_ok=True)
+    return totals
+
+async def statement_version(db, customer: dict, period: str) -> str:
+    # Any insert or update of a booking in the period changes count/updated_at;
+    # the customer's name and email are printed on the statement too
+    rows = await db.bookings.aggregate([
+        {"$match": {"user_id": customer['id'], "preferred_date": statement_range(period)}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "last_update": {"$max": "$updated_at"}}},
+    ]).to_list(1)
+    state = rows[0] if rows else {}
+    payload = json.dumps(
+        [state.get('count', 0), state.get('last_update'), customer.get('name'), customer.get('email')], default=str
+    ).encode()
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+async def render_statement_cached(db, mongo_url: str, db_name: str, customer: dict, period: str, cache_dir: Path) -> Path:
+    prefix = f"{customer['id']}_{period}"
+    path = cache_dir / f"{prefix}_{await statement_version(db, customer, period)}.pdf"
+    if path.exists():
+        return path
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        get_render_pool(), _render_statement_in_worker, mongo_url, db_name, customer, period, path
+    )
+    _prune_stale(cache_dir, prefix, path)
+    return path
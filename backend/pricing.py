@@ -0,0 +1,89 @@
+# Booking price arithmetic, shared by booking creation (one line at a time)
+# and the batch quote endpoint (NumPy over whole columns).
+#
+# The vectorized path performs the same float64 operations in the same order
+# as booking_price, so the unrounded values are bit-identical. Rounding to
+# cents cannot use np.round: it scales by 100 first and that product is
+# itself rounded, so values on or next to a half cent can land on the other
+# side. round_cents reproduces Python's round(v, 2) exactly instead.
+import numpy as np
+
+# Veltkamp splitter: hi/lo halves of a float64 with at most 26/27 bits each
+_SPLITTER = 2.0 ** 27 + 1
+
+def booking_price(pricing: dict, liters: float, customer_price_modifier: float = 0.0) -> dict:
+    # Calculate customer's final fuel price: rack price + customer modifier
+    customer_fuel_price = pricing['rack_price'] + customer_price_modifier
+
+    fuel_cost = liters * customer_fuel_price
+    federal_tax = liters * pricing['federal_carbon_tax']
+    quebec_tax = liters * pricing['quebec_carbon_tax']
+
+    subtotal = fuel_cost + federal_tax + quebec_tax
+    gst = subtotal * pricing['gst_rate']
+    qst = subtotal * pricing['qst_rate']
+
+    total = subtotal + gst + qst
+
+    return {
+        'rack_price': pricing['rack_price'],
+        'customer_price_modifier': customer_price_modifier,
+        'fuel_price_per_liter': customer_fuel_price,
+        'federal_carbon_tax': pricing['federal_carbon_tax'],
+        'quebec_carbon_tax': pricing['quebec_carbon_tax'],
+        'gst_rate': pricing['gst_rate'],
+        'qst_rate': pricing['qst_rate'],
+        'subtotal': round(subtotal, 2),
+        'total_price': round(total, 2)
+    }
+
+def round_cents(values: np.ndarray) -> np.ndarray:
+    # round(v, 2) is correctly rounded: half-even on the exact binary value of
+    # v. The product v * 100 is computed error-free as p + err (both halves of
+    # v times 100 are exact; TwoSum recovers the rounding error of p), which
+    # gives the exact sign of v * 100 - (floor + 0.5) for every element.
+    scaled = _SPLITTER * values
+    hi = scaled - (scaled - values)
+    lo = values - hi
+    a = hi * 100
+    b = lo * 100
+    p = a + b
+    b_virtual = p - a
+    err = (a - (p - b_virtual)) + (b - b_virtual)
+
+    floor = np.floor(p)
+    excess = ((p - floor) - 0.5) + err
+    up = (excess > 0) | ((excess == 0) & (np.mod(floor, 2) == 1))
+    rounded = (floor + up) / 100
+    # round() keeps the sign of values that round to zero
+    return np.where(rounded == 0, np.copysign(0.0, values), rounded)
+
+def quote_columns(pricing: dict, liters: np.ndarray, modifiers: np.ndarray) -> dict:
+    # Column-wise booking_price: every value is a float64 array of len(liters)
+    fuel_price = pricing['rack_price'] + modifiers
+
+    fuel_cost = liters * fuel_price
+    federal_tax = liters * pricing['federal_carbon_tax']
+    quebec_tax = liters * pricing['quebec_carbon_tax']
+
+    subtotal = fuel_cost + federal_tax + quebec_tax
+    gst = subtotal * pricing['gst_rate']
+    qst = subtotal * pricing['qst_rate']
+
+    total = subtotal + gst + qst
+
+    return {
+        'fuel_price_per_liter': fuel_price,
+        'fuel_cost': round_cents(fuel_cost),
+        'federal_carbon_tax_amount': round_cents(federal_tax),
+        'quebec_carbon_tax_amount': round_cents(quebec_tax),
+        'subtotal': round_cents(subtotal),
+        'gst_amount': round_cents(gst),
+        'qst_amount': round_cents(qst),
+        'total_price': round_cents(total),
+    }
+
+def quote_rows(columns: dict) -> list:
+    # Back to one dict per line (tolist() yields plain Python floats)
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
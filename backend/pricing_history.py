@@ -0,0 +1,234 @@
+# Versioned pricing history.
+#
+# Every pricing change is stored as an immutable document in
+# `pricing_versions` ({version, rates..., effective_from, created_by}). A
+# version is in effect from its effective_from until the next version's, so
+# "price as of X" is one indexed query. Bookings store the version number
+# (plus the customer's own modifier) instead of copies of the rates; the
+# rates are added back from a per-process version map when bookings are
+# returned, exported or rendered. Because versions never change, cached
+# entries never go stale; only "which version is current" has a TTL.
+#
+# Bookings created before versioning still carry the copied fields and are
+# returned unchanged (see `python manage.py migrate`). A booking whose version
+# document is missing is priced with the version in effect at its created_at;
+# when there is none, PricingVersionMissing is raised rather than returning a
+# booking without rates.
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from booking_codec import decode_timestamp
+
+logger = logging.getLogger(__name__)
+
+PRICING_VERSIONS = "pricing_versions"
+PRICING_CACHE_TTL_SECONDS = float(os.environ.get('PRICING_CACHE_TTL_SECONDS', '5'))
+
+# Version 1 on a database that has never had pricing
+DEFAULT_PRICING = {
+    'rack_price': 1.50,
+    'federal_carbon_tax': 0.14,
+    'quebec_carbon_tax': 0.05,
+    'gst_rate': 0.05,
+    'qst_rate': 0.09975
+}
+
+RATE_FIELDS = ["rack_price", "federal_carbon_tax", "quebec_carbon_tax", "gst_rate", "qst_rate"]
+# Booking fields derived from (version, customer_price_modifier); not stored
+# on bookings that reference a version.
+DERIVED_BOOKING_FIELDS = {
+    "rack_price", "fuel_price_per_liter", "federal_carbon_tax", "quebec_carbon_tax", "gst_rate", "qst_rate",
+}
+
+VERSION_PROJECTION = {"_id": 0}
+
+
+class PricingVersionMissing(Exception):
+    pass
+
+
+def expand_pricing(booking: dict, version: Optional[dict]) -> dict:
+    # Add the rate fields a booking referencing `version` would have carried
+    if booking.get('pricing_version') is None:
+        return booking
+    if version is None:
+        raise PricingVersionMissing(
+            f"Booking {booking.get('id')} references pricing version {booking['pricing_version']}, "
+            f"and no version was in effect at {booking.get('created_at')}"
+        )
+    modifier = booking.get('customer_price_modifier') or 0.0
+    return {
+        **booking,
+        **{field: version[field] for field in RATE_FIELDS},
+        "fuel_price_per_liter": version['rack_price'] + modifier,
+    }
+
+def version_in_effect(versions: Iterable[dict], at: Optional[str]) -> Optional[dict]:
+    # In-memory as_of over a full version list
+    in_effect = [v for v in versions if at and v['effective_from'] <= at]
+    return max(in_effect, key=lambda v: (v['effective_from'], v['version']), default=None)
+
+def _warn_missing(booking: dict):
+    logger.warning(
+        "Pricing version %s of booking %s is missing; using the version in effect at its creation",
+        booking['pricing_version'], booking.get('id'),
+    )
+
+def resolve_version(booking: dict, versions: dict) -> Optional[dict]:
+    # `versions` holds the whole history (see pdf_rendering.py)
+    number = booking.get('pricing_version')
+    if number is None or number in versions:
+        return versions.get(number)
+    _warn_missing(booking)
+    return version_in_effect(versions.values(), decode_timestamp(booking.get('created_at')))
+
+async def initial_version(db, defaults: dict = DEFAULT_PRICING) -> dict:
+    # Version 1 comes from the legacy single `pricing` document (or the defaults)
+    legacy = await db.pricing.find_one({}, {"_id": 0}) or {}
+    return {
+        "version": 1,
+        **{field: legacy.get(field, defaults[field]) for field in RATE_FIELDS},
+        "effective_from": legacy.get('updated_at') or datetime.now(timezone.utc).isoformat(),
+        "created_by": None,
+    }
+
+
+class PricingHistory:
+    def __init__(self):
+        self._versions = {}
+        self._current = None
+        self._current_loaded_at = 0.0
+
+    def _remember(self, version: dict) -> dict:
+        self._versions[version['version']] = version
+        return version
+
+    async def ensure_seeded(self, db, defaults: dict = DEFAULT_PRICING):
+        # Concurrent workers race on the unique version index
+        if await db[PRICING_VERSIONS].find_one({}, {"_id": 1}):
+            return
+        try:
+            await db[PRICING_VERSIONS].insert_one(await initial_version(db, defaults))
+        except DuplicateKeyError:
+            pass
+
+    async def current(self, db, refresh: bool = False) -> Optional[dict]:
+        now = time.monotonic()
+        if refresh or self._current is None or now - self._current_loaded_at > PRICING_CACHE_TTL_SECONDS:
+            latest = await db[PRICING_VERSIONS].find_one({}, VERSION_PROJECTION, sort=[("version", -1)])
+            self._current = self._remember(latest) if latest else None
+            self._current_loaded_at = now
+        return self._current
+
+    async def get_many(self, db, versions: Iterable[int]) -> dict:
+        wanted = {v for v in versions if v is not None}
+        missing = wanted - self._versions.keys()
+        if missing:
+            async for version in db[PRICING_VERSIONS].find({"version": {"$in": list(missing)}}, VERSION_PROJECTION):
+                self._remember(version)
+        return {v: self._versions[v] for v in wanted if v in self._versions}
+
+    async def as_of(self, db, at: str) -> Optional[dict]:
+        version = await db[PRICING_VERSIONS].find_one(
+            {"effective_from": {"$lte": at}}, VERSION_PROJECTION, sort=[("effective_from", -1), ("version", -1)]
+        )
+        return self._remember(version) if version else None
+
+    async def history(self, db, limit: int) -> list:
+        versions = await db[PRICING_VERSIONS].find({}, VERSION_PROJECTION).sort("version", -1).to_list(limit)
+        # A version is effective until the next one starts
+        history = []
+        effective_to = None
+        for version in versions:
+            self._remember(version)
+            history.append({**version, "effective_to": effective_to})
+            effective_to = version['effective_from']
+        return history
+
+    async def publish(self, db, rates: dict, created_by: Optional[str]) -> dict:
+        # Versions are numbered by the writer; on a concurrent publish the
+        # unique index rejects the duplicate and we retry on top of the winner.
+        while True:
+            latest = await self.current(db, refresh=True)
+            version = {
+                "version": (latest['version'] if latest else 0) + 1,
+                **{field: rates.get(field, latest[field] if latest else None) for field in RATE_FIELDS},
+                "effective_from": datetime.now(timezone.utc).isoformat(),
+                "created_by": created_by,
+            }
+            try:
+                await db[PRICING_VERSIONS].insert_one(version)
+            except DuplicateKeyError:
+                continue
+            version.pop('_id', None)
+            self._current = self._remember(version)
+            self._current_loaded_at = time.monotonic()
+            return version
+
+    async def expand(self, db, bookings: list) -> list:
+        versions = await self.get_many(db, (b.get('pricing_version') for b in bookings))
+        expanded = []
+        for booking in bookings:
+            version = versions.get(booking.get('pricing_version'))
+            if version is None and booking.get('pricing_version') is not None:
+                _warn_missing(booking)
+                created_at = decode_timestamp(booking.get('created_at'))
+                version = await self.as_of(db, created_at) if created_at else None
+            expanded.append(expand_pricing(booking, version))
+        return expanded
+
+    async def expand_one(self, db, booking: dict) -> dict:
+        return (await self.expand(db, [booking]))[0]
+
+    async def expand_stream(self, db, cursor):
+        # Versions are few, so after the first miss every lookup is a dict hit
+        async for booking in cursor:
+            yield await self.expand_one(db, booking)
+
+
+def _version_for(booking: dict, candidates: list) -> Optional[dict]:
+    # Among versions with identical rates, prefer the one in effect when the
+    # booking was created
+    chosen = candidates[0]
+    created_at = decode_timestamp(booking.get('created_at')) or ""
+    for version in candidates:
+        if version['effective_from'] <= created_at:
+            chosen = version
+    return chosen
+
+BOOKING_PRICING_QUERY = {"pricing_version": {"$exists": False}}
+BOOKING_PRICING_FIELDS = DERIVED_BOOKING_FIELDS | {"created_at", "customer_price_modifier"}
+
+async def booking_pricing_rewrite(db, dry_run: bool = False):
+    # Migration 1 (see migrations.py). Bookings created before versioning:
+    # when the copied rates match a version exactly, replace them by a
+    # reference to it. Rates that match no version (changes that were
+    # overwritten in place) are left on the booking.
+    if not dry_run:
+        await PricingHistory().ensure_seeded(db)
+    versions = await db[PRICING_VERSIONS].find({}, VERSION_PROJECTION).sort("effective_from", 1).to_list(None)
+    if not versions:
+        # Dry run on an unseeded database: match against the version 1 that
+        # seeding would insert, without inserting it
+        versions = [await initial_version(db)]
+    by_rates = {}
+    for version in versions:
+        by_rates.setdefault(tuple(version[field] for field in RATE_FIELDS), []).append(version)
+
+    def rewrite(booking: dict) -> Optional[tuple]:
+        candidates = by_rates.get(tuple(booking.get(field) for field in RATE_FIELDS))
+        modifier = booking.get('customer_price_modifier') or 0.0
+        if not candidates or booking.get('fuel_price_per_liter') != booking['rack_price'] + modifier:
+            return None
+        # Guarded on the copied values, so a booking edited meanwhile is skipped
+        return (
+            {"pricing_version": {"$exists": False}, **{field: booking.get(field) for field in DERIVED_BOOKING_FIELDS}},
+            {"$set": {"pricing_version": _version_for(booking, candidates)['version']},
+             "$unset": {field: "" for field in DERIVED_BOOKING_FIELDS}},
+        )
+    return rewrite
@@ -0,0 +1,149 @@
+# Daily revenue/volume rollups per customer and fuel type.
+#
+# Each delivered booking contributes its total_price and liters (dispensed
+# amount when recorded, ordered quantity otherwise) to the bucket for its
+# preferred_date. Writes that change a booking apply the difference between
+# its contribution before and after the change; `rebuild_rollups` recomputes
+# the whole collection from bookings.
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import List, Optional
+
+from booking_codec import STATUS_CODES, day_expr, enum_name_expr, money_expr
+
+ROLLUP_COLLECTION = "booking_rollups"
+GRANULARITIES = ("day", "week", "month")
+
+def bucket_id(day: str, user_id: str, fuel_type: str) -> str:
+    return f"{day}|{user_id}|{fuel_type}"
+
+def booking_contribution(booking: dict) -> Optional[dict]:
+    if booking.get('status') != 'delivered':
+        return None
+    liters = booking.get('dispensed_amount')
+    if liters is None:
+        liters = booking.get('fuel_quantity_liters', 0)
+    return {
+        "day": booking['preferred_date'][:10],
+        "user_id": booking['user_id'],
+        "user_name": booking.get('user_name'),
+        "fuel_type": booking['fuel_type'],
+        "revenue": booking.get('total_price', 0),
+        "liters": liters,
+    }
+
+async def _inc(db, contribution: dict, sign: int):
+    await db[ROLLUP_COLLECTION].update_one(
+        {"_id": bucket_id(contribution['day'], contribution['user_id'], contribution['fuel_type'])},
+        {
+            "$inc": {
+                "revenue": sign * contribution['revenue'],
+                "liters": sign * contribution['liters'],
+                "deliveries": sign,
+            },
+            "$set": {
+                "day": contribution['day'],
+                "user_id": contribution['user_id'],
+                "user_name": contribution['user_name'],
+                "fuel_type": contribution['fuel_type'],
+            },
+        },
+        upsert=True,
+    )
+
+async def apply_rollup_change(db, before: Optional[dict], after: Optional[dict]):
+    old = booking_contribution(before) if before else None
+    new = booking_contribution(after) if after else None
+    if old == new:
+        return
+    if old:
+        await _inc(db, old, -1)
+    if new:
+        await _inc(db, new, 1)
+
+async def rebuild_rollups(db) -> dict:
+    # $out replaces the rollup collection atomically when the pipeline finishes
+    pipeline = [
+        {"$match": {"status": STATUS_CODES["delivered"]}},
+        {"$project": {
+            "day": day_expr("preferred_date"),
+            "user_id": 1,
+            "user_name": 1,
+            "fuel_type": enum_name_expr("fuel_type"),
+            "revenue": {"$ifNull": [money_expr("total_price"), 0]},
+            "liters": {"$ifNull": ["$dispensed_amount", {"$ifNull": ["$fuel_quantity_liters", 0]}]},
+        }},
+        {"$group": {
+            "_id": {"day": "$day", "user_id": "$user_id", "fuel_type": "$fuel_type"},
+            "user_name": {"$last": "$user_name"},
+            "revenue": {"$sum": "$revenue"},
+            "liters": {"$sum": "$liters"},
+            "deliveries": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.day", "|", "$_id.user_id", "|", "$_id.fuel_type"]},
+            "day": "$_id.day",
+            "user_id": "$_id.user_id",
+            "user_name": 1,
+            "fuel_type": "$_id.fuel_type",
+            "revenue": 1,
+            "liters": 1,
+            "deliveries": 1,
+        }},
+        {"$out": ROLLUP_COLLECTION},
+    ]
+    await db.bookings.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    return {"buckets": await db[ROLLUP_COLLECTION].count_documents({})}
+
+def period_key(day: str, granularity: str) -> str:
+    if granularity == "month":
+        return day[:7]
+    if granularity == "week":
+        d = date.fromisoformat(day)
+        return (d - timedelta(days=d.weekday())).isoformat()  # Monday of the ISO week
+    return day
+
+async def query_rollups(
+    db,
+    start: str,
+    end: str,
+    granularity: str = "day",
+    customer_id: Optional[str] = None,
+    fuel_type: Optional[str] = None,
+    group_by: List[str] = (),
+) -> List[dict]:
+    # Buckets whose bookings were all un-delivered again stay at zero
+    query = {"day": {"$gte": start, "$lte": end}, "deliveries": {"$gt": 0}}
+    if customer_id:
+        query['user_id'] = customer_id
+    if fuel_type:
+        query['fuel_type'] = fuel_type
+
+    series = defaultdict(lambda: {"revenue": 0.0, "liters": 0.0, "deliveries": 0})
+    names = {}
+    async for bucket in db[ROLLUP_COLLECTION].find(query, {"_id": 0}):
+        key = [period_key(bucket['day'], granularity)]
+        if "customer" in group_by:
+            key.append(bucket['user_id'])
+            names[bucket['user_id']] = bucket.get('user_name')
+        if "fuel_type" in group_by:
+            key.append(bucket['fuel_type'])
+        point = series[tuple(key)]
+        point['revenue'] += bucket['revenue']
+        point['liters'] += bucket['liters']
+        point['deliveries'] += bucket['deliveries']
+
+    results = []
+    for key, point in sorted(series.items()):
+        row = {"period": key[0]}
+        rest = list(key[1:])
+        if "customer" in group_by:
+            row['customer_id'] = rest.pop(0)
+            row['customer_name'] = names.get(row['customer_id'])
+        if "fuel_type" in group_by:
+            row['fuel_type'] = rest.pop(0)
+        row['revenue'] = round(point['revenue'], 2)
+        row['liters'] = round(point['liters'], 2)
+        row['deliveries'] = point['deliveries']
+        results.append(row)
+    return results
@@ -1,46 +1,148 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Query, Request, Header, Path as PathParam
+from fastapi.responses import FileResponse, Response, JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
+import asyncio
+import numpy as np
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from passlib.context import CryptContext
 import jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.units import inch
-import io
-import base64
+from mongo_pool import create_mongo_client, pool_metrics, read_databases, read_routing_metrics
+from db_indexes import ensure_indexes
+from admission import AdmissionController, AdmissionControlMiddleware
+from pymongo import ReturnDocument
+from file_responses import immutable_file_response
+from idempotency import idempotent
+from image_store import image_path, store_upload, release_image
+from log_ingest import LogIngest
+from customer_overview import OVERVIEW_SORT_FIELDS, customer_overview
+from dispatch import (
+    DISPATCH_PLANS, DISPATCH_TRUCK_CAPACITY_LITERS, DISPATCH_WINDOW_MINUTES, PLAN_PROJECTION, build_plan, commit_plan
+)
+from telemetry import (
+    TELEMETRY_COLLECTION, TELEMETRY_MAX_READINGS, ensure_telemetry_collection, latest_readings, pick_interval,
+    query_series, reading_documents
+)
+from exports import export_cursor, stream_csv, stream_parquet
+from pdf_rendering import (
+    render_invoice_cached, render_statement_cached, stream_invoice_zip,
+    shutdown_render_pool, render_pool_stats
+)
+from forecasting import due_soon, rebuild_forecasts
+from rollups import GRANULARITIES, apply_rollup_change, query_rollups, rebuild_rollups
+from jobs import JobQueue, PermanentJobError
+from pricing import booking_price, quote_columns, quote_rows
+from pricing_history import PricingHistory, DEFAULT_PRICING, DERIVED_BOOKING_FIELDS
+from booking_codec import (
+    encode_booking, decode_booking, decode_stream, encode_enum, encode_enums, day_range
+)
+from booking_refs import (
+    TANK_SNAPSHOT_FIELDS, EQUIPMENT_SNAPSHOT_FIELDS, compact_delivery_locations, expand_references, parse_expand
+)
+from typeahead import (
+    typeahead_search, user_search_fields, tank_search_terms, equipment_search_terms
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Create directories for uploads
+# Upload directories (created by the lifespan handler)
 UPLOAD_DIR = Path("/app/uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
 INVOICE_IMAGES_DIR = UPLOAD_DIR / "invoice_images"
-INVOICE_IMAGES_DIR.mkdir(exist_ok=True)
+INVOICE_PDF_CACHE_DIR = UPLOAD_DIR / "invoice_pdfs"
+STATEMENT_CACHE_DIR = UPLOAD_DIR / "statements"
 
-# MongoDB connection
+# MongoDB connection (opened by the lifespan handler)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+db = None
+# Read routing profiles (see mongo_pool.py): `db` always reads from the
+# primary; analytics_db / lists_db follow MONGO_READ_* settings
+read_dbs = {}
+analytics_db = None
+lists_db = None
+
+STARTUP_RETRY_SECONDS = float(os.environ.get('STARTUP_RETRY_SECONDS', '5'))
+READINESS_PING_TIMEOUT_SECONDS = float(os.environ.get('READINESS_PING_TIMEOUT_SECONDS', '2'))
+
+# Worker state reported by /health/ready
+worker_state = {"ready": False, "warmed_up": False, "indexes": {}, "last_error": None}
+
+async def warm_up():
+    # Everything the first request would otherwise pay for
+    await client.admin.command('ping')
+    worker_state["indexes"] = await ensure_indexes(db)
+    worker_state["indexes"][TELEMETRY_COLLECTION] = await ensure_telemetry_collection(db)
+    await get_pricing_snapshot(refresh=True)
+    app.openapi()
+    await asyncio.to_thread(pwd_context.hash, "warmup")
+    worker_state["warmed_up"] = True
+    worker_state["last_error"] = None
+
+async def warm_up_until_ready():
+    while True:
+        try:
+            await warm_up()
+            worker_state["ready"] = True
+            logger.info("Worker ready")
+            return
+        except Exception as e:
+            worker_state["last_error"] = str(e)
+            logger.warning("Warmup failed, retrying in %ss: %s", STARTUP_RETRY_SECONDS, e)
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, analytics_db, lists_db
+    INVOICE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    INVOICE_PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    STATEMENT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    client = create_mongo_client(mongo_url)
+    read_dbs.update(read_databases(client, os.environ['DB_NAME']))
+    db, analytics_db, lists_db = read_dbs["primary"], read_dbs["analytics"], read_dbs["lists"]
+    
+    # First attempt runs inline so uvicorn only accepts traffic once warm; if
+    # Mongo is not reachable yet, keep retrying in the background while
+    # readiness reports 503.
+    warmup_task = None
+    try:
+        await warm_up()
+        worker_state["ready"] = True
+    except Exception as e:
+        worker_state["last_error"] = str(e)
+        logger.warning("Warmup failed at startup, retrying in background: %s", e)
+        warmup_task = asyncio.create_task(warm_up_until_ready())
+    job_queue.start(db)
+    
+    yield
+    
+    worker_state["ready"] = False
+    if warmup_task:
+        warmup_task.cancel()
+    await job_queue.stop()
+    shutdown_render_pool()
+    client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Per route class concurrency limits (see admission.py)
+admission = AdmissionController()
+
+# Background jobs (see jobs.py); handlers are registered next to their routes
+job_queue = JobQueue()
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -50,6 +152,9 @@ ALGORITHM = "HS256"
 
 security = HTTPBearer()
 
+# Tank/equipment documents carry typeahead keys that are never returned
+RESOURCE_PROJECTION = {"_id": 0, "search_terms": 0}
+
 # Helper functions
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -82,6 +187,8 @@ class DeliverySite(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     address: str
+    lat: Optional[float] = None  # Optional coordinates, used by dispatch planning
+    lon: Optional[float] = None
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -157,6 +264,7 @@ class Booking(BaseModel):
     status: str = "pending"  # pending, confirmed, in_transit, delivered, cancelled
     selected_tanks: Optional[List[dict]] = []  # List of {id, name, identifier, capacity, location_address}
     selected_equipment: Optional[List[dict]] = []  # List of {id, name, unit_number, license_plate, capacity, location_address}
+    pricing_version: Optional[int] = None  # pricing_versions.version; the rates below are filled in from it
     rack_price: Optional[float] = None
     customer_price_modifier: Optional[float] = None
     fuel_price_per_liter: float
@@ -169,6 +277,8 @@ class Booking(BaseModel):
     ordered_amount: Optional[float] = None  # Ordered liters
     dispensed_amount: Optional[float] = None  # Actually dispensed liters
     invoice_images: Optional[List[str]] = []  # List of image file paths
+    dispatch_plan_id: Optional[str] = None  # Set when a dispatch plan confirms the booking
+    dispatch_run_ids: Optional[List[str]] = None  # More than one when split across trucks
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -194,6 +304,35 @@ class BookingUpdate(BaseModel):
     ordered_amount: Optional[float] = None
     dispensed_amount: Optional[float] = None
 
+class BookingSearchResult(BaseModel):
+    items: List[Booking]
+    page: int
+    page_size: int
+    total: int
+    total_is_exact: bool  # False when the count hit SEARCH_COUNT_LIMIT
+
+class CustomerOverview(BaseModel):
+    id: str
+    email: str
+    name: str
+    price_modifier: float = 0.0
+    created_at: Optional[str] = None
+    delivery_sites: int = 0
+    bookings: int = 0
+    open_bookings: int = 0  # pending, confirmed or in transit
+    delivered_bookings: int = 0
+    lifetime_liters: float = 0.0
+    lifetime_revenue: float = 0.0
+    last_booking_at: Optional[str] = None
+    tanks: int = 0
+    equipment: int = 0
+
+class CustomerOverviewResult(BaseModel):
+    items: List[CustomerOverview]
+    page: int
+    page_size: int
+    total: int
+
 class InvoiceUpdate(BaseModel):
     ordered_amount: Optional[float] = None
     dispensed_amount: Optional[float] = None
@@ -207,6 +346,7 @@ class DeliveryLog(BaseModel):
     liters_delivered: float
     delivery_time: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     notes: Optional[str] = None
+    client_log_id: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class DeliveryLogCreate(BaseModel):
@@ -216,9 +356,16 @@ class DeliveryLogCreate(BaseModel):
     liters_delivered: float
     notes: Optional[str] = None
 
+# One line of POST /logs/bulk: logs recorded offline keep their delivery time
+class DeliveryLogIngest(DeliveryLogCreate):
+    client_log_id: str = Field(min_length=1, max_length=128)
+    delivery_time: Optional[str] = None
+
 class PricingConfig(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: Optional[int] = None
+    effective_from: Optional[str] = None
     rack_price: float  # Daily base rate from pipeline
     federal_carbon_tax: float
     quebec_carbon_tax: float
@@ -252,7 +399,8 @@ async def register(user_data: UserRegister):
     )
     
     doc = user.model_dump()
-    doc['password'] = hash_password(user_data.password)
+    doc['password'] = await asyncio.to_thread(hash_password, user_data.password)
+    doc.update(user_search_fields(doc))
     
     await db.users.insert_one(doc)
     return user
@@ -260,7 +408,8 @@ async def register(user_data: UserRegister):
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user['password']):
+    # bcrypt runs in a worker thread so a login storm does not block the event loop
+    if not user or not await asyncio.to_thread(verify_password, credentials.password, user['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"user_id": user['id'], "role": user['role']})
@@ -279,22 +428,26 @@ async def login(credentials: UserLogin):
 async def get_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
+# Pricing versions (see pricing_history.py). The current version is cached per
+# worker; update_pricing refreshes it immediately, other workers pick up a new
+# version within PRICING_CACHE_TTL_SECONDS.
+pricing_history = PricingHistory()
+
+async def get_pricing_snapshot(refresh: bool = False) -> dict:
+    pricing = await pricing_history.current(db, refresh=refresh)
+    if pricing is None:
+        await pricing_history.ensure_seeded(db, DEFAULT_PRICING)
+        pricing = await pricing_history.current(db, refresh=True)
+    return pricing
+
+def pricing_config(version: dict) -> dict:
+    # Version document in the shape GET /pricing has always returned
+    return {**version, "id": str(version['version']), "updated_at": version['effective_from']}
+
 # Pricing Routes
 @api_router.get("/pricing", response_model=PricingConfig)
 async def get_pricing():
-    pricing = await db.pricing.find_one({}, {"_id": 0})
-    if not pricing:
-        # Create default pricing
-        default_pricing = PricingConfig(
-            rack_price=1.50,
-            federal_carbon_tax=0.14,
-            quebec_carbon_tax=0.05,
-            gst_rate=0.05,
-            qst_rate=0.09975
-        )
-        await db.pricing.insert_one(default_pricing.model_dump())
-        return default_pricing
-    return pricing
+    return pricing_config(await get_pricing_snapshot())
 
 @api_router.put("/pricing")
 async def update_pricing(pricing_data: PricingConfigUpdate, current_user: dict = Depends(get_current_user)):
@@ -302,77 +455,131 @@ async def update_pricing(pricing_data: PricingConfigUpdate, current_user: dict =
         raise HTTPException(status_code=403, detail="Admin access required")
     
     update_data = {k: v for k, v in pricing_data.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-    
-    await db.pricing.update_one({}, {"$set": update_data}, upsert=True)
+    await get_pricing_snapshot()  # seeds version 1 on a fresh database
+    version = await pricing_history.publish(db, update_data, created_by=current_user['id'])
+    return pricing_config(version)
+
+PRICING_HISTORY_MAX_LIMIT = 500
+
+@api_router.get("/pricing/history")
+async def get_pricing_history(
+    limit: int = Query(50, ge=1, le=PRICING_HISTORY_MAX_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await pricing_history.history(db, limit)
+
+# Rates in effect at a point in time (ISO 8601, e.g. 2025-01-31T12:00:00+00:00)
+@api_router.get("/pricing/as-of")
+async def get_pricing_as_of(at: str, current_user: dict = Depends(get_current_user)):
+    try:
+        moment = datetime.fromisoformat(at.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="at must be an ISO 8601 timestamp")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
     
-    pricing = await db.pricing.find_one({}, {"_id": 0})
-    return pricing
+    version = await pricing_history.as_of(db, moment.astimezone(timezone.utc).isoformat())
+    if not version:
+        raise HTTPException(status_code=404, detail="No pricing in effect at that time")
+    return pricing_config(version)
 
 # Calculate price helper
 async def calculate_booking_price(liters: float, customer_price_modifier: float = 0.0):
-    pricing = await db.pricing.find_one({}, {"_id": 0})
-    if not pricing:
-        pricing = {
-            'rack_price': 1.50,
-            'federal_carbon_tax': 0.14,
-            'quebec_carbon_tax': 0.05,
-            'gst_rate': 0.05,
-            'qst_rate': 0.09975
-        }
-    
-    # Calculate customer's final fuel price: rack price + customer modifier
-    customer_fuel_price = pricing['rack_price'] + customer_price_modifier
-    
-    fuel_cost = liters * customer_fuel_price
-    federal_tax = liters * pricing['federal_carbon_tax']
-    quebec_tax = liters * pricing['quebec_carbon_tax']
-    
-    subtotal = fuel_cost + federal_tax + quebec_tax
-    gst = subtotal * pricing['gst_rate']
-    qst = subtotal * pricing['qst_rate']
+    pricing = await get_pricing_snapshot()
+    return {**booking_price(pricing, liters, customer_price_modifier), 'pricing_version': pricing['version']}
+
+# Batch quotes (ERP integration): many lines priced in one vectorized pass
+QUOTE_MAX_LINES = int(os.environ.get('QUOTE_MAX_LINES', '100000'))
+
+class QuoteLine(BaseModel):
+    liters: float = Field(..., gt=0)
+    customer_id: Optional[str] = None
+    price_modifier: Optional[float] = None  # admin only; overrides the customer's modifier
+
+class QuoteRequest(BaseModel):
+    lines: List[QuoteLine] = Field(..., min_length=1, max_length=QUOTE_MAX_LINES)
+
+@api_router.post("/pricing/quote")
+async def quote_prices(quote: QuoteRequest, current_user: dict = Depends(get_current_user)):
+    is_admin = current_user['role'] == 'admin'
+    customer_ids = {line.customer_id for line in quote.lines if line.customer_id and line.price_modifier is None}
+    if not is_admin:
+        if any(line.price_modifier is not None for line in quote.lines) or customer_ids - {current_user['id']}:
+            raise HTTPException(status_code=403, detail="Customers can only quote their own pricing")
+    
+    modifiers_by_customer = {}
+    if customer_ids:
+        cursor = db.users.find({"id": {"$in": list(customer_ids)}}, {"_id": 0, "id": 1, "price_modifier": 1})
+        async for user in cursor:
+            modifiers_by_customer[user['id']] = user.get('price_modifier', 0.0)
+        unknown = customer_ids - modifiers_by_customer.keys()
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown customer ids: {sorted(unknown)[:10]}")
+    
+    # Customers without a customer_id on a line quote at their own modifier
+    default_modifier = 0.0 if is_admin else current_user.get('price_modifier', 0.0)
+    modifiers = [
+        line.price_modifier if line.price_modifier is not None
+        else modifiers_by_customer[line.customer_id] if line.customer_id
+        else default_modifier
+        for line in quote.lines
+    ]
     
-    total = subtotal + gst + qst
+    pricing = await get_pricing_snapshot()
+    columns = quote_columns(
+        pricing,
+        np.fromiter((line.liters for line in quote.lines), dtype=np.float64, count=len(quote.lines)),
+        np.array(modifiers, dtype=np.float64),
+    )
+    # Quotes are returned in request order
+    rows = quote_rows(columns)
     
-    return {
-        'rack_price': pricing['rack_price'],
-        'customer_price_modifier': customer_price_modifier,
-        'fuel_price_per_liter': customer_fuel_price,
-        'federal_carbon_tax': pricing['federal_carbon_tax'],
-        'quebec_carbon_tax': pricing['quebec_carbon_tax'],
-        'gst_rate': pricing['gst_rate'],
-        'qst_rate': pricing['qst_rate'],
-        'subtotal': round(subtotal, 2),
-        'total_price': round(total, 2)
-    }
+    rates = {key: pricing[key] for key in ('version', 'rack_price', 'federal_carbon_tax', 'quebec_carbon_tax', 'gst_rate', 'qst_rate')}
+    # Plain floats/strings only, so skip FastAPI's per-field jsonable_encoder pass
+    return JSONResponse({"pricing": rates, "count": len(rows), "quotes": rows})
 
 # Booking Routes
+# Retries carrying the same Idempotency-Key get the first response back
+# (see idempotency.py)
 @api_router.post("/bookings", response_model=Booking)
-async def create_booking(booking_data: BookingCreate, current_user: dict = Depends(get_current_user)):
+async def create_booking(
+    booking_data: BookingCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    return await idempotent(
+        db, idempotency_key, current_user['id'], "POST /bookings", booking_data,
+        lambda: insert_booking(booking_data, current_user),
+    )
+
+async def insert_booking(booking_data: BookingCreate, current_user: dict) -> Booking:
     # Get customer's price modifier
     customer_price_modifier = current_user.get('price_modifier', 0.0)
     price_info = await calculate_booking_price(booking_data.fuel_quantity_liters, customer_price_modifier)
     
-    # Fetch tank details if selected_tank_ids provided
+    # Selected tanks/equipment are stored as references with the minimal
+    # snapshot an invoice needs (see booking_refs.py)
     selected_tanks = []
     if booking_data.selected_tank_ids:
         tanks_cursor = db.fuel_tanks.find(
             {"id": {"$in": booking_data.selected_tank_ids}, "user_id": current_user['id']},
-            {"_id": 0}
+            {"_id": 0, **{field: 1 for field in TANK_SNAPSHOT_FIELDS}}
         )
         selected_tanks = await tanks_cursor.to_list(length=None)
     
-    # Fetch equipment details if selected_equipment_ids provided
     selected_equipment = []
     if booking_data.selected_equipment_ids:
         equipment_cursor = db.customer_equipment.find(
             {"id": {"$in": booking_data.selected_equipment_ids}, "user_id": current_user['id']},
-            {"_id": 0}
+            {"_id": 0, **{field: 1 for field in EQUIPMENT_SNAPSHOT_FIELDS}}
         )
         selected_equipment = await equipment_cursor.to_list(length=None)
     
     # Create booking dict
     booking_dict = booking_data.model_dump(exclude={'selected_tank_ids', 'selected_equipment_ids'})
+    booking_dict['delivery_locations'] = compact_delivery_locations(booking_dict['delivery_locations'])
     booking = Booking(
         user_id=current_user['id'],
         user_name=current_user['name'],
@@ -383,19 +590,143 @@ async def create_booking(booking_data: BookingCreate, current_user: dict = Depen
         **price_info
     )
     
-    await db.bookings.insert_one(booking.model_dump())
+    # Rates are not copied onto the stored booking, only the pricing version
+    await db.bookings.insert_one(encode_booking(booking.model_dump(exclude=DERIVED_BOOKING_FIELDS)))
     return booking
 
+# ?expand=tanks,equipment on booking reads: resolve the stored references
+def expand_options(expand: Optional[str] = None) -> set:
+    try:
+        return parse_expand(expand)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def prepare_bookings(bookings: list, expand: set) -> list:
+    # Stored documents -> API shape (see booking_codec.py, pricing_history.py)
+    bookings = await pricing_history.expand(db, [decode_booking(b) for b in bookings])
+    return await expand_references(db, bookings, expand, RESOURCE_PROJECTION)
+
 @api_router.get("/bookings", response_model=List[Booking])
-async def get_bookings(current_user: dict = Depends(get_current_user)):
+async def get_bookings(expand: set = Depends(expand_options), current_user: dict = Depends(get_current_user)):
     if current_user['role'] == 'admin':
-        bookings = await db.bookings.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+        bookings = await lists_db.bookings.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    else:
+        bookings = await lists_db.bookings.find({"user_id": current_user['id']}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return await prepare_bookings(bookings, expand)
+
+# Booking search: filtering, sorting and paging happen in Mongo on the
+# compound indexes declared for bookings in db_indexes.py
+SEARCH_MAX_PAGE_SIZE = 200
+SEARCH_COUNT_LIMIT = 10000
+BOOKING_SORT_FIELDS = {"created_at", "preferred_date", "fuel_quantity_liters", "total_price", "status"}
+
+def booking_filters(
+    status: Optional[List[str]] = Query(None),
+    fuel_type: Optional[List[str]] = Query(None),
+    customer_id: Optional[str] = None,
+    preferred_date_from: Optional[str] = None,
+    preferred_date_to: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    min_liters: Optional[float] = None,
+    max_liters: Optional[float] = None,
+) -> dict:
+    # Values are matched in their stored encoding (see booking_codec.py)
+    query = {}
+    if status:
+        query['status'] = {"$in": encode_enums('status', status)}
+    if fuel_type:
+        query['fuel_type'] = {"$in": encode_enums('fuel_type', fuel_type)}
+    if customer_id:
+        query['user_id'] = customer_id
+    try:
+        # Dates are inclusive of the whole end day
+        for field, first, last in (
+            ('preferred_date', preferred_date_from, preferred_date_to),
+            ('created_at', created_from, created_to),
+        ):
+            bounds = day_range(first, last)
+            if bounds:
+                query[field] = bounds
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    liters = {}
+    if min_liters is not None:
+        liters['$gte'] = min_liters
+    if max_liters is not None:
+        liters['$lte'] = max_liters
+    if liters:
+        query['fuel_quantity_liters'] = liters
+    return query
+
+def scope_bookings_query(query: dict, current_user: dict) -> dict:
+    # Customers only ever see their own bookings, whatever filter they send
+    if current_user['role'] != 'admin':
+        query = {**query, 'user_id': current_user['id']}
+    return query
+
+@api_router.get("/bookings/search", response_model=BookingSearchResult)
+async def search_bookings(
+    query: dict = Depends(booking_filters),
+    sort: str = "created_at",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    expand: set = Depends(expand_options),
+    current_user: dict = Depends(get_current_user)
+):
+    if sort not in BOOKING_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {sorted(BOOKING_SORT_FIELDS)}")
+    
+    query = scope_bookings_query(query, current_user)
+    direction = 1 if order == "asc" else -1
+    
+    cursor = lists_db.bookings.find(query, {"_id": 0}).sort([(sort, direction), ("id", direction)])
+    items = await cursor.skip((page - 1) * page_size).limit(page_size).to_list(page_size)
+    
+    if query:
+        total = await lists_db.bookings.count_documents(query, limit=SEARCH_COUNT_LIMIT)
+        total_is_exact = total < SEARCH_COUNT_LIMIT
     else:
-        bookings = await db.bookings.find({"user_id": current_user['id']}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return bookings
+        total = await lists_db.bookings.estimated_document_count()
+        total_is_exact = False
+    
+    return {
+        "items": await prepare_bookings(items, expand),
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "total_is_exact": total_is_exact
+    }
+
+# Streaming export for accounting (same filters as /bookings/search)
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv"),
+    "parquet": (stream_parquet, "application/vnd.apache.parquet"),
+}
+
+@api_router.get("/bookings/export")
+async def export_bookings(
+    query: dict = Depends(booking_filters),
+    format: str = "csv",
+    current_user: dict = Depends(get_current_user)
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(EXPORT_FORMATS)}")
+    
+    stream, media_type = EXPORT_FORMATS[format]
+    # Bookings may lag on a secondary, but pricing versions are read from the
+    # primary so a version created in the staleness window is never missing
+    cursor = export_cursor(analytics_db, scope_bookings_query(query, current_user))
+    filename = f"bookings_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(
+        stream(pricing_history.expand_stream(db, decode_stream(cursor))),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @api_router.get("/bookings/{booking_id}", response_model=Booking)
-async def get_booking(booking_id: str, current_user: dict = Depends(get_current_user)):
+async def get_booking(booking_id: str, expand: set = Depends(expand_options), current_user: dict = Depends(get_current_user)):
     booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
@@ -403,7 +734,7 @@ async def get_booking(booking_id: str, current_user: dict = Depends(get_current_
     if current_user['role'] != 'admin' and booking['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return booking
+    return (await prepare_bookings([booking], expand))[0]
 
 @api_router.put("/bookings/{booking_id}")
 async def update_booking(booking_id: str, booking_update: BookingUpdate, current_user: dict = Depends(get_current_user)):
@@ -413,24 +744,53 @@ async def update_booking(booking_id: str, booking_update: BookingUpdate, current
     update_data = {k: v for k, v in booking_update.model_dump().items() if v is not None}
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
-    result = await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
+    before = decode_booking(await db.bookings.find_one_and_update(
+        {"id": booking_id},
+        {"$set": encode_booking(update_data)},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    ))
     
-    if result.matched_count == 0:
+    if not before:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    return booking
+    booking = {**before, **update_data}
+    await apply_rollup_change(db, before, booking)
+    return await pricing_history.expand_one(db, booking)
 
 # Delivery Logs Routes
 @api_router.post("/logs", response_model=DeliveryLog)
-async def create_log(log_data: DeliveryLogCreate, current_user: dict = Depends(get_current_user)):
+async def create_log(
+    log_data: DeliveryLogCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    return await idempotent(
+        db, idempotency_key, current_user['id'], "POST /logs", log_data,
+        lambda: insert_log(log_data),
+    )
+
+async def insert_log(log_data: DeliveryLogCreate) -> DeliveryLog:
     log = DeliveryLog(**log_data.model_dump())
     await db.delivery_logs.insert_one(log.model_dump())
     return log
 
+def ingest_log_document(line: bytes) -> dict:
+    data = DeliveryLogIngest.model_validate_json(line)
+    return DeliveryLog(**data.model_dump(exclude_none=True)).model_dump()
+
+# NDJSON body, one DeliveryLogIngest per line; results are reported per line
+# (see log_ingest.py)
+@api_router.post("/logs/bulk")
+async def ingest_logs(request: Request, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await LogIngest(db, ingest_log_document).run(request.stream())
+
 @api_router.get("/logs", response_model=List[DeliveryLog])
 async def get_logs(booking_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
@@ -440,7 +800,7 @@ async def get_logs(booking_id: Optional[str] = None, current_user: dict = Depend
     if booking_id:
         query['booking_id'] = booking_id
     
-    logs = await db.delivery_logs.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    logs = await lists_db.delivery_logs.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
     return logs
 
 @api_router.get("/logs/booking/{booking_id}", response_model=List[DeliveryLog])
@@ -456,19 +816,71 @@ async def get_logs_by_booking(booking_id: str, current_user: dict = Depends(get_
     logs = await db.delivery_logs.find({"booking_id": booking_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
     return logs
 
+# Truck telemetry (time-series collection, see telemetry.py)
+class TelemetryReading(BaseModel):
+    ts: datetime
+    meter_liters: Optional[float] = None
+    flow_rate_lpm: Optional[float] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+
+class TelemetryUpload(BaseModel):
+    truck_license_plate: str = Field(..., min_length=1)
+    readings: List[TelemetryReading] = Field(..., min_length=1, max_length=TELEMETRY_MAX_READINGS)
+
+@api_router.post("/telemetry")
+async def ingest_telemetry(upload: TelemetryUpload, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    documents = reading_documents(upload.truck_license_plate, [r.model_dump() for r in upload.readings])
+    await db[TELEMETRY_COLLECTION].insert_many(documents, ordered=False)
+    return {"inserted": len(documents)}
+
+@api_router.get("/telemetry/latest")
+async def get_latest_telemetry(
+    minutes: int = Query(15, ge=1, le=1440),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await latest_readings(analytics_db, minutes)
+
+# Downsampled series: min/max/avg per interval (seconds; chosen automatically
+# when omitted)
+@api_router.get("/telemetry/{truck_license_plate}/series")
+async def get_telemetry_series(
+    truck_license_plate: str,
+    start: datetime,
+    end: datetime,
+    interval: Optional[int] = Query(None, ge=1, le=86400),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        interval = pick_interval(start, end, interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    points = await query_series(analytics_db, truck_license_plate, start, end, interval)
+    return {"truck_license_plate": truck_license_plate, "interval": interval, "points": points}
+
 # Stats for admin dashboard
 @api_router.get("/stats")
 async def get_stats(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    total_bookings = await db.bookings.count_documents({})
-    pending_bookings = await db.bookings.count_documents({"status": "pending"})
-    completed_bookings = await db.bookings.count_documents({"status": "delivered"})
-    total_customers = await db.users.count_documents({"role": "customer"})
+    total_bookings = await analytics_db.bookings.count_documents({})
+    pending_bookings = await analytics_db.bookings.count_documents({"status": encode_enum('status', "pending")})
+    completed_bookings = await analytics_db.bookings.count_documents({"status": encode_enum('status', "delivered")})
+    total_customers = await analytics_db.users.count_documents({"role": "customer"})
     
     # Calculate total revenue
-    bookings = await db.bookings.find({"status": "delivered"}, {"_id": 0}).to_list(10000)
+    cursor = analytics_db.bookings.find({"status": encode_enum('status', "delivered")}, {"_id": 0})
+    bookings = [decode_booking(b) for b in await cursor.to_list(10000)]
     total_revenue = sum(b.get('total_price', 0) for b in bookings)
     
     # Total liters delivered
@@ -483,15 +895,106 @@ async def get_stats(current_user: dict = Depends(get_current_user)):
         "total_liters_delivered": round(total_liters, 2)
     }
 
+# Revenue and volume analytics, read from the daily rollups (see rollups.py)
+@api_router.get("/analytics/revenue")
+async def get_revenue_analytics(
+    start: str = Query(..., pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    end: str = Query(..., pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    granularity: str = "day",
+    customer_id: Optional[str] = None,
+    fuel_type: Optional[str] = None,
+    group_by: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {list(GRANULARITIES)}")
+    dimensions = group_by.split(',') if group_by else []
+    if set(dimensions) - {"customer", "fuel_type"}:
+        raise HTTPException(status_code=400, detail="group_by accepts customer and fuel_type")
+    
+    series = await query_rollups(analytics_db, start, end, granularity, customer_id, fuel_type, dimensions)
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "group_by": dimensions,
+        "series": series
+    }
+
+# Runtime metrics for operators (per worker process)
+@api_router.get("/admin/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "mongo_pool": pool_metrics(client),
+        "read_routing": read_routing_metrics(read_dbs),
+        "admission": admission.snapshot(),
+        "pdf_render_pool": render_pool_stats(),
+        "jobs": await job_queue.metrics(db)
+    }
+
+# Background job status
+def job_accepted(job: dict) -> JSONResponse:
+    status_url = f"/api/jobs/{job['id']}"
+    return JSONResponse(
+        status_code=202,
+        content={**job, "status_url": status_url},
+        headers={"Location": status_url}
+    )
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await job_queue.get(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user['role'] != 'admin' and job['created_by'] != current_user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
+async def rollups_rebuild_job(payload: dict) -> dict:
+    return await rebuild_rollups(db)
+
+job_queue.register("rollups_rebuild", rollups_rebuild_job, concurrency=1, max_attempts=2)
+
+@api_router.post("/admin/rollups/rebuild", status_code=202)
+async def rebuild_rollups_in_background(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    job = await job_queue.enqueue(db, "rollups_rebuild", {}, created_by=current_user['id'])
+    return job_accepted(job)
+
 # Customer management routes for admin
 @api_router.get("/customers", response_model=List[User])
 async def get_customers(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    customers = await db.users.find({"role": "customer"}, {"_id": 0, "password": 0}).to_list(1000)
+    customers = await lists_db.users.find({"role": "customer"}, {"_id": 0, "password": 0}).to_list(1000)
     return customers
 
+# Customers with their booking/tank/equipment counts and lifetime totals,
+# joined server-side (see customer_overview.py)
+@api_router.get("/admin/customers/overview", response_model=CustomerOverviewResult)
+async def get_customer_overview(
+    sort: str = "name",
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if sort not in OVERVIEW_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {sorted(OVERVIEW_SORT_FIELDS)}")
+    
+    return await customer_overview(analytics_db, sort, 1 if order == "asc" else -1, page, page_size)
+
 @api_router.put("/customers/{customer_id}/pricing")
 async def update_customer_pricing(
     customer_id: str, 
@@ -509,7 +1012,10 @@ async def update_customer_pricing(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    customer = await db.users.find_one({"id": customer_id}, {"_id": 0, "password": 0})
+    customer = await db.users.find_one(
+        {"id": customer_id},
+        {"_id": 0, "password": 0, "search_terms": 0, "site_search_terms": 0}
+    )
     return customer
 
 
@@ -517,6 +1023,12 @@ async def update_customer_pricing(
 class DeliverySiteCreate(BaseModel):
     name: str
     address: str
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+
+def delivery_sites_update(user: dict, delivery_sites: List[dict]) -> dict:
+    # Keep the typeahead keys in sync with the saved sites
+    return {"delivery_sites": delivery_sites, **user_search_fields({**user, "delivery_sites": delivery_sites})}
 
 @api_router.get("/delivery-sites")
 async def get_delivery_sites(current_user: dict = Depends(get_current_user)):
@@ -531,13 +1043,15 @@ async def add_delivery_site(site_data: DeliverySiteCreate, current_user: dict =
     new_site = {
         "id": str(uuid.uuid4()),
         "name": site_data.name,
-        "address": site_data.address
+        "address": site_data.address,
+        "lat": site_data.lat,
+        "lon": site_data.lon
     }
     delivery_sites.append(new_site)
     
     await db.users.update_one(
         {"id": current_user['id']},
-        {"$set": {"delivery_sites": delivery_sites}}
+        {"$set": delivery_sites_update(user, delivery_sites)}
     )
     
     return new_site
@@ -553,6 +1067,8 @@ async def update_delivery_site(site_id: str, site_data: DeliverySiteCreate, curr
         if site['id'] == site_id:
             site['name'] = site_data.name
             site['address'] = site_data.address
+            site['lat'] = site_data.lat
+            site['lon'] = site_data.lon
             site_found = True
             break
     
@@ -561,10 +1077,10 @@ async def update_delivery_site(site_id: str, site_data: DeliverySiteCreate, curr
     
     await db.users.update_one(
         {"id": current_user['id']},
-        {"$set": {"delivery_sites": delivery_sites}}
+        {"$set": delivery_sites_update(user, delivery_sites)}
     )
     
-    return {"id": site_id, "name": site_data.name, "address": site_data.address}
+    return {"id": site_id, **site_data.model_dump()}
 
 @api_router.delete("/delivery-sites/{site_id}")
 async def delete_delivery_site(site_id: str, current_user: dict = Depends(get_current_user)):
@@ -579,7 +1095,7 @@ async def delete_delivery_site(site_id: str, current_user: dict = Depends(get_cu
     
     await db.users.update_one(
         {"id": current_user['id']},
-        {"$set": {"delivery_sites": delivery_sites}}
+        {"$set": delivery_sites_update(user, delivery_sites)}
     )
     
     return {"message": "Delivery site deleted successfully"}
@@ -587,29 +1103,56 @@ async def delete_delivery_site(site_id: str, current_user: dict = Depends(get_cu
 # Fuel Tanks Management
 @api_router.get("/fuel-tanks")
 async def get_fuel_tanks(current_user: dict = Depends(get_current_user)):
-    tanks = await db.fuel_tanks.find({"user_id": current_user['id']}, {"_id": 0}).to_list(1000)
+    tanks = await db.fuel_tanks.find({"user_id": current_user['id']}, RESOURCE_PROJECTION).to_list(1000)
     return tanks
 
+# Refill forecasts (see forecasting.py); admins may filter by customer
+@api_router.get("/fuel-tanks/due-soon")
+async def get_tanks_due_soon(
+    days: int = Query(7, ge=0, le=365),
+    customer_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    user_id = customer_id if current_user['role'] == 'admin' else current_user['id']
+    return await due_soon(analytics_db, days, user_id)
+
+async def tank_forecast_job(payload: dict) -> dict:
+    return await rebuild_forecasts(db)
+
+job_queue.register("tank_forecast", tank_forecast_job, concurrency=1, max_attempts=2)
+
+@api_router.post("/admin/forecasts/rebuild", status_code=202)
+async def rebuild_forecasts_in_background(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    job = await job_queue.enqueue(db, "tank_forecast", {}, created_by=current_user['id'])
+    return job_accepted(job)
+
 @api_router.post("/fuel-tanks")
 async def create_fuel_tank(tank_data: FuelTankCreate, current_user: dict = Depends(get_current_user)):
     tank = FuelTank(**tank_data.model_dump(), id=str(uuid.uuid4()))
     doc = tank.model_dump()
     doc['user_id'] = current_user['id']
+    doc['search_terms'] = tank_search_terms(doc)
     
     await db.fuel_tanks.insert_one(doc)
     return tank
 
 @api_router.put("/fuel-tanks/{tank_id}")
 async def update_fuel_tank(tank_id: str, tank_data: FuelTankCreate, current_user: dict = Depends(get_current_user)):
+    update_data = tank_data.model_dump()
+    update_data['search_terms'] = tank_search_terms(update_data)
+    
     result = await db.fuel_tanks.update_one(
         {"id": tank_id, "user_id": current_user['id']},
-        {"$set": tank_data.model_dump()}
+        {"$set": update_data}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Fuel tank not found")
     
-    tank = await db.fuel_tanks.find_one({"id": tank_id}, {"_id": 0})
+    tank = await db.fuel_tanks.find_one({"id": tank_id}, RESOURCE_PROJECTION)
     return tank
 
 @api_router.delete("/fuel-tanks/{tank_id}")
@@ -624,7 +1167,7 @@ async def delete_fuel_tank(tank_id: str, current_user: dict = Depends(get_curren
 # Customer Equipment Management
 @api_router.get("/equipment")
 async def get_equipment(current_user: dict = Depends(get_current_user)):
-    equipment = await db.customer_equipment.find({"user_id": current_user['id']}, {"_id": 0}).to_list(1000)
+    equipment = await db.customer_equipment.find({"user_id": current_user['id']}, RESOURCE_PROJECTION).to_list(1000)
     return equipment
 
 @api_router.post("/equipment")
@@ -632,21 +1175,25 @@ async def create_equipment(equipment_data: CustomerEquipmentCreate, current_user
     equipment = CustomerEquipment(**equipment_data.model_dump(), id=str(uuid.uuid4()))
     doc = equipment.model_dump()
     doc['user_id'] = current_user['id']
+    doc['search_terms'] = equipment_search_terms(doc)
     
     await db.customer_equipment.insert_one(doc)
     return equipment
 
 @api_router.put("/equipment/{equipment_id}")
 async def update_equipment(equipment_id: str, equipment_data: CustomerEquipmentCreate, current_user: dict = Depends(get_current_user)):
+    update_data = equipment_data.model_dump()
+    update_data['search_terms'] = equipment_search_terms(update_data)
+    
     result = await db.customer_equipment.update_one(
         {"id": equipment_id, "user_id": current_user['id']},
-        {"$set": equipment_data.model_dump()}
+        {"$set": update_data}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
-    equipment = await db.customer_equipment.find_one({"id": equipment_id}, {"_id": 0})
+    equipment = await db.customer_equipment.find_one({"id": equipment_id}, RESOURCE_PROJECTION)
     return equipment
 
 @api_router.delete("/equipment/{equipment_id}")
@@ -668,10 +1215,11 @@ async def update_invoice(
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # Get current booking
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    # Get current booking (with the rates of its pricing version)
+    booking = decode_booking(await db.bookings.find_one({"id": booking_id}, {"_id": 0}))
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
+    booking = await pricing_history.expand_one(db, booking)
     
     update_fields = {k: v for k, v in invoice_data.model_dump().items() if v is not None}
     update_fields['updated_at'] = datetime.now(timezone.utc).isoformat()
@@ -695,16 +1243,19 @@ async def update_invoice(
         update_fields['subtotal'] = round(subtotal, 2)
         update_fields['total_price'] = round(total, 2)
     
-    result = await db.bookings.update_one(
+    before = decode_booking(await db.bookings.find_one_and_update(
         {"id": booking_id},
-        {"$set": update_fields}
-    )
+        {"$set": encode_booking(update_fields)},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    ))
     
-    if result.matched_count == 0:
+    if not before:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    return booking
+    booking = {**before, **update_fields}
+    await apply_rollup_change(db, before, booking)
+    return await pricing_history.expand_one(db, booking)
 
 # Image Upload for Invoices
 @api_router.post("/invoices/{booking_id}/upload-image")
@@ -726,20 +1277,15 @@ async def upload_invoice_image(
     if len(current_images) >= 5:
         raise HTTPException(status_code=400, detail="Maximum 5 images allowed per invoice")
     
-    # Save file
+    # Save file (content-addressed, identical photos are stored once)
     file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    file_name = f"{booking_id}_{uuid.uuid4()}.{file_ext}"
-    file_path = INVOICE_IMAGES_DIR / file_name
-    
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    file_name = await store_upload(db, INVOICE_IMAGES_DIR, file.file, file_ext)
     
     # Update booking with image path
     current_images.append(file_name)
     await db.bookings.update_one(
         {"id": booking_id},
-        {"$set": {"invoice_images": current_images, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": encode_booking({"invoice_images": current_images, "updated_at": datetime.now(timezone.utc).isoformat()})}
     )
     
     return {"filename": file_name, "message": "Image uploaded successfully"}
@@ -761,26 +1307,28 @@ async def delete_invoice_image(
     if image_filename not in current_images:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Delete file
-    file_path = INVOICE_IMAGES_DIR / image_filename
-    if file_path.exists():
-        file_path.unlink()
+    # Drop this booking's reference; the file goes when nothing references it
+    await release_image(db, INVOICE_IMAGES_DIR, image_filename)
     
     # Update booking
     current_images.remove(image_filename)
     await db.bookings.update_one(
         {"id": booking_id},
-        {"$set": {"invoice_images": current_images, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": encode_booking({"invoice_images": current_images, "updated_at": datetime.now(timezone.utc).isoformat()})}
     )
     
     return {"message": "Image deleted successfully"}
 
 @api_router.get("/invoices/{booking_id}/images/{image_filename}")
-async def get_invoice_image(booking_id: str, image_filename: str):
-    file_path = INVOICE_IMAGES_DIR / image_filename
-    if not file_path.exists():
+async def get_invoice_image(booking_id: str, image_filename: str, request: Request):
+    # Filenames are content digests, so the response is cached as immutable
+    # and repeat views are answered with 304 (see file_responses.py)
+    response = await asyncio.to_thread(
+        immutable_file_response, image_path(INVOICE_IMAGES_DIR, image_filename), INVOICE_IMAGES_DIR, request.headers
+    )
+    if response is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(file_path)
+    return response
 
 # PDF Export
 @api_router.get("/invoices/{booking_id}/export-pdf")
@@ -793,118 +1341,139 @@ async def export_invoice_pdf(booking_id: str, current_user: dict = Depends(get_c
     if current_user['role'] != 'admin' and booking['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Create PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph(f"<b>INVOICE - FuelTrack</b>", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Booking Info
-    info_data = [
-        ['Invoice Number:', booking['id']],
-        ['Customer:', booking['user_name']],
-        ['Email:', booking['user_email']],
-        ['Date:', booking['created_at'][:10]],
-        ['Status:', booking['status'].upper()],
-    ]
-    info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(info_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Delivery Details
-    delivery_data = [
-        ['Delivery Address:', booking['delivery_address']],
-        ['Fuel Type:', booking['fuel_type'].upper()],
-        ['Preferred Date:', booking['preferred_date']],
-        ['Preferred Time:', booking['preferred_time']],
-    ]
-    if booking.get('ordered_amount'):
-        delivery_data.append(['Ordered Amount:', f"{booking['ordered_amount']} L"])
-    if booking.get('dispensed_amount'):
-        delivery_data.append(['Dispensed Amount:', f"{booking['dispensed_amount']} L"])
-    
-    delivery_table = Table(delivery_data, colWidths=[2*inch, 4*inch])
-    delivery_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(delivery_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Price Breakdown
-    price_header = Paragraph("<b>Price Breakdown</b>", styles['Heading2'])
-    elements.append(price_header)
-    elements.append(Spacer(1, 0.1*inch))
-    
-    # Use dispensed amount if available, otherwise use fuel_quantity_liters
-    quantity_for_price = booking.get('dispensed_amount', booking["fuel_quantity_liters"])
-    quantity_label = f"Dispensed: {quantity_for_price}L" if booking.get('dispensed_amount') else f"{quantity_for_price}L"
-    
-    price_data = [
-        ['Description', 'Rate/Amount', 'Total'],
-        [f'Fuel Price ({quantity_label})', f'${booking["fuel_price_per_liter"]:.4f}/L', f'${quantity_for_price * booking["fuel_price_per_liter"]:.2f}'],
-        [f'Federal Carbon Tax ({quantity_label})', f'${booking["federal_carbon_tax"]:.4f}/L', f'${quantity_for_price * booking["federal_carbon_tax"]:.2f}'],
-        [f'Quebec Carbon Tax ({quantity_label})', f'${booking["quebec_carbon_tax"]:.4f}/L', f'${quantity_for_price * booking["quebec_carbon_tax"]:.2f}'],
-        ['Subtotal', '', f'${booking["subtotal"]:.2f}'],
-        [f'GST ({booking["gst_rate"]*100:.2f}%)', '', f'${booking["subtotal"] * booking["gst_rate"]:.2f}'],
-        [f'QST ({booking["qst_rate"]*100:.4f}%)', '', f'${booking["subtotal"] * booking["qst_rate"]:.2f}'],
-        ['TOTAL', '', f'${booking["total_price"]}'],
-    ]
-    
-    price_table = Table(price_data, colWidths=[3*inch, 1.5*inch, 1.5*inch])
-    price_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 12),
-    ]))
-    elements.append(price_table)
-    
-    # Add images if they exist
-    invoice_images = booking.get('invoice_images', [])
-    if invoice_images:
-        elements.append(Spacer(1, 0.3*inch))
-        elements.append(Paragraph("<b>Attached Images</b>", styles['Heading2']))
-        elements.append(Spacer(1, 0.1*inch))
-        
-        for img_name in invoice_images[:5]:
-            img_path = INVOICE_IMAGES_DIR / img_name
-            if img_path.exists():
-                try:
-                    img = RLImage(str(img_path), width=4*inch, height=3*inch)
-                    elements.append(img)
-                    elements.append(Spacer(1, 0.1*inch))
-                except:
-                    pass
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
+    # Rendered in the PDF worker pool (the only processes that load ReportLab)
+    booking = await pricing_history.expand_one(db, decode_booking(booking))
+    pdf_bytes = await render_invoice_cached(booking, INVOICE_IMAGES_DIR, INVOICE_PDF_CACHE_DIR)
     
     return Response(
-        content=buffer.read(),
+        content=pdf_bytes,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=invoice_{booking_id}.pdf"}
     )
 
+async def invoice_pdf_job(payload: dict) -> dict:
+    booking = await db.bookings.find_one({"id": payload['booking_id']}, {"_id": 0})
+    if not booking:
+        raise PermanentJobError("Booking not found")
+    booking = await pricing_history.expand_one(db, decode_booking(booking))
+    await render_invoice_cached(booking, INVOICE_IMAGES_DIR, INVOICE_PDF_CACHE_DIR)
+    return {"download_url": f"/api/invoices/{booking['id']}/export-pdf"}
+
+job_queue.register("invoice_pdf", invoice_pdf_job, concurrency=2)
+
+# Render in the background: 202 with a job id; once the job has succeeded the
+# GET above serves the cached PDF.
+@api_router.post("/invoices/{booking_id}/export-pdf", status_code=202)
+async def queue_invoice_pdf(booking_id: str, current_user: dict = Depends(get_current_user)):
+    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "user_id": 1})
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if current_user['role'] != 'admin' and booking['user_id'] != current_user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    job = await job_queue.enqueue(db, "invoice_pdf", {"booking_id": booking_id}, created_by=current_user['id'])
+    return job_accepted(job)
+
+
+# Monthly statement: one PDF per customer and month (period = YYYY-MM)
+@api_router.get("/statements/{customer_id}/{period}")
+async def export_monthly_statement(
+    customer_id: str,
+    period: str = PathParam(..., pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin' and customer_id != current_user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    customer = await db.users.find_one({"id": customer_id}, {"_id": 0, "id": 1, "name": 1, "email": 1})
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    pdf_path = await render_statement_cached(
+        db, mongo_url, os.environ['DB_NAME'], customer, period, STATEMENT_CACHE_DIR
+    )
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        filename=f"statement_{customer_id}_{period}.pdf"
+    )
+
+async def statement_pdf_job(payload: dict) -> dict:
+    customer_id, period = payload['customer_id'], payload['period']
+    customer = await db.users.find_one({"id": customer_id}, {"_id": 0, "id": 1, "name": 1, "email": 1})
+    if not customer:
+        raise PermanentJobError("Customer not found")
+    await render_statement_cached(db, mongo_url, os.environ['DB_NAME'], customer, period, STATEMENT_CACHE_DIR)
+    return {"download_url": f"/api/statements/{customer_id}/{period}"}
+
+job_queue.register("statement_pdf", statement_pdf_job, concurrency=1)
+
+@api_router.post("/statements/{customer_id}/{period}", status_code=202)
+async def queue_monthly_statement(
+    customer_id: str,
+    period: str = PathParam(..., pattern=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin' and customer_id != current_user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not await db.users.find_one({"id": customer_id}, {"_id": 0, "id": 1}):
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    job = await job_queue.enqueue(
+        db, "statement_pdf", {"customer_id": customer_id, "period": period}, created_by=current_user['id']
+    )
+    return job_accepted(job)
+
+# Dispatch planning (see dispatch.py): preview by default, commit=true stores
+# the plan and confirms the planned bookings
+class DispatchPlanRequest(BaseModel):
+    date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$")
+    truck_capacity_liters: float = Field(DISPATCH_TRUCK_CAPACITY_LITERS, gt=0)
+    window_minutes: int = Field(DISPATCH_WINDOW_MINUTES, ge=15, le=1440)
+    commit: bool = False
+
+@api_router.post("/admin/dispatch/plan")
+async def plan_dispatch(request: DispatchPlanRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        plan = await build_plan(db, request.date, request.truck_capacity_liters, request.window_minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.commit:
+        plan = await commit_plan(db, plan, current_user['id'])
+    return plan
+
+@api_router.get("/admin/dispatch/plans/{plan_id}")
+async def get_dispatch_plan(plan_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    plan = await db[DISPATCH_PLANS].find_one({"id": plan_id}, PLAN_PROJECTION)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Dispatch plan not found")
+    return plan
+
+# Batch export: every matching invoice in one streamed ZIP
+@api_router.get("/admin/invoices/export-zip")
+async def export_invoices_zip(
+    query: dict = Depends(booking_filters),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    cursor = analytics_db.bookings.find(query, {"_id": 0}).sort("created_at", 1).batch_size(100)
+    filename = f"invoices_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_invoice_zip(
+            pricing_history.expand_stream(db, decode_stream(cursor)), INVOICE_IMAGES_DIR, INVOICE_PDF_CACHE_DIR
+        ),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 
 # Admin-only Tank and Equipment Management (for all customers)
 class AdminTankCreate(BaseModel):
@@ -920,12 +1489,33 @@ class AdminEquipmentCreate(BaseModel):
     license_plate: str
     capacity: Optional[float] = None
 
+# Typeahead for admin pickers (customers, delivery sites, tanks, equipment)
+TYPEAHEAD_TYPES = ["customers", "sites", "tanks", "equipment"]
+TYPEAHEAD_MAX_LIMIT = 50
+
+@api_router.get("/admin/search")
+async def admin_typeahead_search(
+    q: str = Query(..., min_length=1, max_length=100),
+    types: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=TYPEAHEAD_MAX_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    requested = types.split(',') if types else TYPEAHEAD_TYPES
+    unknown = set(requested) - set(TYPEAHEAD_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {sorted(unknown)}")
+    
+    return await typeahead_search(db, q, requested, limit)
+
 @api_router.get("/admin/fuel-tanks")
 async def admin_get_all_fuel_tanks(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    tanks = await db.fuel_tanks.find({}, {"_id": 0}).to_list(10000)
+    tanks = await lists_db.fuel_tanks.find({}, RESOURCE_PROJECTION).to_list(10000)
     return tanks
 
 @api_router.post("/admin/fuel-tanks")
@@ -941,6 +1531,7 @@ async def admin_create_fuel_tank(tank_data: AdminTankCreate, current_user: dict
     )
     doc = tank.model_dump()
     doc['user_id'] = tank_data.user_id
+    doc['search_terms'] = tank_search_terms(doc)
     
     await db.fuel_tanks.insert_one(doc)
     return tank
@@ -950,15 +1541,18 @@ async def admin_update_fuel_tank(tank_id: str, tank_data: FuelTankCreate, curren
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    update_data = tank_data.model_dump()
+    update_data['search_terms'] = tank_search_terms(update_data)
+    
     result = await db.fuel_tanks.update_one(
         {"id": tank_id},
-        {"$set": tank_data.model_dump()}
+        {"$set": update_data}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Fuel tank not found")
     
-    tank = await db.fuel_tanks.find_one({"id": tank_id}, {"_id": 0})
+    tank = await db.fuel_tanks.find_one({"id": tank_id}, RESOURCE_PROJECTION)
     return tank
 
 @api_router.delete("/admin/fuel-tanks/{tank_id}")
@@ -978,7 +1572,7 @@ async def admin_get_all_equipment(current_user: dict = Depends(get_current_user)
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    equipment = await db.customer_equipment.find({}, {"_id": 0}).to_list(10000)
+    equipment = await lists_db.customer_equipment.find({}, RESOURCE_PROJECTION).to_list(10000)
     return equipment
 
 @api_router.post("/admin/equipment")
@@ -995,6 +1589,7 @@ async def admin_create_equipment(equipment_data: AdminEquipmentCreate, current_u
     )
     doc = equipment.model_dump()
     doc['user_id'] = equipment_data.user_id
+    doc['search_terms'] = equipment_search_terms(doc)
     
     await db.customer_equipment.insert_one(doc)
     return equipment
@@ -1004,15 +1599,18 @@ async def admin_update_equipment(equipment_id: str, equipment_data: CustomerEqui
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    update_data = equipment_data.model_dump()
+    update_data['search_terms'] = equipment_search_terms(update_data)
+    
     result = await db.customer_equipment.update_one(
         {"id": equipment_id},
-        {"$set": equipment_data.model_dump()}
+        {"$set": update_data}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
-    equipment = await db.customer_equipment.find_one({"id": equipment_id}, {"_id": 0})
+    equipment = await db.customer_equipment.find_one({"id": equipment_id}, RESOURCE_PROJECTION)
     return equipment
 
 @api_router.delete("/admin/equipment/{equipment_id}")
@@ -1027,9 +1625,32 @@ async def admin_delete_equipment(equipment_id: str, current_user: dict = Depends
     
     return {"message": "Equipment deleted successfully"}
 
+# Health probes (outside /api so load balancers can reach them without auth)
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    if not worker_state["ready"]:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "starting", "last_error": worker_state["last_error"]}
+        )
+    
+    try:
+        await asyncio.wait_for(client.admin.command('ping'), READINESS_PING_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "mongo_unavailable", "last_error": str(e)})
+    
+    return {"status": "ready", "indexes": worker_state["indexes"]}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so that 503 responses still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware, controller=admission)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1043,8 +1664,4 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+logger = logging.getLogger(__name__)
\ No newline at end of file
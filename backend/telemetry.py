@@ -0,0 +1,131 @@
+# Truck telemetry: meter reading, flow rate and position, up to one reading
+# per second per truck.
+#
+# Readings go to a MongoDB time-series collection (timeField "ts", metaField
+# "truck" = license plate, granularity seconds), which stores them as
+# compressed per-truck buckets; points expire after TELEMETRY_RETENTION_DAYS.
+# Dashboards never download raw points: series queries are downsampled in
+# the aggregation pipeline to min/max/avg per interval (plus the last
+# position), with the interval chosen so a window returns at most
+# TELEMETRY_MAX_POINTS buckets.
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_COLLECTION = "truck_telemetry"
+TELEMETRY_RETENTION_DAYS = int(os.environ.get('TELEMETRY_RETENTION_DAYS', '90'))
+TELEMETRY_MAX_READINGS = int(os.environ.get('TELEMETRY_MAX_READINGS', '5000'))
+TELEMETRY_MAX_POINTS = int(os.environ.get('TELEMETRY_MAX_POINTS', '2000'))
+TELEMETRY_DEFAULT_POINTS = int(os.environ.get('TELEMETRY_DEFAULT_POINTS', '500'))
+TELEMETRY_MAX_WINDOW_DAYS = int(os.environ.get('TELEMETRY_MAX_WINDOW_DAYS', '31'))
+
+# Numeric measurements that are downsampled to min/max/avg
+MEASUREMENTS = ("meter_liters", "flow_rate_lpm")
+POSITION_FIELDS = ("lat", "lon")
+# Intervals (seconds) picked for automatic downsampling
+NICE_INTERVALS = (1, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+
+async def ensure_telemetry_collection(db) -> str:
+    # Time-series options can only be given at creation; an existing
+    # collection is left as it is
+    try:
+        try:
+            await db.create_collection(
+                TELEMETRY_COLLECTION,
+                timeseries={"timeField": "ts", "metaField": "truck", "granularity": "seconds"},
+                expireAfterSeconds=TELEMETRY_RETENTION_DAYS * 86400,
+            )
+        except CollectionInvalid:
+            pass
+        # Created automatically from MongoDB 6.3 on (same spec and default
+        # name, so this is a no-op there)
+        await db[TELEMETRY_COLLECTION].create_index([("truck", ASCENDING), ("ts", ASCENDING)])
+    except OperationFailure as e:
+        logger.error("Failed to set up %s: %s", TELEMETRY_COLLECTION, e)
+        return str(e)
+    return "ok"
+
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def reading_documents(truck: str, readings: list) -> list:
+    # readings: dicts with ts (datetime) and any measurement / position
+    # fields; absent fields are left out of the stored point
+    return [
+        {"ts": as_utc(reading['ts']), "truck": truck,
+         **{field: reading[field] for field in MEASUREMENTS + POSITION_FIELDS if reading.get(field) is not None}}
+        for reading in readings
+    ]
+
+def pick_interval(start: datetime, end: datetime, interval: Optional[int]) -> int:
+    # Raises ValueError when the window or the requested interval is out of range.
+    # Naive values are UTC, as in the stored points (a query may mix both)
+    window = (as_utc(end) - as_utc(start)).total_seconds()
+    if window <= 0:
+        raise ValueError("end must be after start")
+    if window > TELEMETRY_MAX_WINDOW_DAYS * 86400:
+        raise ValueError(f"Window is limited to {TELEMETRY_MAX_WINDOW_DAYS} days")
+    if interval is None:
+        wanted = window / TELEMETRY_DEFAULT_POINTS
+        return next((step for step in NICE_INTERVALS if step >= wanted), math.ceil(wanted))
+    if math.ceil(window / interval) > TELEMETRY_MAX_POINTS:
+        raise ValueError(f"At most {TELEMETRY_MAX_POINTS} points per query; use a larger interval")
+    return interval
+
+def series_pipeline(truck: str, start: datetime, end: datetime, interval: int) -> list:
+    # The match on metaField + timeField only opens buckets in the window
+    group = {
+        "_id": {"$dateTrunc": {"date": "$ts", "unit": "second", "binSize": interval}},
+        "count": {"$sum": 1},
+        "position": {"$bottom": {"sortBy": {"ts": 1}, "output": ["$" + field for field in POSITION_FIELDS]}},
+    }
+    for field in MEASUREMENTS:
+        group[f"{field}_min"] = {"$min": f"${field}"}
+        group[f"{field}_max"] = {"$max": f"${field}"}
+        group[f"{field}_avg"] = {"$avg": f"${field}"}
+    return [
+        {"$match": {"truck": truck, "ts": {"$gte": as_utc(start), "$lt": as_utc(end)}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+def shape_bucket(bucket: dict) -> dict:
+    point = {"t": as_utc(bucket['_id']).isoformat(), "count": bucket['count']}
+    for field in MEASUREMENTS:
+        point[field] = {stat: bucket[f"{field}_{stat}"] for stat in ("min", "max", "avg")}
+    lat, lon = bucket.get('position') or (None, None)
+    point['position'] = {"lat": lat, "lon": lon} if lat is not None and lon is not None else None
+    return point
+
+async def query_series(db, truck: str, start: datetime, end: datetime, interval: int) -> list:
+    cursor = db[TELEMETRY_COLLECTION].aggregate(series_pipeline(truck, start, end, interval))
+    return [shape_bucket(bucket) async for bucket in cursor]
+
+async def latest_readings(db, minutes: int) -> list:
+    # Last reading of every truck that reported within the last `minutes`
+    since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+    pipeline = [
+        {"$match": {"ts": {"$gte": since}}},
+        {"$group": {
+            "_id": "$truck",
+            "reading": {"$bottom": {"sortBy": {"ts": 1}, "output": "$$ROOT"}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    trucks = []
+    async for row in db[TELEMETRY_COLLECTION].aggregate(pipeline):
+        reading = row['reading']
+        trucks.append({
+            "truck_license_plate": row['_id'],
+            "ts": as_utc(reading['ts']).isoformat(),
+            **{field: reading.get(field) for field in MEASUREMENTS + POSITION_FIELDS},
+        })
+    return trucks
@@ -0,0 +1,110 @@
+# Typeahead search over customers, delivery sites, tanks and equipment.
+#
+# Each searchable document carries a `search_terms` array of lowercase prefix
+# keys (the whole value, each word, and the value with punctuation removed).
+# An anchored, case-sensitive regex on a multikey index is a bounded index
+# range scan, so lookups stay fast however large the collections grow.
+# Delivery sites are embedded in users and use `site_search_terms`.
+import asyncio
+import re
+from typing import List
+
+from pymongo import UpdateOne
+
+_WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+
+def normalize(value: str) -> str:
+    return " ".join(str(value).lower().split())
+
+def search_terms(*values) -> List[str]:
+    terms = set()
+    for value in values:
+        if not value:
+            continue
+        text = normalize(value)
+        terms.add(text)
+        terms.add(_WORD_SPLIT.sub("", text))
+        terms.update(_WORD_SPLIT.split(text))
+    terms.discard("")
+    return sorted(terms)
+
+def user_search_fields(user: dict) -> dict:
+    sites = user.get('delivery_sites') or []
+    return {
+        "search_terms": search_terms(user.get('name'), user.get('email')),
+        "site_search_terms": search_terms(*[v for s in sites for v in (s.get('name'), s.get('address'))]),
+    }
+
+def tank_search_terms(tank: dict) -> List[str]:
+    return search_terms(tank.get('name'), tank.get('identifier'))
+
+def equipment_search_terms(equipment: dict) -> List[str]:
+    return search_terms(equipment.get('name'), equipment.get('unit_number'), equipment.get('license_plate'))
+
+def prefix_filter(q: str) -> dict:
+    return {"$regex": "^" + re.escape(normalize(q))}
+
+def _site_matches(site: dict, prefix: str) -> bool:
+    return any(term.startswith(prefix) for term in search_terms(site.get('name'), site.get('address')))
+
+async def typeahead_search(db, q: str, types: List[str], limit: int) -> dict:
+    prefix = normalize(q)
+    match = prefix_filter(q)
+    queries = {}
+    if "customers" in types:
+        queries["customers"] = db.users.find(
+            {"search_terms": match, "role": "customer"},
+            {"_id": 0, "id": 1, "name": 1, "email": 1}
+        ).limit(limit).to_list(limit)
+    if "sites" in types:
+        queries["sites"] = db.users.find(
+            {"site_search_terms": match},
+            {"_id": 0, "id": 1, "name": 1, "delivery_sites": 1}
+        ).limit(limit).to_list(limit)
+    if "tanks" in types:
+        queries["tanks"] = db.fuel_tanks.find(
+            {"search_terms": match},
+            {"_id": 0, "id": 1, "name": 1, "identifier": 1, "user_id": 1, "location_name": 1}
+        ).limit(limit).to_list(limit)
+    if "equipment" in types:
+        queries["equipment"] = db.customer_equipment.find(
+            {"search_terms": match},
+            {"_id": 0, "id": 1, "name": 1, "unit_number": 1, "license_plate": 1, "user_id": 1}
+        ).limit(limit).to_list(limit)
+
+    results = dict(zip(queries.keys(), await asyncio.gather(*queries.values())))
+
+    if "sites" in results:
+        sites = []
+        for user in results["sites"]:
+            for site in user.get('delivery_sites') or []:
+                if _site_matches(site, prefix):
+                    sites.append({
+                        "id": site['id'],
+                        "name": site['name'],
+                        "address": site['address'],
+                        "user_id": user['id'],
+                        "user_name": user['name'],
+                    })
+        results["sites"] = sites[:limit]
+    return results
+
+async def backfill_search_terms(db, batch_size: int = 1000) -> dict:
+    counts = {}
+    for collection, fields, compute in (
+        ("users", {"name": 1, "email": 1, "delivery_sites": 1}, user_search_fields),
+        ("fuel_tanks", {"name": 1, "identifier": 1}, lambda d: {"search_terms": tank_search_terms(d)}),
+        ("customer_equipment", {"name": 1, "unit_number": 1, "license_plate": 1},
+         lambda d: {"search_terms": equipment_search_terms(d)}),
+    ):
+        updated = 0
+        ops = []
+        async for doc in db[collection].find({}, fields).batch_size(batch_size):
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": compute(doc)}))
+            if len(ops) >= batch_size:
+                updated += (await db[collection].bulk_write(ops, ordered=False)).modified_count
+                ops = []
+        if ops:
+            updated += (await db[collection].bulk_write(ops, ordered=False)).modified_count
+        counts[collection] = updated
+    return counts
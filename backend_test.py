@@ -1,7 +1,11 @@
 import requests
 import sys
 import json
-from datetime import datetime
+import csv
+import io
+import zipfile
+import time
+from datetime import datetime, timedelta
 import uuid
 
 class FuelDeliveryAPITester:
@@ -76,6 +80,30 @@ class FuelDeliveryAPITester:
             self.log_test(name, False, f"Exception: {str(e)}")
             return False, {}
 
+    def get_raw(self, name, endpoint, expected_status, headers=None):
+        """GET a non-JSON endpoint (files, exports); returns the requests response"""
+        try:
+            response = requests.get(f"{self.api_url}/{endpoint}", headers=headers or {})
+        except Exception as e:
+            self.log_test(name, False, f"Exception: {str(e)}")
+            return False, None
+        success = response.status_code == expected_status
+        details = f"Status: {response.status_code}, {len(response.content)} bytes"
+        if not success:
+            details += f", Error: {response.text[:200]}"
+        self.log_test(name, success, details)
+        return success, response
+
+    def test_health_probes(self):
+        """Test liveness and readiness probes"""
+        for probe in ("live", "ready"):
+            try:
+                response = requests.get(f"{self.base_url}/health/{probe}")
+                success = response.status_code == 200
+                self.log_test(f"Health {probe}", success, f"Status: {response.status_code}")
+            except Exception as e:
+                self.log_test(f"Health {probe}", False, f"Exception: {str(e)}")
+
     def test_admin_login(self):
         """Test admin login"""
         success, response = self.run_test(
@@ -216,6 +244,47 @@ class FuelDeliveryAPITester:
         )
         return success
 
+    def test_search_bookings(self):
+        """Test server-side booking search with filters and sorting"""
+        if not self.admin_token:
+            self.log_test("Search Bookings", False, "No admin token available")
+            return False
+
+        success, response = self.run_test(
+            "Search Bookings (diesel, >= 100L, by preferred date)",
+            "GET",
+            "bookings/search?fuel_type=diesel&min_liters=100&sort=preferred_date&order=asc&page_size=10",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success:
+            items = response.get('items', [])
+            if any(b['fuel_type'] != 'diesel' or b['fuel_quantity_liters'] < 100 for b in items):
+                self.log_test("Search Bookings Filter", False, "Result does not match filters")
+                return False
+        return success
+
+    def test_search_bookings_date_range(self):
+        """Test date-range search returns bookings in their API shape"""
+        if not self.admin_token:
+            self.log_test("Search Bookings Date Range", False, "No admin token available")
+            return False
+
+        success, response = self.run_test(
+            "Search Bookings (pending/confirmed, preferred date range)",
+            "GET",
+            "bookings/search?status=pending&status=confirmed&preferred_date_from=2024-01-01&preferred_date_to=2030-12-31",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success:
+            for b in response.get('items', []):
+                if b['status'] not in ('pending', 'confirmed') or not isinstance(b['preferred_date'], str) \
+                        or not isinstance(b['created_at'], str) or not isinstance(b['total_price'], float):
+                    self.log_test("Search Bookings Date Range Shape", False, f"Unexpected booking: {b['id']}")
+                    return False
+        return success
+
     def test_update_booking_status(self, booking_id):
         """Test update booking status (admin only)"""
         if not self.admin_token or not booking_id:
@@ -256,6 +325,41 @@ class FuelDeliveryAPITester:
         )
         return success
 
+    def test_bulk_ingest_logs(self, booking_id):
+        """Test NDJSON bulk log upload, including a re-upload of the same lines"""
+        if not self.admin_token or not booking_id:
+            self.log_test("Bulk Ingest Logs", False, "No admin token or booking ID available")
+            return False
+
+        batch = uuid.uuid4().hex[:8]
+        lines = [
+            json.dumps({
+                "client_log_id": f"{batch}-{i}",
+                "booking_id": booking_id,
+                "truck_license_plate": "TRUCK-001",
+                "driver_name": "John Driver",
+                "liters_delivered": 100.0 + i,
+                "delivery_time": "2024-12-31T10:00:00+00:00"
+            })
+            for i in range(3)
+        ] + ["not json"]
+        body = "\n".join(lines).encode()
+        headers = {"Authorization": f"Bearer {self.admin_token}", "Content-Type": "application/x-ndjson"}
+
+        try:
+            first = requests.post(f"{self.api_url}/logs/bulk", data=body, headers=headers).json()
+            second = requests.post(f"{self.api_url}/logs/bulk", data=body, headers=headers).json()
+        except Exception as e:
+            self.log_test("Bulk Ingest Logs", False, f"Exception: {str(e)}")
+            return False
+
+        success = (first.get('created'), first.get('error')) == (3, 1) and second.get('duplicate') == 3
+        self.log_test(
+            "Bulk Ingest Logs", success,
+            f"First: {first.get('created')} created, {first.get('error')} errors; re-upload: {second.get('duplicate')} duplicates"
+        )
+        return success
+
     def test_get_delivery_logs(self):
         """Test get delivery logs (admin only)"""
         if not self.admin_token:
@@ -301,6 +405,458 @@ class FuelDeliveryAPITester:
         )
         return success
 
+    def test_get_admin_metrics(self):
+        """Test get admin runtime metrics (Mongo pool statistics)"""
+        if not self.admin_token:
+            self.log_test("Get Admin Metrics", False, "No admin token available")
+            return False
+
+        success, response = self.run_test(
+            "Get Admin Metrics",
+            "GET",
+            "admin/metrics",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success and 'stats' not in response.get('mongo_pool', {}):
+            self.log_test("Admin Metrics Pool Stats", False, "mongo_pool.stats missing")
+            return False
+        classes = response.get('admission', {}).get('classes', {}) if success else {}
+        missing = {"read", "write", "auth", "heavy", "stream"} - set(classes)
+        counters = {"concurrency", "queue_size", "active", "waiting", "admitted", "rejected", "timed_out"}
+        if success and (missing or any(counters - set(c) for c in classes.values())):
+            self.log_test("Admin Metrics Admission Classes", False, f"Missing classes {sorted(missing)} or counters")
+            return False
+        if success and classes['read']['admitted'] < 1:
+            self.log_test("Admin Metrics Admission Classes", False, "read class has admitted no requests")
+            return False
+        routing = response.get('read_routing', {}) if success else {}
+        if success and routing.get('primary', {}).get('read_preference', {}).get('mode') != 'primary':
+            self.log_test("Admin Metrics Read Routing", False, f"Unexpected read routing: {routing}")
+            return False
+        return success
+
+    def test_background_invoice_pdf(self, booking_id):
+        """Test queueing an invoice PDF render and polling the job"""
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        success, response = self.run_test(
+            "Queue Invoice PDF Job",
+            "POST",
+            f"invoices/{booking_id}/export-pdf",
+            202,
+            headers=headers
+        )
+        if not success or 'id' not in response:
+            return False
+
+        job = response
+        for _ in range(30):
+            success, job = self.run_test("Get Job Status", "GET", f"jobs/{response['id']}", 200, headers=headers)
+            if not success or job.get('status') in ("succeeded", "failed"):
+                break
+            time.sleep(1)
+        success = success and job.get('status') == "succeeded"
+        self.log_test("Invoice PDF Job Succeeded", success, f"Status: {job.get('status')}, error: {job.get('error')}")
+        return success
+
+    def test_export_invoices_zip(self):
+        """Test the invoice ZIP export for a status filter"""
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        success, search = self.run_test(
+            "Search Confirmed Bookings For ZIP", "GET", "bookings/search?status=confirmed&page_size=200", 200, headers=headers
+        )
+        if not success:
+            return False
+        success, response = self.get_raw("Export Invoices ZIP", "admin/invoices/export-zip?status=confirmed", 200, headers=headers)
+        if not success:
+            return False
+        try:
+            names = set(zipfile.ZipFile(io.BytesIO(response.content)).namelist())
+        except zipfile.BadZipFile as e:
+            self.log_test("Invoice ZIP Opens", False, str(e))
+            return False
+        expected = {f"invoice_{booking['id']}.pdf" for booking in search['items']}
+        success = bool(expected) and names == expected and "errors.txt" not in names
+        self.log_test("Invoice ZIP Entries", success, f"{len(names)} entries, {len(expected)} confirmed bookings")
+        return success
+
+    def upload_image(self, name, booking_id, content):
+        """Upload invoice image bytes as admin; returns the stored filename or None"""
+        try:
+            response = requests.post(
+                f"{self.api_url}/invoices/{booking_id}/upload-image",
+                files={"file": ("photo.jpg", content, "image/jpeg")},
+                headers={"Authorization": f"Bearer {self.admin_token}"}
+            )
+        except Exception as e:
+            self.log_test(name, False, f"Exception: {str(e)}")
+            return None
+        success = response.status_code == 200
+        self.log_test(name, success, f"Status: {response.status_code}, Response: {response.text[:200]}")
+        return response.json()['filename'] if success else None
+
+    def test_invoice_image_headers(self, booking_id):
+        """Test the ETag, 304 and byte-range handling of invoice images"""
+        content = uuid.uuid4().bytes * 4
+        filename = self.upload_image("Upload Invoice Image", booking_id, content)
+        if not filename:
+            return False
+        endpoint = f"invoices/{booking_id}/images/{filename}"
+        success, response = self.get_raw("Get Invoice Image", endpoint, 200)
+        if not success:
+            return False
+        etag = response.headers.get('etag')
+        success = response.content == content and etag == f'"{filename.split(".")[0]}"'
+        self.log_test("Invoice Image ETag Is The Digest", success, f"ETag: {etag}")
+        if not success:
+            return False
+
+        success, _ = self.get_raw("Invoice Image Not Modified", endpoint, 304, headers={"If-None-Match": etag})
+        if not success:
+            return False
+        success, response = self.get_raw("Invoice Image Range", endpoint, 206, headers={"Range": "bytes=0-9"})
+        if not success:
+            return False
+        content_range = response.headers.get('content-range')
+        success = content_range == f"bytes 0-9/{len(content)}" and response.content == content[:10]
+        self.log_test("Invoice Image Content-Range", success, f"Content-Range: {content_range}")
+        if not success:
+            return False
+        success, _ = self.get_raw(
+            "Invoice Image Unsatisfiable Range", endpoint, 416, headers={"Range": f"bytes={len(content)}-"}
+        )
+        return success
+
+    def test_shared_invoice_image(self, first_booking_id, second_booking_id):
+        """Test that identical uploads share one file until the last reference is deleted"""
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        content = uuid.uuid4().bytes * 4
+        first = self.upload_image("Upload Image To First Booking", first_booking_id, content)
+        second = self.upload_image("Upload Same Image To Second Booking", second_booking_id, content)
+        if not first or not second:
+            return False
+        success = first == second
+        self.log_test("Identical Uploads Share A Filename", success, f"{first} / {second}")
+        if not success:
+            return False
+
+        success, _ = self.run_test(
+            "Delete Image From First Booking", "DELETE", f"invoices/{first_booking_id}/images/{first}", 200, headers=headers
+        )
+        if not success:
+            return False
+        success, response = self.get_raw(
+            "Shared Image Still Served", f"invoices/{second_booking_id}/images/{second}", 200
+        )
+        if not success or response.content != content:
+            return False
+        success, _ = self.run_test(
+            "Delete Image From Second Booking", "DELETE", f"invoices/{second_booking_id}/images/{second}", 200, headers=headers
+        )
+        if not success:
+            return False
+        success, _ = self.get_raw("Unreferenced Image Removed", f"invoices/{second_booking_id}/images/{second}", 404)
+        return success
+
+    def test_monthly_statement(self):
+        """Test the customer's monthly statement PDF"""
+        success, response = self.get_raw(
+            "Monthly Statement PDF",
+            f"statements/{self.customer_id}/2024-12",
+            200,
+            headers={"Authorization": f"Bearer {self.customer_token}"}
+        )
+        if not success:
+            return False
+        success = response.headers.get('content-type', '').startswith("application/pdf") and response.content.startswith(b"%PDF-")
+        self.log_test("Monthly Statement Is A PDF", success, f"Content-Type: {response.headers.get('content-type')}")
+        return success
+
+    def test_truck_telemetry(self):
+        """Test telemetry upload and a downsampled series query"""
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        plate = f"TEST-{uuid.uuid4().hex[:6]}"
+        start = datetime.utcnow().replace(microsecond=0)
+        readings = [
+            {"ts": (start + timedelta(seconds=i)).isoformat(), "meter_liters": 1000.0 + i, "flow_rate_lpm": 60.0,
+             "lat": 45.5, "lon": -73.6}
+            for i in range(120)
+        ]
+        success, _ = self.run_test(
+            "Upload Truck Telemetry", "POST", "telemetry", 200,
+            data={"truck_license_plate": plate, "readings": readings}, headers=headers
+        )
+        if not success:
+            return False
+
+        end = start + timedelta(seconds=120)
+        success, response = self.run_test(
+            "Get Downsampled Telemetry",
+            "GET",
+            f"telemetry/{plate}/series?start={start.isoformat()}&end={end.isoformat()}&interval=60",
+            200,
+            headers=headers
+        )
+        if success:
+            points = response.get('points', [])
+            success = sum(p['count'] for p in points) == 120 and len(points) <= 3
+            self.log_test("Telemetry Downsampling", success, f"{len(points)} points")
+        if not success:
+            return False
+
+        # Offset-aware start with a naive (UTC) end
+        success, response = self.run_test(
+            "Get Telemetry With Mixed Timezones",
+            "GET",
+            f"telemetry/{plate}/series?start={start.isoformat()}Z&end={end.isoformat()}&interval=60",
+            200,
+            headers=headers
+        )
+        if success:
+            success = sum(p['count'] for p in response.get('points', [])) == 120
+            self.log_test("Telemetry Mixed Timezones", success, f"{len(response.get('points', []))} points")
+        return success
+
+    def test_dispatch_plan_preview(self):
+        """Test dispatch planning preview (nothing is written without commit)"""
+        success, response = self.run_test(
+            "Dispatch Plan Preview",
+            "POST",
+            "admin/dispatch/plan",
+            200,
+            data={"date": "2024-12-31", "truck_capacity_liters": 30000},
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success:
+            overloaded = [r['run_id'] for r in response.get('runs', []) if r['load_liters'] > r['capacity_liters']]
+            success = not overloaded
+            self.log_test("Dispatch Runs Within Capacity", success, f"{len(response.get('runs', []))} runs")
+        return success
+
+    def test_idempotent_booking(self):
+        """Test that a retried booking with the same Idempotency-Key is not created twice"""
+        booking_data = {
+            "delivery_address": "123 Test Street, Montreal, QC",
+            "fuel_quantity_liters": 750.0,
+            "fuel_type": "diesel",
+            "preferred_date": "2024-12-31",
+            "preferred_time": "10:00"
+        }
+        headers = {
+            "Authorization": f"Bearer {self.customer_token}",
+            "Idempotency-Key": str(uuid.uuid4())
+        }
+        success, first = self.run_test("Idempotent Booking", "POST", "bookings", 200, data=booking_data, headers=headers)
+        if not success:
+            return False
+        success, retry = self.run_test("Idempotent Booking Retry", "POST", "bookings", 200, data=booking_data, headers=headers)
+        if success and retry.get('id') != first.get('id'):
+            self.log_test("Idempotent Booking Replay", False, "Retry created a second booking")
+            return False
+        if not success:
+            return False
+        success, _ = self.run_test(
+            "Idempotency-Key Reused With Different Body",
+            "POST",
+            "bookings",
+            422,
+            data={**booking_data, "fuel_quantity_liters": 800.0},
+            headers=headers
+        )
+        return success
+
+    def test_customer_overview(self):
+        """Test the admin customer overview with joined counts"""
+        success, response = self.run_test(
+            "Customer Overview (Admin)",
+            "GET",
+            "admin/customers/overview?sort=bookings&order=desc&page_size=20",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if not success:
+            return False
+        if any('password' in row for row in response['items']):
+            self.log_test("Customer Overview Password", False, "password field returned")
+            return False
+        counts = [row['bookings'] for row in response['items']]
+        if counts != sorted(counts, reverse=True):
+            self.log_test("Customer Overview Sort", False, f"Not sorted by bookings: {counts}")
+            return False
+        return True
+
+    def test_tanks_due_soon(self):
+        """Test the refill forecast listing for the customer's tanks"""
+        success, response = self.run_test(
+            "Tanks Due Soon (Customer)",
+            "GET",
+            "fuel-tanks/due-soon?days=14",
+            200,
+            headers={"Authorization": f"Bearer {self.customer_token}"}
+        )
+        if success and any(f.get('user_id') != self.customer_id for f in response):
+            self.log_test("Tanks Due Soon Scope", False, "Forecast for another customer's tank returned")
+            return False
+        return success
+
+    def test_export_bookings(self):
+        """Test the streaming CSV/Parquet export: filters, formats and customer scoping"""
+        admin = {"Authorization": f"Bearer {self.admin_token}"}
+        customer = {"Authorization": f"Bearer {self.customer_token}"}
+        success, search = self.run_test(
+            "Search Pending Bookings For Export", "GET", "bookings/search?status=pending&page_size=200", 200, headers=admin
+        )
+        if not success:
+            return False
+
+        success, response = self.get_raw("Export Bookings CSV", "bookings/export?format=csv&status=pending", 200, headers=admin)
+        if not success:
+            return False
+        rows = list(csv.reader(io.StringIO(response.text)))
+        header, rows = rows[0], rows[1:]
+        status_column = header.index('status') if 'status' in header else None
+        success = (
+            header[:2] == ["id", "user_id"] and status_column is not None
+            and len(rows) == search['total'] and all(row[status_column] == "pending" for row in rows)
+        )
+        self.log_test("Export CSV Filtered Rows", success, f"{len(rows)} rows, {search['total']} pending bookings")
+        if not success:
+            return False
+
+        success, response = self.get_raw(
+            "Export Bookings Parquet", "bookings/export?format=parquet&status=pending", 200, headers=admin
+        )
+        if not success:
+            return False
+        try:
+            import pyarrow.parquet as pq
+            table = pq.read_table(io.BytesIO(response.content))
+            success = table.num_rows == search['total'] and set(table.column('status').to_pylist()) <= {"pending"}
+            details = f"{table.num_rows} rows"
+        except Exception as e:
+            success, details = False, f"Unreadable Parquet: {e}"
+        self.log_test("Export Parquet Reads Back", success, details)
+        if not success:
+            return False
+
+        success, own = self.run_test("Get Customer Bookings For Export", "GET", "bookings", 200, headers=customer)
+        if not success:
+            return False
+        success, response = self.get_raw("Export Bookings CSV (Customer)", "bookings/export?format=csv", 200, headers=customer)
+        if not success:
+            return False
+        reader = csv.DictReader(io.StringIO(response.text))
+        user_ids = [row['user_id'] for row in reader]
+        success = len(user_ids) == len(own) and set(user_ids) <= {self.customer_id}
+        self.log_test("Export Scoped To Customer", success, f"{len(user_ids)} rows, {len(own)} own bookings")
+        return success
+
+    def test_pricing_history(self):
+        """Test pricing version history and point-in-time lookup"""
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        success, history = self.run_test("Pricing History", "GET", "pricing/history", 200, headers=headers)
+        if not success or not history:
+            return False
+
+        success, response = self.run_test(
+            "Pricing As Of Current Version",
+            "GET",
+            f"pricing/as-of?at={history[0]['effective_from'].replace('+', '%2B')}",
+            200,
+            headers=headers
+        )
+        if success and response.get('version') != history[0]['version']:
+            self.log_test("Pricing As Of Version", False, f"Expected {history[0]['version']}, got {response.get('version')}")
+            return False
+        return success
+
+    def test_get_booking_expanded(self, booking_id):
+        """Test resolving tank/equipment references with ?expand="""
+        success, response = self.run_test(
+            "Get Booking (expand tanks, equipment)",
+            "GET",
+            f"bookings/{booking_id}?expand=tanks,equipment",
+            200,
+            headers={"Authorization": f"Bearer {self.customer_token}"}
+        )
+        if success and response.get('selected_tanks') and 'capacity' not in response['selected_tanks'][0]:
+            self.log_test("Expanded Tank Documents", False, "selected_tanks not expanded")
+            return False
+        return success
+
+    def test_price_quote(self):
+        """Test batch price quotes against the single-booking price"""
+        success, response = self.run_test(
+            "Batch Price Quote",
+            "POST",
+            "pricing/quote",
+            200,
+            data={"lines": [{"liters": 1000}, {"liters": 250.5, "price_modifier": 0.05}]},
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success and response.get('count') != 2:
+            self.log_test("Batch Price Quote Count", False, f"Expected 2 quotes, got {response.get('count')}")
+            return False
+        if not success:
+            return False
+
+        # A quote for the customer must price exactly like their booking
+        liters = 437.25
+        success, booking = self.run_test(
+            "Booking For Quote Comparison",
+            "POST",
+            "bookings",
+            200,
+            data={
+                "delivery_address": "123 Test Street, Montreal, QC",
+                "fuel_quantity_liters": liters,
+                "fuel_type": "diesel",
+                "preferred_date": "2024-12-31",
+                "preferred_time": "10:00"
+            },
+            headers={"Authorization": f"Bearer {self.customer_token}"}
+        )
+        if not success:
+            return False
+        success, response = self.run_test(
+            "Customer Price Quote",
+            "POST",
+            "pricing/quote",
+            200,
+            data={"lines": [{"liters": liters, "customer_id": self.customer_id}]},
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if not success:
+            return False
+        quote, rates = response['quotes'][0], response['pricing']
+        taxes = round(quote['gst_amount'] + quote['qst_amount'], 2)
+        booking_taxes = round(booking['total_price'] - booking['subtotal'], 2)
+        mismatches = [
+            field for field in ('subtotal', 'total_price', 'fuel_price_per_liter') if quote[field] != booking[field]
+        ] + [
+            rate for rate in ('federal_carbon_tax', 'quebec_carbon_tax', 'gst_rate', 'qst_rate') if rates[rate] != booking[rate]
+        ]
+        if abs(taxes - booking_taxes) > 0.011:
+            mismatches.append(f"taxes {taxes} != {booking_taxes}")
+        success = not mismatches
+        self.log_test("Quote Matches Booking Price", success, f"Mismatched: {mismatches}" if mismatches else f"Total: {quote['total_price']}")
+        return success
+
+    def test_revenue_analytics(self):
+        """Test revenue/volume rollup query"""
+        if not self.admin_token:
+            self.log_test("Revenue Analytics", False, "No admin token available")
+            return False
+
+        success, response = self.run_test(
+            "Revenue Analytics (monthly by fuel type)",
+            "GET",
+            "analytics/revenue?start=2020-01-01&end=2030-12-31&granularity=month&group_by=fuel_type",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        return success
+
     # New Multi-Select and Admin Resource Management Tests
     
     def test_create_customer_tanks(self):
@@ -602,6 +1158,20 @@ class FuelDeliveryAPITester:
         )
         return success
 
+    def test_admin_typeahead_search(self):
+        """Test admin typeahead search over customers, sites, tanks and equipment"""
+        success, response = self.run_test(
+            "Admin Typeahead Search",
+            "GET",
+            "admin/search?q=test&limit=5",
+            200,
+            headers={"Authorization": f"Bearer {self.admin_token}"}
+        )
+        if success and set(response.keys()) != {"customers", "sites", "tanks", "equipment"}:
+            self.log_test("Admin Typeahead Result Types", False, f"Unexpected keys: {list(response.keys())}")
+            return False
+        return success
+
     def test_admin_get_all_equipment(self):
         """Test admin can get all customers' equipment"""
         if not self.admin_token:
@@ -788,6 +1358,10 @@ class FuelDeliveryAPITester:
         print(f"Testing against: {self.base_url}")
         print("=" * 80)
 
+        # Health Probe Tests
+        print("\n💓 Health Probe Tests")
+        self.test_health_probes()
+
         # Authentication Tests
         print("\n📝 Authentication Tests")
         admin_login_success = self.test_admin_login()
@@ -819,6 +1393,7 @@ class FuelDeliveryAPITester:
             success, booking_id = self.test_multi_select_booking_both()
             if success:
                 multi_booking_ids.append(booking_id)
+                self.test_get_booking_expanded(booking_id)
 
         # Backward Compatibility Tests
         print("\n🔄 Backward Compatibility Tests")
@@ -836,6 +1411,7 @@ class FuelDeliveryAPITester:
             self.test_admin_get_all_equipment()
             self.test_admin_create_equipment()
             self.test_admin_update_equipment()
+            self.test_admin_typeahead_search()
 
         # Security Tests
         print("\n🔒 Security Tests")
@@ -855,6 +1431,8 @@ class FuelDeliveryAPITester:
 
         if admin_login_success:
             self.test_get_bookings_admin()
+            self.test_search_bookings()
+            self.test_search_bookings_date_range()
             if len(multi_booking_ids) > 0:
                 self.test_update_booking_status(multi_booking_ids[0])
                 booking_id = multi_booking_ids[0]
@@ -863,15 +1441,34 @@ class FuelDeliveryAPITester:
         print("\n🚛 Delivery Log Tests")
         if admin_login_success and booking_id:
             self.test_create_delivery_log(booking_id)
+            self.test_bulk_ingest_logs(booking_id)
             self.test_get_delivery_logs()
             
         if customer_login_success and booking_id:
             self.test_get_logs_by_booking(booking_id)
+            self.test_monthly_statement()
+
+        if admin_login_success and booking_id:
+            self.test_background_invoice_pdf(booking_id)
+            self.test_export_invoices_zip()
+            self.test_invoice_image_headers(booking_id)
+            if len(multi_booking_ids) > 1:
+                self.test_shared_invoice_image(multi_booking_ids[0], multi_booking_ids[1])
 
         # Admin Stats Tests
         print("\n📊 Admin Statistics Tests")
         if admin_login_success:
             self.test_get_admin_stats()
+            self.test_get_admin_metrics()
+            self.test_revenue_analytics()
+            self.test_export_bookings()
+            self.test_price_quote()
+            self.test_pricing_history()
+            self.test_truck_telemetry()
+            self.test_dispatch_plan_preview()
+            self.test_tanks_due_soon()
+            self.test_customer_overview()
+            self.test_idempotent_booking()
 
         # Cleanup Tests
         print("\n🧹 Cleanup Tests")
@@ -0,0 +1,71 @@
+"""Tank refill forecasting benchmark.
+
+Generates N synthetic tanks (default 100k) with a random number of refills
+each, fits every tank's consumption rate with forecasting.fit_consumption /
+predict_refills (the vectorized path behind the tank_forecast job) and
+reports the time per stage, plus the error of the fitted rates against the
+rates the refills were generated from.
+
+    python benchmarks/bench_forecast.py [--tanks 100000] [--refills 24]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("FORECAST_HALF_LIFE_DAYS", "90")
+
+import numpy as np  # noqa: E402
+
+from forecasting import fit_consumption, predict_refills  # noqa: E402
+
+
+def make_refills(tanks: int, refills: int, seed: int):
+    rng = np.random.default_rng(seed)
+    rates = rng.uniform(5, 500, tanks)
+    capacity = np.where(rng.random(tanks) < 0.8, rng.choice([500.0, 1000.0, 5000.0, 20000.0], tanks), np.nan)
+    counts = rng.integers(1, refills * 2, tanks)
+    tank = np.repeat(np.arange(tanks), counts)
+    # Refill i of a tank comes gap_i days after refill i - 1 and replaces
+    # what was consumed in between (+-5%)
+    gaps = rng.uniform(3, 30, tank.size)
+    elapsed = np.cumsum(gaps)
+    first = np.r_[0, np.cumsum(counts)[:-1]]
+    t = 19_000 + elapsed - np.repeat(elapsed[first], counts)
+    liters = gaps * rates[tank] * rng.normal(1, 0.05, tank.size)
+    # Shuffled, as rows arrive from the bookings cursor
+    order = rng.permutation(tank.size)
+    return tank[order], t[order], liters[order], capacity, rates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tanks", type=int, default=100_000)
+    parser.add_argument("--refills", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tank, t, liters, capacity, rates = make_refills(args.tanks, args.refills, args.seed)
+    now = float(t.max()) + 1
+
+    start = time.perf_counter()
+    fit = fit_consumption(tank, t, liters, args.tanks, now)
+    fit_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    prediction = predict_refills(fit, capacity, now)
+    predict_ms = (time.perf_counter() - start) * 1000
+
+    print(f"tanks: {args.tanks:,}  refills: {tank.size:,}")
+    print(f"fit consumption   {fit_ms:8.1f} ms")
+    print(f"predict refills   {predict_ms:8.1f} ms")
+    valid = prediction['valid']
+    error = np.abs(fit['rate'][valid] / rates[valid] - 1)
+    print(f"forecasts         {int(valid.sum()):,}  (others have fewer than two refills)")
+    print(f"rate error        median {np.median(error):.2%}, p99 {np.percentile(error, 99):.2%}")
+
+
+if __name__ == "__main__":
+    main()
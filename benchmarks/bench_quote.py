@@ -0,0 +1,92 @@
+"""Batch price-quote benchmark.
+
+Prices N random quote lines (default 100k) with the per-booking scalar path
+(pricing.booking_price, as used by create_booking) and with the vectorized
+path behind POST /api/pricing/quote, checks that subtotal and total_price
+are identical for every line, and reports the time spent in each stage of
+the endpoint (request validation, pricing, row building, JSON encoding).
+
+    python benchmarks/bench_quote.py [--lines 100000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench_quote")
+os.environ.setdefault("QUOTE_MAX_LINES", "1000000")
+
+import numpy as np  # noqa: E402
+
+from pricing import booking_price, quote_columns, quote_rows  # noqa: E402
+from server import DEFAULT_PRICING, QuoteRequest  # noqa: E402
+
+
+def make_body(lines: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    modifiers = [round(rng.uniform(-0.2, 0.3), 4) for _ in range(50)]
+    return json.dumps({"lines": [
+        {"liters": round(rng.uniform(0.5, 50000), rng.choice((0, 1, 3))), "price_modifier": rng.choice(modifiers)}
+        for _ in range(lines)
+    ]}).encode()
+
+
+def timed(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    pricing = DEFAULT_PRICING
+    body = make_body(args.lines, args.seed)
+    request, parse_ms = timed(lambda: QuoteRequest.model_validate_json(body), args.runs)
+    liters = np.fromiter((line.liters for line in request.lines), dtype=np.float64, count=len(request.lines))
+    modifiers = np.array([line.price_modifier for line in request.lines], dtype=np.float64)
+
+    scalar, scalar_ms = timed(
+        lambda: [booking_price(pricing, line.liters, line.price_modifier) for line in request.lines], args.runs
+    )
+    columns, vector_ms = timed(lambda: quote_columns(pricing, liters, modifiers), args.runs)
+    rows, rows_ms = timed(lambda: quote_rows(columns), args.runs)
+    _, encode_ms = timed(lambda: json.dumps({"quotes": rows}).encode(), args.runs)
+
+    mismatches = sum(
+        1 for s, row in zip(scalar, rows)
+        if s['subtotal'] != row['subtotal'] or s['total_price'] != row['total_price']
+    )
+    # Lines that np.round (instead of round_cents) would have priced differently
+    subtotal = liters * (pricing['rack_price'] + modifiers) + liters * pricing['federal_carbon_tax'] + liters * pricing['quebec_carbon_tax']
+    total = subtotal + subtotal * pricing['gst_rate'] + subtotal * pricing['qst_rate']
+    naive = sum(
+        1 for s, sub, tot in zip(scalar, np.round(subtotal, 2).tolist(), np.round(total, 2).tolist())
+        if s['subtotal'] != sub or s['total_price'] != tot
+    )
+
+    print(f"lines: {args.lines:,}  (request body {len(body) / 1e6:.1f} MB)")
+    print(f"validate request      {parse_ms:8.1f} ms")
+    print(f"scalar booking_price  {scalar_ms:8.1f} ms")
+    print(f"vectorized pricing    {vector_ms:8.1f} ms   ({scalar_ms / vector_ms:.0f}x)")
+    print(f"build rows            {rows_ms:8.1f} ms")
+    print(f"encode JSON           {encode_ms:8.1f} ms")
+    print(f"subtotal/total mismatches vs scalar: {mismatches}  (with np.round: {naive})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Read routing check against a replica set.
+
+Runs the same read through each profile from mongo_pool.read_databases (with
+the MONGO_READ_* settings of the environment) and reports which members
+served it, plus the average latency per profile. Start a local replica set
+first, e.g.
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0 &
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs1 &
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}]})'
+
+    MONGO_URL=mongodb://localhost:27017,localhost:27018/?replicaSet=rs0 \\
+        python benchmarks/bench_read_routing.py [--reads 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import monitoring  # noqa: E402
+
+from mongo_pool import read_databases, read_routing_metrics  # noqa: E402
+
+
+class ServedBy(monitoring.CommandListener):
+    def __init__(self):
+        self.servers = Counter()
+
+    def started(self, event):
+        if event.command_name == "find":
+            self.servers["%s:%s" % event.connection_id] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--db", default="read_routing_check")
+    args = parser.parse_args()
+
+    served = ServedBy()
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), event_listeners=[served])
+    databases = read_databases(client, args.db)
+    await databases["primary"].bookings.insert_one({"id": "read-routing-check"})
+    primary = (await client.admin.command("hello")).get("primary")
+    print(f"primary: {primary}")
+    for profile, settings in read_routing_metrics(databases).items():
+        served.servers.clear()
+        start = time.perf_counter()
+        for _ in range(args.reads):
+            await databases[profile].bookings.find_one({"id": "read-routing-check"})
+        ms = (time.perf_counter() - start) * 1000 / args.reads
+        print(f"{profile:10s} {settings['read_preference']}  concern={settings['read_concern']}  {ms:.2f} ms/read")
+        for server, count in served.servers.most_common():
+            print(f"    {server}{' (primary)' if server == primary else ''}: {count}")
+    await client.drop_database(args.db)
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Worker cold-start benchmark.
+
+Imports backend/server.py in fresh interpreters and reports wall time and peak
+RSS. The "eager" variant imports the ReportLab modules before server.py, which
+is what every worker paid before invoice rendering moved to invoice_pdf.py.
+
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+EAGER_IMPORTS = """
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage
+from reportlab.lib.units import inch
+"""
+
+PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+{preload}
+import server
+elapsed = time.perf_counter() - t0
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "reportlab_loaded": "reportlab" in sys.modules,
+}}))
+"""
+
+
+def run_once(preload: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "bench_startup")
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(preload=preload)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # Warm the OS page cache so both variants read .pyc files from memory
+    run_once(EAGER_IMPORTS)
+
+    for label, preload in (("lazy (current)", ""), ("eager reportlab", EAGER_IMPORTS)):
+        samples = [run_once(preload) for _ in range(args.runs)]
+        seconds = [s["seconds"] * 1000 for s in samples]
+        rss = [s["max_rss_kb"] / 1024 for s in samples]
+        print(
+            f"{label:16s} import server: median {statistics.median(seconds):7.1f} ms "
+            f"(min {min(seconds):.1f}), peak RSS {statistics.median(rss):6.1f} MiB, "
+            f"reportlab loaded: {samples[0]['reportlab_loaded']}"
+        )
+
+
+if __name__ == "__main__":
+    main()